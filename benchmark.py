@@ -0,0 +1,258 @@
+"""
+离线基准：在本地模拟的 Graph（fake_graph.py）上运行 keepalive 与 delete_groups，
+报告耗时、请求数与内存峰值，便于在不接触真实租户的情况下衡量性能改动。
+
+startup 场景在全新进程中分别以冷启动（无缓存）与热启动（令牌、授权元数据、拓扑缓存已存在）
+测量导入耗时、客户端初始化（含授权发现）与首个 Graph 请求的延迟。
+
+示例：
+    python benchmark.py --groups 10,1000 --tasks 5000 --latency-ms 20
+    python benchmark.py --scenario delete_groups --groups 10000 --json result.json
+    python benchmark.py --scenario startup --latency-ms 50
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _start_fake_graph(args: argparse.Namespace, groups: int) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        os.path.join(HERE, "fake_graph.py"),
+        "--groups", str(groups),
+        "--tasks", str(args.tasks),
+        "--plan-ratio", str(args.plan_ratio),
+        "--page-size", str(args.page_size),
+        "--latency-ms", str(args.latency_ms),
+        "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate),
+        "--retry-after", str(args.retry_after),
+        "--seed", str(args.seed),
+        # MSAL only accepts https authorities, so the fake always serves a throwaway certificate.
+        "--tls",
+    ]
+    # The server runs in its own process so its memory and GIL do not skew the numbers.
+    return subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+
+
+def _configure_env(url: str, certfile: str, state_dir: str, args: argparse.Namespace) -> None:
+    os.environ.update(
+        {
+            "CLIENT_ID": "bench-client",
+            "CLIENT_SECRET": "bench-secret",
+            "TENANT_ID": "fake-tenant",
+            "USER_EMAIL": "user@example.com",
+            "NOTIFICATION_EMAIL": "user@example.com",
+            "APP_SCOPE": "https://graph.microsoft.com/.default",
+            "DELEGATED_SCOPES": "User.Read",
+            "MAIL_PLAN_TITLE": "邮箱检查",
+            "AUTH_MODE": "app",
+            "REQUEST_TIMEOUT_SECONDS": str(args.request_timeout),
+            "MAX_DELETE_PER_RUN": str(args.max_delete),
+            "CLEANUP_TIME_BUDGET_SECONDS": str(args.cleanup_budget),
+            "ENABLE_OLD_CLEANUP": "true",
+            "GRAPH_BASE_URL": f"{url}/v1.0/",
+            "AUTHORITY_HOST": url,
+            "MSAL_INSTANCE_DISCOVERY": "false",
+            "TOKEN_CACHE_PATH": os.path.join(state_dir, "token_cache.json"),
+            "MSAL_HTTP_CACHE_PATH": os.path.join(state_dir, "http_cache.bin"),
+            "TOPOLOGY_CACHE_PATH": os.path.join(state_dir, "topology.json"),
+            "CLEANUP_CURSOR_PATH": os.path.join(state_dir, "cleanup_cursor.json"),
+            "USER_ID_CACHE_PATH": os.path.join(state_dir, "user_ids.json"),
+            "METRICS_JSON_PATH": os.path.join(state_dir, "metrics.json"),
+            "INBOX_STATE_PATH": os.path.join(state_dir, "inbox_state.json"),
+        }
+    )
+    os.environ["REQUESTS_CA_BUNDLE"] = certfile
+
+
+def _run_keepalive() -> None:
+    from planner_agent import run_keepalive_cycle
+
+    run_keepalive_cycle()
+
+
+def _run_delete_groups() -> None:
+    from config import load_settings
+    from planner_agent import PlannerAgent
+
+    PlannerAgent(load_settings()).delete_all_planner_groups()
+
+
+SCENARIOS: Dict[str, Callable[[], None]] = {
+    "keepalive": _run_keepalive,
+    "delete_groups": _run_delete_groups,
+}
+
+# Runs in a fresh interpreter so module imports and MSAL discovery are really cold.
+STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+from config import load_settings
+from planner_agent import PlannerAgent
+imported = time.perf_counter()
+agent = PlannerAgent(load_settings())
+initialised = time.perf_counter()
+agent.client.get("groups", params={"$top": 1})
+finished = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "init_seconds": initialised - imported,
+    "first_request_seconds": finished - initialised,
+}))
+"""
+
+
+def run_scenario(name: str, groups: int, args: argparse.Namespace) -> Dict:
+    server = _start_fake_graph(args, groups)
+    try:
+        url = server.stdout.readline().strip()
+        certfile = server.stdout.readline().strip()
+        with tempfile.TemporaryDirectory(prefix="graph-bench-") as state_dir:
+            _configure_env(url, certfile, state_dir, args)
+            requests.post(f"{url}/_fake/reset", verify=certfile, timeout=10)
+
+            output = io.StringIO()
+            error = None
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(output):
+                    SCENARIOS[name]()
+            except Exception as exc:
+                error = str(exc)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            stats = requests.get(f"{url}/_fake/stats", verify=certfile, timeout=10).json()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    requests_by_route = stats["requests"]
+    return {
+        "scenario": name,
+        "groups": groups,
+        "tasks": args.tasks,
+        "wall_seconds": round(elapsed, 3),
+        "requests": requests_by_route.get("total", 0),
+        "batched_requests": requests_by_route.get("batched", 0),
+        "bytes_received": stats.get("bytes_sent", 0),
+        "peak_memory_mb": round(peak / (1024 * 1024), 2),
+        "by_route": requests_by_route,
+        "error": error,
+        "output_tail": output.getvalue().splitlines()[-3:],
+    }
+
+
+def run_startup(groups: int, args: argparse.Namespace) -> List[Dict]:
+    server = _start_fake_graph(args, groups)
+    results = []
+    try:
+        url = server.stdout.readline().strip()
+        certfile = server.stdout.readline().strip()
+        with tempfile.TemporaryDirectory(prefix="graph-bench-") as state_dir:
+            _configure_env(url, certfile, state_dir, args)
+            # The second run finds the caches the first one wrote.
+            for phase in ("cold", "warm"):
+                requests.post(f"{url}/_fake/reset", verify=certfile, timeout=10)
+                start = time.perf_counter()
+                completed = subprocess.run(
+                    [sys.executable, "-c", STARTUP_PROBE],
+                    cwd=HERE,
+                    capture_output=True,
+                    text=True,
+                    timeout=120,
+                )
+                elapsed = time.perf_counter() - start
+                stats = requests.get(f"{url}/_fake/stats", verify=certfile, timeout=10).json()
+                timings = {}
+                error = None
+                if completed.returncode == 0:
+                    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+                else:
+                    error = completed.stderr.strip().splitlines()[-1] if completed.stderr else "failed"
+                requests_by_route = stats["requests"]
+                results.append(
+                    {
+                        "scenario": f"startup-{phase}",
+                        "groups": groups,
+                        "wall_seconds": round(elapsed, 3),
+                        "requests": requests_by_route.get("total", 0),
+                        "discovery_requests": sum(
+                            count for route, count in requests_by_route.items() if "openid-configuration" in route
+                        ),
+                        **{key: round(value, 4) for key, value in timings.items()},
+                        "by_route": requests_by_route,
+                        "error": error,
+                    }
+                )
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="在本地模拟 Graph 上测量 keepalive / delete_groups 性能")
+    parser.add_argument("--scenario", choices=["keepalive", "delete_groups", "startup", "all"], default="all")
+    parser.add_argument("--groups", default="10,100", help="逗号分隔的组数量列表，例如 10,1000,10000")
+    parser.add_argument("--tasks", type=int, default=1000, help="邮箱检查计划中的任务数量")
+    parser.add_argument("--plan-ratio", type=float, default=0.5, help="包含计划的组比例")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--max-delete", type=int, default=500)
+    parser.add_argument("--cleanup-budget", type=float, default=60.0)
+    parser.add_argument("--request-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    names = [*SCENARIOS, "startup"] if args.scenario == "all" else [args.scenario]
+    results: List[Dict] = []
+    for groups in [int(value) for value in args.groups.split(",") if value]:
+        if "startup" in names:
+            for result in run_startup(groups, args):
+                results.append(result)
+                status = f" 错误: {result['error']}" if result["error"] else ""
+                print(
+                    f"{result['scenario']:<14} 组 {groups:>6} | {result['wall_seconds']:>8.3f}s | "
+                    f"请求 {result['requests']:>3}（发现 {result['discovery_requests']}） | "
+                    f"导入 {result.get('import_seconds', 0) * 1000:.0f}ms "
+                    f"初始化 {result.get('init_seconds', 0) * 1000:.0f}ms "
+                    f"首次请求 {result.get('first_request_seconds', 0) * 1000:.0f}ms{status}"
+                )
+        for name in [name for name in names if name in SCENARIOS]:
+            result = run_scenario(name, groups, args)
+            results.append(result)
+            status = f" 错误: {result['error']}" if result["error"] else ""
+            print(
+                f"{name:<14} 组 {groups:>6} 任务 {args.tasks:>7} | "
+                f"{result['wall_seconds']:>8.3f}s | 请求 {result['requests']:>6}（批内 {result['batched_requests']:>6}） | "
+                f"内存峰值 {result['peak_memory_mb']:>7.2f} MB{status}"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers worth keeping; everything else (request ids, dates, auth) is dropped.
+RECORDED_HEADERS = ("Content-Type", "ETag", "Location", "Retry-After", "Preference-Applied")
+
+
+class CassetteMiss(RuntimeError):
+    """Replay found no recorded exchange for a request."""
+
+
+def _normalize(url: str) -> Tuple[str, Dict[str, str]]:
+    """Path without host or API version, and the query string as a sorted dict."""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if segments and segments[0] in ("v1.0", "beta"):
+        segments = segments[1:]
+    return "/".join(segments), dict(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+
+def _body_digest(body) -> str:
+    if not body:
+        return ""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha1(body).hexdigest()[:16]
+
+
+class Cassette:
+    """
+    Graph exchanges as JSON lines: method, normalized path, params, request body
+    digest, status, selected response headers, response body and latency.
+
+    In "record" mode every response GraphClient receives is appended to the file.
+    In "replay" mode requests are answered from the file without any network:
+    exchanges are matched by method, path, params and request body, falling back
+    to method, path and params (titles carry timestamps), and consumed in order,
+    the last one repeating once a key runs out.
+    """
+
+    def __init__(self, path: str, mode: str, replay_latency: bool = False):
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._handle = None
+        self._exact: Dict[tuple, Deque[Dict]] = defaultdict(deque)
+        self._loose: Dict[tuple, Deque[Dict]] = defaultdict(deque)
+        self._last: Dict[tuple, Dict] = {}
+        self._played = set()
+        self.stats: Counter = Counter()
+        if mode == "record":
+            self._handle = open(path, "w", encoding="utf-8")
+        elif mode == "replay":
+            self._load()
+        else:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                loose = (entry["method"], entry["path"], json.dumps(entry["params"], sort_keys=True))
+                self._exact[loose + (entry.get("body_digest", ""),)].append(entry)
+                self._loose[loose].append(entry)
+                self.stats["recorded"] += 1
+
+    def record(self, response: requests.Response, seconds: float) -> None:
+        sent = response.request
+        path, params = _normalize(sent.url)
+        try:
+            body = response.json() if response.content else None
+        except ValueError:
+            body = response.text
+        entry = {
+            "method": sent.method,
+            "path": path,
+            "params": params,
+            "body_digest": _body_digest(sent.body),
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            "body": body,
+            "seconds": round(seconds, 4),
+        }
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._handle.write(line + "\n")
+            # Flushed per line so an interrupted run still leaves a usable cassette.
+            self._handle.flush()
+            self.stats["recorded"] += 1
+
+    def play(self, method: str, url: str, **kwargs) -> requests.Response:
+        prepared = requests.Request(
+            method.upper(), url, params=kwargs.get("params"), data=kwargs.get("data"), json=kwargs.get("json")
+        ).prepare()
+        path, params = _normalize(prepared.url)
+        loose = (prepared.method, path, json.dumps(params, sort_keys=True))
+        exact = loose + (_body_digest(prepared.body),)
+        with self._lock:
+            entry = self._take(self._exact.get(exact)) or self._take(self._loose.get(loose))
+            if entry is not None:
+                self._last[loose] = entry
+                self.stats["played"] += 1
+            elif loose in self._last:
+                entry = self._last[loose]
+                self.stats["repeated"] += 1
+            else:
+                self.stats["missed"] += 1
+                raise CassetteMiss(f"No recorded response for {prepared.method} {path} {params}")
+        if self.replay_latency:
+            time.sleep(entry.get("seconds", 0))
+        return _build_response(prepared, entry)
+
+    def _take(self, queue: Optional[Deque[Dict]]) -> Optional[Dict]:
+        """Next exchange not yet played; each one sits in both indexes but is used once."""
+        while queue:
+            entry = queue.popleft()
+            if id(entry) not in self._played:
+                self._played.add(id(entry))
+                return entry
+        return None
+
+    def report_lines(self) -> List[str]:
+        if self.replaying:
+            unused = self.stats["recorded"] - self.stats["played"]
+            return [
+                f"回放 {self.path}：命中 {self.stats['played']} 次，重复使用 {self.stats['repeated']} 次，"
+                f"未命中 {self.stats['missed']} 次，未使用的录制 {unused} 条"
+            ]
+        return [f"已录制 {self.stats['recorded']} 次 Graph 调用到 {self.path}"]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._handle:
+                self._handle.close()
+                self._handle = None
+
+
+def _build_response(prepared: requests.PreparedRequest, entry: Dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+    body = entry.get("body")
+    if body is None:
+        response._content = b""
+    elif isinstance(body, str):
+        response._content = body.encode("utf-8")
+    else:
+        response._content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = prepared.url
+    response.request = prepared
+    return response
+
+
+def open_cassette(mode: str, path: str, replay_latency: bool = False) -> Optional[Cassette]:
+    """Cassette for GRAPH_CASSETTE_MODE, or None when the mode is off."""
+    if not mode or mode == "off":
+        return None
+    return Cassette(path, mode, replay_latency)
@@ -0,0 +1,115 @@
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, FrozenSet, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from metrics import endpoint_template
+
+
+# Writing one of these also changes what reads of the kinds it contains return.
+_CONTAINED_KINDS = {
+    "groups": ("plans", "buckets", "tasks"),
+    "plans": ("buckets", "tasks"),
+    "buckets": ("tasks",),
+}
+
+
+def read_kinds(path: str) -> FrozenSet[str]:
+    """Named segments of a Graph path, e.g. planner/plans/{id}/buckets -> planner, plans, buckets."""
+    return frozenset(segment for segment in endpoint_template(path).split("/") if segment != "{id}")
+
+
+def written_kinds(path: str) -> FrozenSet[str]:
+    """
+    Kinds a write to `path` can change: the collection of the written entity (the
+    segment before the first id, or the last one for a write to the collection
+    itself) plus what that entity contains, e.g. a task under planner/tasks/{id}/details.
+    """
+    segments = endpoint_template(path).split("/")
+    kind = segments[segments.index("{id}") - 1] if "{id}" in segments[1:] else segments[-1]
+    return frozenset((kind, *_CONTAINED_KINDS.get(kind, ())))
+
+
+class RequestCoalescer:
+    """
+    Per-run memo for GET responses with single-flight semantics: while a scope is
+    open, identical GETs share one call (concurrent callers wait for the one in
+    flight) and later ones reuse its 2xx response. A write anywhere under the
+    kind (see written_kinds) drops the entries whose path names that kind, so creating
+    a task forgets task listings but keeps bucket and group listings, and a GET that
+    was already in flight when such a write happened is not stored.
+    Outside a scope every call goes straight through.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._responses: Dict[tuple, Any] = {}
+        self._in_flight: Dict[tuple, Future] = {}
+        self._generations: Dict[str, int] = {}
+
+    @property
+    def active(self) -> bool:
+        return self._depth > 0
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        with self._lock:
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if not self._depth:
+                    self._responses.clear()
+                    self._generations.clear()
+
+    @staticmethod
+    def key(path: str, params: Optional[Dict] = None) -> Tuple:
+        parts = urlsplit(path)
+        query = tuple(sorted((str(name), str(value)) for name, value in (params or {}).items()))
+        return (parts.path.rstrip("/"), parts.query, query)
+
+    def fetch(self, key: Tuple, load: Callable[[], Any], on_shared: Optional[Callable[[], None]] = None) -> Any:
+        """`load()` once per key and scope; `on_shared` runs for every caller served without a call."""
+        if not self.active:
+            return load()
+        kinds = read_kinds(key[0])
+        with self._lock:
+            cached = self._responses.get(key)
+            waiting = self._in_flight.get(key) if cached is None else None
+            if cached is None and waiting is None:
+                leader = self._in_flight[key] = Future()
+                generations = self._snapshot(kinds)
+        if cached is not None or waiting is not None:
+            if on_shared:
+                on_shared()
+            return cached if cached is not None else waiting.result()
+
+        try:
+            response = load()
+        except BaseException as exc:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            # Callers that joined this flight see the same failure; nothing is cached.
+            leader.set_exception(exc)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if self.active and self._snapshot(kinds) == generations:
+                self._responses[key] = response
+        leader.set_result(response)
+        return response
+
+    def _snapshot(self, kinds: FrozenSet[str]) -> Tuple[int, ...]:
+        return tuple(self._generations.get(kind, 0) for kind in sorted(kinds))
+
+    def invalidate(self, path: str) -> None:
+        kinds = written_kinds(path)
+        with self._lock:
+            for kind in kinds:
+                self._generations[kind] = self._generations.get(kind, 0) + 1
+            for key in [key for key in self._responses if read_kinds(key[0]) & kinds]:
+                del self._responses[key]
@@ -30,6 +30,79 @@ class Settings:
     notification_email: str
     cleanup_time_budget_seconds: float
     enable_old_cleanup: bool
+    http_pool_connections: int = 10
+    http_pool_maxsize: int = 10
+    http_pool_block: bool = False
+    http_keepalive: bool = True
+    token_cache_path: str = ".msal_token_cache.json"
+    token_refresh_skew_seconds: float = 300.0
+    graph_page_size: int = 100
+    graph_prefetch_pages: bool = True
+    discovery_workers: int = 8
+    topology_cache_path: str = ".planner_topology.json"
+    topology_cache_ttl_seconds: float = 86400.0
+    cleanup_cursor_path: str = ".cleanup_cursor.json"
+    cleanup_cursor_ttl_seconds: float = 604800.0
+    user_id_cache_path: str = ".user_id_cache.json"
+    user_id_cache_ttl_seconds: float = 2592000.0
+    user_id_cache_max_entries: int = 10000
+    graph_max_retries: int = 4
+    graph_retry_backoff_seconds: float = 0.5
+    graph_retry_max_backoff_seconds: float = 30.0
+    graph_rate_limit_per_second: float = 0.0
+    graph_max_concurrency: int = 16
+    graph_base_url: str = "https://graph.microsoft.com/v1.0/"
+    msal_instance_discovery: bool = True
+    msal_http_cache_path: str = ".msal_http_cache.bin"
+    metrics_json_path: str = ".graph_metrics.json"
+    metrics_prometheus_path: str = ""
+    daemon_interval_seconds: float = 3600.0
+    daemon_jitter_seconds: float = 300.0
+    mailboxes_file: str = ""
+    mailbox_workers: int = 8
+    group_delete_workers: int = 4
+    cleanup_delete_workers: int = 4
+    inbox_change_mode: str = "off"
+    inbox_state_path: str = ".inbox_state.json"
+    graph_cassette_mode: str = "off"
+    graph_cassette_path: str = ".graph_cassette.jsonl"
+    graph_cassette_replay_latency: bool = False
+    graph_select_profile: str = "auto"
+    graph_hedge_percentile: float = 0.0
+    graph_breaker_failures: int = 5
+    graph_breaker_cooldown_seconds: float = 30.0
+
+
+@dataclass
+class MailboxTarget:
+    email: str
+    plan_title: str
+
+    @property
+    def title_prefix(self) -> str:
+        """Task titles carry the mailbox so keep-latest runs per mailbox in a shared plan."""
+        return f"{self.plan_title}-{self.email}"
+
+
+def load_mailboxes(path: str, default_plan_title: str) -> List[MailboxTarget]:
+    """
+    Read one mailbox per line as `email` or `email,plan title`; blank lines and
+    lines starting with # are ignored, and repeated entries are kept once.
+    """
+    targets: List[MailboxTarget] = []
+    seen = set()
+    with open(path, "r", encoding="utf-8-sig") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            email, _, plan_title = line.partition(",")
+            key = (email.strip().lower(), plan_title.strip() or default_plan_title)
+            if key in seen:
+                continue
+            seen.add(key)
+            targets.append(MailboxTarget(email.strip(), key[1]))
+    return targets
 
 
 def _require_env(key: str, default: Optional[str] = None) -> str:
@@ -41,6 +114,7 @@ def _require_env(key: str, default: Optional[str] = None) -> str:
 
 def load_settings() -> Settings:
     tenant_id = _require_env("TENANT_ID")
+    authority_host = os.getenv("AUTHORITY_HOST", "https://login.microsoftonline.com").rstrip("/")
     request_timeout = float(_require_env("REQUEST_TIMEOUT_SECONDS"))
     max_delete_per_run = int(_require_env("MAX_DELETE_PER_RUN"))
     mail_plan_group_name = os.getenv("MAIL_PLAN_GROUP", "")
@@ -57,7 +131,7 @@ def load_settings() -> Settings:
         user_email=_require_env("USER_EMAIL"),
         scopes=[_require_env("APP_SCOPE")],
         delegated_scopes=delegated_scopes,
-        authority=f"https://login.microsoftonline.com/{tenant_id}",
+        authority=f"{authority_host}/{tenant_id}",
         # Default prefix mirrors plan title if not provided.
         task_title_prefix=os.getenv("TASK_TITLE_PREFIX", mail_plan_title),
         request_timeout=request_timeout,
@@ -68,4 +142,68 @@ def load_settings() -> Settings:
         notification_email=_require_env("NOTIFICATION_EMAIL"),
         cleanup_time_budget_seconds=float(_require_env("CLEANUP_TIME_BUDGET_SECONDS")),
         enable_old_cleanup=os.getenv("ENABLE_OLD_CLEANUP", "false").lower() == "true",
+        http_pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "10")),
+        http_pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "10")),
+        http_pool_block=os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true",
+        http_keepalive=os.getenv("HTTP_KEEPALIVE", "true").lower() == "true",
+        # Empty path keeps the MSAL token cache in memory only.
+        token_cache_path=os.getenv("TOKEN_CACHE_PATH", ".msal_token_cache.json"),
+        token_refresh_skew_seconds=float(os.getenv("TOKEN_REFRESH_SKEW_SECONDS", "300")),
+        # $top for list endpoints that accept it; 0 leaves the server default.
+        graph_page_size=int(os.getenv("GRAPH_PAGE_SIZE", "100")),
+        graph_prefetch_pages=os.getenv("GRAPH_PREFETCH_PAGES", "true").lower() == "true",
+        # 1 keeps plan discovery sequential.
+        discovery_workers=int(os.getenv("DISCOVERY_WORKERS", "8")),
+        # Empty path keeps the group/plan/bucket index in memory only.
+        topology_cache_path=os.getenv("TOPOLOGY_CACHE_PATH", ".planner_topology.json"),
+        topology_cache_ttl_seconds=float(os.getenv("TOPOLOGY_CACHE_TTL_SECONDS", "86400")),
+        # Empty path keeps cleanup progress in memory only (still resumes within a process).
+        cleanup_cursor_path=os.getenv("CLEANUP_CURSOR_PATH", ".cleanup_cursor.json"),
+        # Saved cleanup progress older than this is discarded; 0 keeps it until the sweep finishes.
+        cleanup_cursor_ttl_seconds=float(os.getenv("CLEANUP_CURSOR_TTL_SECONDS", "604800")),
+        # UPN -> user id; empty path keeps the cache in memory only, TTL 0 never expires.
+        user_id_cache_path=os.getenv("USER_ID_CACHE_PATH", ".user_id_cache.json"),
+        user_id_cache_ttl_seconds=float(os.getenv("USER_ID_CACHE_TTL_SECONDS", "2592000")),
+        user_id_cache_max_entries=int(os.getenv("USER_ID_CACHE_MAX_ENTRIES", "10000")),
+        graph_max_retries=int(os.getenv("GRAPH_MAX_RETRIES", "4")),
+        graph_retry_backoff_seconds=float(os.getenv("GRAPH_RETRY_BACKOFF_SECONDS", "0.5")),
+        graph_retry_max_backoff_seconds=float(os.getenv("GRAPH_RETRY_MAX_BACKOFF_SECONDS", "30")),
+        # 0 disables the token bucket; the AIMD concurrency window still applies.
+        graph_rate_limit_per_second=float(os.getenv("GRAPH_RATE_LIMIT_PER_SECOND", "0")),
+        graph_max_concurrency=int(os.getenv("GRAPH_MAX_CONCURRENCY", "16")),
+        # Overridable so the benchmark can point at fake_graph.py.
+        graph_base_url=os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0/").rstrip("/") + "/",
+        msal_instance_discovery=os.getenv("MSAL_INSTANCE_DISCOVERY", "true").lower() == "true",
+        # Authority metadata cached between runs; empty path rediscovers on every start.
+        msal_http_cache_path=os.getenv("MSAL_HTTP_CACHE_PATH", ".msal_http_cache.bin"),
+        # Per-endpoint Graph call metrics written after keepalive; empty paths skip the export.
+        metrics_json_path=os.getenv("METRICS_JSON_PATH", ".graph_metrics.json"),
+        metrics_prometheus_path=os.getenv("METRICS_PROMETHEUS_PATH", ""),
+        # `main.py daemon`: seconds between cycle starts, plus up to the jitter at random.
+        daemon_interval_seconds=float(os.getenv("DAEMON_INTERVAL_SECONDS", "3600")),
+        daemon_jitter_seconds=float(os.getenv("DAEMON_JITTER_SECONDS", "300")),
+        # Optional list of mailboxes for keepalive; empty keeps the single USER_EMAIL run.
+        mailboxes_file=os.getenv("MAILBOXES_FILE", ""),
+        mailbox_workers=int(os.getenv("MAILBOX_WORKERS", "8")),
+        # delete_groups: $batch chunks of group deletions in flight at once.
+        group_delete_workers=int(os.getenv("GROUP_DELETE_WORKERS", "4")),
+        # Task cleanup: $batch delete chunks sent while listing continues.
+        cleanup_delete_workers=int(os.getenv("CLEANUP_DELETE_WORKERS", "4")),
+        # off: new task every run; touch: retitle the last task when the inbox is unchanged;
+        # skip: write nothing when the inbox is unchanged.
+        inbox_change_mode=os.getenv("INBOX_CHANGE_MODE", "off").lower(),
+        inbox_state_path=os.getenv("INBOX_STATE_PATH", ".inbox_state.json"),
+        # record: append every Graph exchange to the cassette; replay: answer from it offline,
+        # at full speed or sleeping each recorded latency.
+        graph_cassette_mode=os.getenv("GRAPH_CASSETTE_MODE", "off").lower(),
+        graph_cassette_path=os.getenv("GRAPH_CASSETTE_PATH", ".graph_cassette.jsonl"),
+        graph_cassette_replay_latency=os.getenv("GRAPH_CASSETTE_REPLAY_LATENCY", "false").lower() == "true",
+        # auto: list calls $select only the fields the running workflow reads; full: whole entities.
+        graph_select_profile=os.getenv("GRAPH_SELECT_PROFILE", "auto").lower(),
+        # Duplicate a GET still unanswered past this latency percentile of its endpoint
+        # (e.g. 95); 0 disables hedging.
+        graph_hedge_percentile=float(os.getenv("GRAPH_HEDGE_PERCENTILE", "0")),
+        # Consecutive transport errors/5xx that open an endpoint's circuit; 0 disables the breaker.
+        graph_breaker_failures=int(os.getenv("GRAPH_BREAKER_FAILURES", "5")),
+        graph_breaker_cooldown_seconds=float(os.getenv("GRAPH_BREAKER_COOLDOWN_SECONDS", "30")),
     )
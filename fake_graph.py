@@ -0,0 +1,675 @@
+"""
+Local stand-in for graph.microsoft.com and the Entra token endpoint, used by the
+benchmark harness and tests. Serves users, mailFolders, groups and Planner
+plans/buckets/tasks with ETags, nextLink pagination, $select, $batch, gzip and configurable
+latency, error and throttle injection.
+
+Run standalone: python fake_graph.py --groups 100 --tasks 5000 --tls
+The first stdout line is the base URL; GET /_fake/stats returns request counts.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+Response = Tuple[int, Dict[str, str], Any]
+
+
+def _graph_timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f") + "0Z"
+
+
+class _PagedIndex:
+    """Insertion-ordered ids with tombstones, so skiptoken paging stays O(page) under deletes."""
+
+    def __init__(self):
+        self._ids: List[Optional[str]] = []
+        self._positions: Dict[str, int] = {}
+
+    def add(self, item_id: str) -> None:
+        self._positions[item_id] = len(self._ids)
+        self._ids.append(item_id)
+
+    def remove(self, item_id: str) -> None:
+        position = self._positions.pop(item_id, None)
+        if position is not None:
+            self._ids[position] = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def page(self, start: int, size: int) -> Tuple[List[str], Optional[int]]:
+        """Ids from `start` on, and the position of the next page (None when exhausted)."""
+        found: List[str] = []
+        position = start
+        while position < len(self._ids) and len(found) < size:
+            if self._ids[position] is not None:
+                found.append(self._ids[position])
+            position += 1
+        # Skip trailing tombstones so an exhausted index does not hand out an empty page.
+        while position < len(self._ids) and self._ids[position] is None:
+            position += 1
+        return found, position if position < len(self._ids) else None
+
+
+class FakeTenant:
+    """In-memory tenant. All mutation happens under one lock."""
+
+    def __init__(
+        self,
+        groups: int = 10,
+        tasks: int = 100,
+        plan_ratio: float = 0.5,
+        mail_plan_title: str = "邮箱检查",
+        user_email: str = "user@example.com",
+        messages: int = 20,
+        seed: int = 0,
+    ):
+        self.lock = threading.RLock()  # $batch re-enters handle() while holding it
+        self._random = random.Random(seed)
+        self._counter = 0
+        self.users: Dict[str, Dict] = {}
+        self.messages: Dict[str, List[Dict]] = {}
+        self.groups: Dict[str, Dict] = {}
+        self.group_index = _PagedIndex()
+        self.plans: Dict[str, Dict] = {}
+        self.group_plans: Dict[str, _PagedIndex] = {}
+        self.buckets: Dict[str, Dict] = {}
+        self.plan_buckets: Dict[str, _PagedIndex] = {}
+        self.tasks: Dict[str, Dict] = {}
+        self.details: Dict[str, Dict] = {}
+        self.plan_tasks: Dict[str, _PagedIndex] = {}
+        self.bucket_tasks: Dict[str, _PagedIndex] = {}
+
+        self.add_user(user_email, messages)
+        now = datetime.now(timezone.utc)
+        mail_group_position = groups // 2
+        for index in range(groups):
+            group = self.add_group(f"Group {index:05d}")
+            if index == mail_group_position:
+                plan = self.add_plan(group["id"], mail_plan_title)
+                bucket = self.add_bucket(plan["id"], "待办事项")
+                for task_index in range(tasks):
+                    created = now - timedelta(minutes=self._random.randint(1, 30 * 24 * 60))
+                    self.add_task(plan["id"], bucket["id"], f"{mail_plan_title}-{task_index}", created)
+            elif self._random.random() < plan_ratio:
+                plan = self.add_plan(group["id"], f"Plan {index:05d}")
+                self.add_bucket(plan["id"], "待办事项")
+
+    def _next_id(self, prefix: str) -> str:
+        self._counter += 1
+        return f"{prefix}-{self._counter:08d}"
+
+    def _etag(self) -> str:
+        self._counter += 1
+        return f'W/"JzEtVGFzayAg{self._counter:08d}"'
+
+    def add_user(self, upn: str, messages: int) -> Dict:
+        user = {"id": self._next_id("user"), "userPrincipalName": upn, "displayName": upn.split("@")[0]}
+        self.users[user["id"]] = user
+        now = datetime.now(timezone.utc)
+        self.messages[user["id"]] = [
+            {
+                "id": self._next_id("msg"),
+                "subject": f"Message {index}",
+                "from": {"emailAddress": {"address": f"sender{index}@example.com"}},
+                "isRead": index % 3 != 0,
+                "receivedDateTime": _graph_timestamp(now - timedelta(hours=index)),
+            }
+            for index in range(messages)
+        ]
+        return user
+
+    def add_group(self, name: str) -> Dict:
+        group = {"id": self._next_id("group"), "displayName": name, "mailEnabled": False}
+        self.groups[group["id"]] = group
+        self.group_index.add(group["id"])
+        self.group_plans[group["id"]] = _PagedIndex()
+        return group
+
+    def add_plan(self, group_id: str, title: str) -> Dict:
+        plan = {
+            "id": self._next_id("plan"),
+            "title": title,
+            "owner": group_id,
+            "createdDateTime": _graph_timestamp(datetime.now(timezone.utc)),
+            "@odata.etag": self._etag(),
+        }
+        self.plans[plan["id"]] = plan
+        self.group_plans[group_id].add(plan["id"])
+        self.plan_buckets[plan["id"]] = _PagedIndex()
+        self.plan_tasks[plan["id"]] = _PagedIndex()
+        return plan
+
+    def add_bucket(self, plan_id: str, name: str) -> Dict:
+        bucket = {
+            "id": self._next_id("bucket"),
+            "name": name,
+            "planId": plan_id,
+            "orderHint": " !",
+            "@odata.etag": self._etag(),
+        }
+        self.buckets[bucket["id"]] = bucket
+        self.plan_buckets[plan_id].add(bucket["id"])
+        self.bucket_tasks[bucket["id"]] = _PagedIndex()
+        return bucket
+
+    def add_task(self, plan_id: str, bucket_id: str, title: str, created: Optional[datetime] = None) -> Dict:
+        task = {
+            "id": self._next_id("task"),
+            "planId": plan_id,
+            "bucketId": bucket_id,
+            "title": title,
+            "percentComplete": 0,
+            "createdDateTime": _graph_timestamp(created or datetime.now(timezone.utc)),
+            "createdBy": {"user": {"id": "app"}},
+            "assignments": {},
+            "appliedCategories": {},
+            "@odata.etag": self._etag(),
+        }
+        self.tasks[task["id"]] = task
+        self.details[task["id"]] = {
+            "id": task["id"],
+            "description": "",
+            "previewType": "automatic",
+            "references": {},
+            "checklist": {},
+            "@odata.etag": self._etag(),
+        }
+        self.plan_tasks[plan_id].add(task["id"])
+        self.bucket_tasks[bucket_id].add(task["id"])
+        return task
+
+    def remove_task(self, task_id: str) -> None:
+        task = self.tasks.pop(task_id)
+        self.details.pop(task_id, None)
+        self.plan_tasks[task["planId"]].remove(task_id)
+        self.bucket_tasks[task["bucketId"]].remove(task_id)
+
+    def remove_group(self, group_id: str) -> None:
+        self.groups.pop(group_id)
+        self.group_index.remove(group_id)
+        for plan_id in list(self.group_plans.pop(group_id)._positions):
+            self.plans.pop(plan_id, None)
+
+    def find_user(self, key: str) -> Optional[Dict]:
+        if key in self.users:
+            return self.users[key]
+        for user in self.users.values():
+            if user["userPrincipalName"].lower() == key.lower():
+                return user
+        return None
+
+
+def _project(item: Dict, select: Optional[str]) -> Dict:
+    if not select:
+        return item
+    fields = set(select.split(",")) | {"id", "@odata.etag"}
+    return {key: value for key, value in item.items() if key in fields}
+
+
+class FakeGraphApp:
+    """Routes Graph-shaped requests against a FakeTenant and injects faults."""
+
+    def __init__(
+        self,
+        tenant: FakeTenant,
+        base_url: str,
+        page_size: int = 100,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ):
+        self.tenant = tenant
+        self.base_url = base_url.rstrip("/")
+        self.page_size = page_size
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        self.routes = [
+            ("POST", r"[^/]+/oauth2/v2\.0/token", self._token),
+            ("GET", r"[^/]+/v2\.0/\.well-known/openid-configuration", self._openid_configuration),
+            ("GET", r"[^/]+/\.well-known/openid-configuration", self._openid_configuration),
+            ("POST", r"v1\.0/\$batch", self._batch),
+            ("GET", r"v1\.0/users", self._list_users),
+            ("GET", r"v1\.0/users/(?P<user>[^/]+)", self._get_user),
+            ("GET", r"v1\.0/users/(?P<user>[^/]+)/mailFolders/Inbox", self._inbox),
+            ("GET", r"v1\.0/users/(?P<user>[^/]+)/mailFolders/Inbox/messages", self._messages),
+            ("GET", r"v1\.0/users/(?P<user>[^/]+)/messages", self._messages),
+            ("GET", r"v1\.0/groups", self._list_groups),
+            ("DELETE", r"v1\.0/groups/(?P<group>[^/]+)", self._delete_group),
+            ("GET", r"v1\.0/groups/(?P<group>[^/]+)/planner/plans", self._list_plans),
+            ("POST", r"v1\.0/planner/plans", self._create_plan),
+            ("GET", r"v1\.0/planner/plans/(?P<plan>[^/]+)/buckets", self._list_buckets),
+            ("GET", r"v1\.0/planner/plans/(?P<plan>[^/]+)/tasks", self._list_plan_tasks),
+            ("POST", r"v1\.0/planner/buckets", self._create_bucket),
+            ("GET", r"v1\.0/planner/buckets/(?P<bucket>[^/]+)/tasks", self._list_bucket_tasks),
+            ("POST", r"v1\.0/planner/tasks", self._create_task),
+            ("GET", r"v1\.0/planner/tasks/(?P<task>[^/]+)", self._get_task),
+            ("PATCH", r"v1\.0/planner/tasks/(?P<task>[^/]+)", self._update_task),
+            ("DELETE", r"v1\.0/planner/tasks/(?P<task>[^/]+)", self._delete_task),
+            ("GET", r"v1\.0/planner/tasks/(?P<task>[^/]+)/details", self._get_details),
+            ("PATCH", r"v1\.0/planner/tasks/(?P<task>[^/]+)/details", self._update_details),
+        ]
+        self._compiled = [
+            (method, re.compile(pattern + r"/?$"), self._template(pattern), handler)
+            for method, pattern, handler in self.routes
+        ]
+
+    @staticmethod
+    def _template(pattern: str) -> str:
+        """Readable route name for stats, e.g. v1.0/planner/plans/{plan}/tasks."""
+        return re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern).replace("\\", "")
+
+    # Dispatch
+    def handle(self, method: str, raw_path: str, headers: Dict[str, str], body: Any, top_level: bool = True) -> Response:
+        parts = urlsplit(raw_path)
+        path = unquote(parts.path).lstrip("/")
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if path.startswith("_fake/"):
+            return self._control(method, path)
+        if self.latency and top_level:
+            time.sleep(self.latency)
+        for route_method, pattern, template, handler in self._compiled:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self._count(f"{method} {template}", top_level)
+                # Faults hit Graph resources only, not auth or the $batch envelope.
+                if path.startswith("v1.0/") and template != "v1.0/$batch":
+                    injected = self._inject_fault()
+                    if injected:
+                        return injected
+                with self.tenant.lock:
+                    return handler(query=query, headers=headers, body=body, **match.groupdict())
+        self._count(f"{method} <unmatched>", top_level)
+        return self._error(404, "Request_ResourceNotFound", f"No route for {method} {path}")
+
+    def _count(self, key: str, top_level: Optional[bool] = None) -> None:
+        """Bump one stat; routed requests also count towards "total" (HTTP requests) or "batched" ($batch items)."""
+        with self._stats_lock:
+            self.stats[key] += 1
+            if top_level is not None:
+                self.stats["total" if top_level else "batched"] += 1
+
+    def _inject_fault(self) -> Optional[Response]:
+        roll = self._random.random()
+        if roll < self.throttle_rate:
+            self._count("injected 429")
+            return (
+                429,
+                {"Retry-After": str(self.retry_after)},
+                {"error": {"code": "TooManyRequests", "message": "Injected throttle"}},
+            )
+        if roll < self.throttle_rate + self.error_rate:
+            self._count("injected 503")
+            return 503, {}, {"error": {"code": "ServiceUnavailable", "message": "Injected error"}}
+        return None
+
+    def _control(self, method: str, path: str) -> Response:
+        if path == "_fake/stats":
+            with self._stats_lock:
+                return 200, {}, {"requests": dict(self.stats), "bytes_sent": self.bytes_sent}
+        if path == "_fake/reset" and method == "POST":
+            with self._stats_lock:
+                self.stats.clear()
+                self.bytes_sent = 0
+            return 204, {}, None
+        return self._error(404, "NotFound", path)
+
+    @staticmethod
+    def _error(status: int, code: str, message: str) -> Response:
+        return status, {}, {"error": {"code": code, "message": message}}
+
+    def _page(self, index: _PagedIndex, items: Dict[str, Dict], path: str, query: Dict, page_size: Optional[int] = None) -> Response:
+        size = page_size or self.page_size
+        start = int(query.get("$skiptoken", 0))
+        ids, next_start = index.page(start, size)
+        payload: Dict[str, Any] = {"value": [_project(items[item_id], query.get("$select")) for item_id in ids]}
+        if next_start is not None:
+            extra = f"&$top={size}" if page_size else ""
+            select = f"&$select={query['$select']}" if query.get("$select") else ""
+            payload["@odata.nextLink"] = f"{self.base_url}/v1.0/{path}?$skiptoken={next_start}{extra}{select}"
+        return 200, {}, payload
+
+    @staticmethod
+    def _etag_matches(headers: Dict[str, str], etag: str) -> bool:
+        expected = {key.lower(): value for key, value in headers.items()}.get("if-match")
+        return expected in (etag, "*")
+
+    # Auth
+    def _token(self, **_kwargs) -> Response:
+        return 200, {}, {"token_type": "Bearer", "expires_in": 3599, "ext_expires_in": 3599, "access_token": "fake-access-token"}
+
+    def _openid_configuration(self, **_kwargs) -> Response:
+        tenant_base = f"{self.base_url}/fake-tenant"
+        return 200, {}, {
+            "issuer": f"{tenant_base}/v2.0",
+            "authorization_endpoint": f"{tenant_base}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{tenant_base}/oauth2/v2.0/token",
+            "device_authorization_endpoint": f"{tenant_base}/oauth2/v2.0/devicecode",
+        }
+
+    # Batch
+    def _batch(self, body: Any, **_kwargs) -> Response:
+        responses = []
+        for item in (body or {}).get("requests", [])[:20]:
+            status, headers, payload = self.handle(
+                item["method"], "/v1.0" + item["url"], item.get("headers") or {}, item.get("body"), top_level=False
+            )
+            responses.append({"id": item["id"], "status": status, "headers": headers, "body": payload})
+        return 200, {}, {"responses": responses}
+
+    # Users and mail
+    def _list_users(self, query: Dict, **_kwargs) -> Response:
+        match = re.search(r"userPrincipalName eq '([^']+)'", query.get("$filter", ""))
+        users = list(self.tenant.users.values())
+        if match:
+            users = [user for user in users if user["userPrincipalName"].lower() == match.group(1).lower()]
+        return 200, {}, {"value": [_project(user, query.get("$select")) for user in users]}
+
+    def _get_user(self, user: str, query: Dict, **_kwargs) -> Response:
+        found = self.tenant.find_user(user)
+        if not found:
+            return self._error(404, "Request_ResourceNotFound", f"User {user} not found")
+        return 200, {}, _project(found, query.get("$select"))
+
+    def _inbox(self, user: str, query: Dict, **_kwargs) -> Response:
+        found = self.tenant.find_user(user)
+        if not found:
+            return self._error(404, "ErrorInvalidUser", user)
+        messages = self.tenant.messages[found["id"]]
+        folder = {
+            "id": "inbox",
+            "displayName": "Inbox",
+            "totalItemCount": len(messages),
+            "unreadItemCount": sum(1 for message in messages if not message["isRead"]),
+        }
+        return 200, {}, _project(folder, query.get("$select"))
+
+    def _messages(self, user: str, query: Dict, **_kwargs) -> Response:
+        found = self.tenant.find_user(user)
+        if not found:
+            return self._error(404, "ErrorInvalidUser", user)
+        top = int(query.get("$top", 10))
+        start = int(query.get("$skiptoken", 0))
+        messages = self.tenant.messages[found["id"]]
+        payload: Dict[str, Any] = {
+            "value": [_project(message, query.get("$select")) for message in messages[start : start + top]]
+        }
+        if start + top < len(messages):
+            payload["@odata.nextLink"] = f"{self.base_url}/v1.0/users/{user}/messages?$top={top}&$skiptoken={start + top}"
+        return 200, {}, payload
+
+    # Groups and plans
+    def _list_groups(self, query: Dict, **_kwargs) -> Response:
+        top = int(query["$top"]) if query.get("$top") else None
+        return self._page(self.tenant.group_index, self.tenant.groups, "groups", query, page_size=top)
+
+    def _delete_group(self, group: str, **_kwargs) -> Response:
+        if group not in self.tenant.groups:
+            return self._error(404, "Request_ResourceNotFound", group)
+        self.tenant.remove_group(group)
+        return 204, {}, None
+
+    def _list_plans(self, group: str, query: Dict, **_kwargs) -> Response:
+        if group not in self.tenant.groups:
+            return self._error(404, "Request_ResourceNotFound", group)
+        return self._page(self.tenant.group_plans[group], self.tenant.plans, f"groups/{group}/planner/plans", query)
+
+    def _create_plan(self, body: Dict, **_kwargs) -> Response:
+        if body.get("owner") not in self.tenant.groups:
+            return self._error(404, "NotFound", "owner")
+        return 201, {}, self.tenant.add_plan(body["owner"], body.get("title", "plan"))
+
+    def _list_buckets(self, plan: str, query: Dict, **_kwargs) -> Response:
+        if plan not in self.tenant.plans:
+            return self._error(404, "NotFound", plan)
+        return self._page(self.tenant.plan_buckets[plan], self.tenant.buckets, f"planner/plans/{plan}/buckets", query)
+
+    def _create_bucket(self, body: Dict, **_kwargs) -> Response:
+        if body.get("planId") not in self.tenant.plans:
+            return self._error(404, "NotFound", "planId")
+        return 201, {}, self.tenant.add_bucket(body["planId"], body.get("name", "bucket"))
+
+    # Tasks
+    def _list_plan_tasks(self, plan: str, query: Dict, **_kwargs) -> Response:
+        if plan not in self.tenant.plans:
+            return self._error(404, "NotFound", plan)
+        return self._page(self.tenant.plan_tasks[plan], self.tenant.tasks, f"planner/plans/{plan}/tasks", query)
+
+    def _list_bucket_tasks(self, bucket: str, query: Dict, **_kwargs) -> Response:
+        if bucket not in self.tenant.buckets:
+            return self._error(404, "NotFound", bucket)
+        return self._page(self.tenant.bucket_tasks[bucket], self.tenant.tasks, f"planner/buckets/{bucket}/tasks", query)
+
+    def _create_task(self, body: Dict, headers: Dict[str, str], **_kwargs) -> Response:
+        if body.get("planId") not in self.tenant.plans or body.get("bucketId") not in self.tenant.buckets:
+            return self._error(404, "NotFound", "planId/bucketId")
+        task = self.tenant.add_task(body["planId"], body["bucketId"], body.get("title", ""))
+        if isinstance(body.get("details"), dict):
+            details = self.tenant.details[task["id"]]
+            details.update({key: value for key, value in body["details"].items() if key in ("description",)})
+            details["@odata.etag"] = self.tenant._etag()
+        return 201, {}, task
+
+    def _get_task(self, task: str, query: Dict, **_kwargs) -> Response:
+        if task not in self.tenant.tasks:
+            return self._error(404, "NotFound", task)
+        return 200, {}, _project(self.tenant.tasks[task], query.get("$select"))
+
+    def _update_task(self, task: str, headers: Dict[str, str], body: Dict, **_kwargs) -> Response:
+        return self._patch(self.tenant.tasks, task, headers, body, ("title", "percentComplete", "bucketId"))
+
+    def _delete_task(self, task: str, headers: Dict[str, str], **_kwargs) -> Response:
+        if task not in self.tenant.tasks:
+            return self._error(404, "NotFound", task)
+        if not self._etag_matches(headers, self.tenant.tasks[task]["@odata.etag"]):
+            return self._error(412, "PreconditionFailed", "etag mismatch")
+        self.tenant.remove_task(task)
+        return 204, {}, None
+
+    def _get_details(self, task: str, **_kwargs) -> Response:
+        if task not in self.tenant.details:
+            return self._error(404, "NotFound", task)
+        return 200, {}, self.tenant.details[task]
+
+    def _update_details(self, task: str, headers: Dict[str, str], body: Dict, **_kwargs) -> Response:
+        return self._patch(self.tenant.details, task, headers, body, ("description", "previewType"))
+
+    def _patch(self, items: Dict[str, Dict], item_id: str, headers: Dict[str, str], body: Dict, fields) -> Response:
+        if item_id not in items:
+            return self._error(404, "NotFound", item_id)
+        item = items[item_id]
+        if not self._etag_matches(headers, item["@odata.etag"]):
+            return self._error(412, "PreconditionFailed", "etag mismatch")
+        item.update({key: value for key, value in (body or {}).items() if key in fields})
+        item["@odata.etag"] = self.tenant._etag()
+        prefer = {key.lower(): value for key, value in headers.items()}.get("prefer", "")
+        if "return=representation" in prefer:
+            return 200, {}, item
+        return 204, {}, None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    app: FakeGraphApp
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this Nagle adds ~40ms per response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *_args) -> None:
+        pass
+
+    def _serve(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body: Any = None
+        if raw:
+            content_type = self.headers.get("Content-Type", "")
+            if "json" in content_type:
+                body = json.loads(raw.decode("utf-8"))
+            else:
+                body = parse_qs(raw.decode("utf-8"))
+        status, headers, payload = self.app.handle(self.command, self.path, dict(self.headers.items()), body)
+        data = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        compress = len(data) > 1024 and "gzip" in self.headers.get("Accept-Encoding", "")
+        if compress:
+            data = gzip.compress(data, compresslevel=1)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.app._stats_lock:
+            self.app.bytes_sent += len(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _serve
+
+
+def make_self_signed_cert(directory: str) -> Tuple[str, str]:
+    """Write a throwaway certificate for 127.0.0.1/localhost; returns (certfile, keyfile)."""
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=5))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+            ),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, "fake_graph_cert.pem")
+    keyfile = os.path.join(directory, "fake_graph_key.pem")
+    with open(certfile, "wb") as handle:
+        handle.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as handle:
+        handle.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return certfile, keyfile
+
+
+class FakeGraphServer:
+    """Threaded HTTP(S) server around FakeGraphApp; `url` is the scheme://host:port root."""
+
+    def __init__(self, tenant: FakeTenant, host: str = "127.0.0.1", port: int = 0, tls: bool = False, **app_options):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.certfile: Optional[str] = None
+        scheme = "http"
+        if tls:
+            import ssl
+
+            self._cert_dir = tempfile.mkdtemp(prefix="fake-graph-")
+            self.certfile, keyfile = make_self_signed_cert(self._cert_dir)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            scheme = "https"
+        self.url = f"{scheme}://{host}:{self.httpd.server_address[1]}"
+        self.app = FakeGraphApp(tenant, self.url, **app_options)
+        self.httpd.RequestHandlerClass = type("BoundHandler", (_Handler,), {"app": self.app})
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "FakeGraphServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地模拟 Microsoft Graph 与令牌端点")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--plan-ratio", type=float, default=0.5)
+    parser.add_argument("--mail-plan-title", default="邮箱检查")
+    parser.add_argument("--user-email", default="user@example.com")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tenant = FakeTenant(
+        groups=args.groups,
+        tasks=args.tasks,
+        plan_ratio=args.plan_ratio,
+        mail_plan_title=args.mail_plan_title,
+        user_email=args.user_email,
+        seed=args.seed,
+    )
+    server = FakeGraphServer(
+        tenant,
+        port=args.port,
+        tls=args.tls,
+        page_size=args.page_size,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    print(server.url, flush=True)
+    if server.certfile:
+        print(server.certfile, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,201 @@
-﻿import requests
-from msal import ConfidentialClientApplication, PublicClientApplication
+﻿import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
 
+import requests
+from requests.adapters import HTTPAdapter
+from msal import ConfidentialClientApplication, PublicClientApplication, SerializableTokenCache
+
+from cassette import open_cassette
+from coalesce import RequestCoalescer
 from config import Settings
+from metrics import RequestMetrics, endpoint_template
+from throttling import (
+    RETRYABLE_STATUS,
+    AdaptiveRateLimiter,
+    CircuitBreaker,
+    LatencyTracker,
+    parse_retry_after,
+    retry_delay,
+)
+
+# Graph rejects $batch payloads with more than 20 sub-requests.
+MAX_BATCH_SIZE = 20
+
+# Methods that may be re-sent after a transport error without risking a duplicate write.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class GraphError(RuntimeError):
+    """Non-2xx Graph response; keeps the status code for callers that branch on it."""
+
+    def __init__(self, method: str, path: str, status_code: int, body: str):
+        super().__init__(f"Graph {method} {path} failed {status_code}: {body}")
+        self.method = method
+        self.path = path
+        self.status_code = status_code
+        self.body = body
+
+
+class CircuitOpenError(GraphError):
+    """Raised without calling Graph while the endpoint's circuit breaker is open."""
+
+    def __init__(self, method: str, path: str, endpoint: str):
+        super().__init__(method, path, 503, f"circuit open for {endpoint}, failing fast")
+        self.endpoint = endpoint
+
+
+@dataclass
+class BatchResponse:
+    """Result of one $batch sub-request, mirroring what an individual call would return."""
+
+    method: str
+    path: str
+    status_code: int
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: Any = None
+    error: Optional[GraphError] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def json(self) -> Any:
+        return self.body if self.body is not None else {}
+
+
+class GraphBatch:
+    """
+    Queue of Graph requests sent as JSON $batch calls of at most MAX_BATCH_SIZE
+    sub-requests. Responses come back in the order the requests were added.
+    """
+
+    def __init__(self, client: "GraphClient"):
+        self.client = client
+        self._requests: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def add(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        json: Any = None,
+    ) -> int:
+        url = "/" + path.lstrip("/")
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        item: Dict[str, Any] = {"method": method.upper(), "url": url, "path": path}
+        if headers:
+            item["headers"] = dict(headers)
+        if json is not None:
+            item["body"] = json
+            item.setdefault("headers", {}).setdefault("Content-Type", "application/json")
+        self._requests.append(item)
+        return len(self._requests) - 1
+
+    def execute(self) -> List[BatchResponse]:
+        pending, self._requests = self._requests, []
+        results: List[BatchResponse] = []
+        try:
+            for start in range(0, len(pending), MAX_BATCH_SIZE):
+                results.extend(self._send_chunk(pending[start : start + MAX_BATCH_SIZE]))
+        finally:
+            for item in pending:
+                if item["method"] != "GET":
+                    self.client.coalescer.invalidate(item["path"])
+        return results
+
+    def _send_chunk(self, chunk: List[Dict[str, Any]]) -> List[BatchResponse]:
+        settings = self.client.settings
+        results: List[Optional[BatchResponse]] = [None] * len(chunk)
+        remaining = list(range(len(chunk)))
+        for attempt in range(settings.graph_max_retries + 1):
+            raw_by_index = self._post_sub_requests(chunk, remaining)
+            if isinstance(raw_by_index, Exception):
+                # The whole envelope failed: report the same error for every sub-request.
+                exc = raw_by_index
+                status = getattr(exc, "status_code", 0)
+                error = exc if isinstance(exc, GraphError) else GraphError("POST", "$batch", status, str(exc))
+                for index in remaining:
+                    item = chunk[index]
+                    results[index] = BatchResponse(item["method"], item["path"], status, error=error)
+                break
+
+            throttled: List[int] = []
+            delays: List[float] = []
+            for index in remaining:
+                item = chunk[index]
+                raw = raw_by_index.get(index, {"status": 0, "body": "missing from $batch response"})
+                status = int(raw.get("status", 0))
+                headers = raw.get("headers") or {}
+                body = raw.get("body")
+                self.client.metrics.record_batched(item["method"], item["path"], status, retry=attempt > 0)
+                if status in RETRYABLE_STATUS and attempt < settings.graph_max_retries:
+                    retry_after = parse_retry_after(headers)
+                    self.client.limiter.record_throttle(retry_after)
+                    throttled.append(index)
+                    delays.append(self.client._retry_delay(attempt, retry_after))
+                    continue
+                error = None
+                if not 200 <= status < 300:
+                    text = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+                    error = GraphError(item["method"], item["path"], status, text)
+                results[index] = BatchResponse(item["method"], item["path"], status, headers, body, error)
+            if not throttled:
+                break
+            time.sleep(max(delays))
+            remaining = throttled
+        return [result for result in results if result is not None]
+
+    def _post_sub_requests(self, chunk: List[Dict[str, Any]], indexes: List[int]):
+        """POST the selected sub-requests; returns {index: raw response} or the exception."""
+        sub_requests = []
+        for index in indexes:
+            sub_request = {key: value for key, value in chunk[index].items() if key != "path"}
+            sub_request["id"] = str(index)
+            sub_requests.append(sub_request)
+        try:
+            response = self.client.post("$batch", json={"requests": sub_requests})
+        except Exception as exc:
+            return exc
+        return {int(item["id"]): item for item in response.json().get("responses", [])}
 
 
 class HttpClientWithTimeout(requests.Session):
-    """MSAL-compatible HTTP client that enforces a default timeout for token calls."""
+    """
+    Pooled keep-alive HTTP client shared by MSAL token calls and Graph requests.
+    Enforces a default timeout; pool sizes are per host.
+    """
 
-    def __init__(self, timeout: float):
+    def __init__(
+        self,
+        timeout: float,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        keepalive: bool = True,
+    ):
         super().__init__()
         self._default_timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        if not keepalive:
+            self.headers["Connection"] = "close"
 
     def send(self, request, **kwargs):
         if kwargs.get("timeout") is None:
@@ -17,32 +203,152 @@ class HttpClientWithTimeout(requests.Session):
         return super().send(request, **kwargs)
 
 
+def _wire_bytes(response: requests.Response) -> int:
+    """Body bytes as received, i.e. compressed when Graph gzipped the response."""
+    content = response.content or b""
+    raw = getattr(response, "raw", None)
+    try:
+        return int(raw.tell()) if raw is not None else len(content)
+    except (AttributeError, TypeError, ValueError):
+        return len(content)
+
+
 class GraphClient:
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.base_url = "https://graph.microsoft.com/v1.0/"
+        self.base_url = settings.graph_base_url
         self.auth_mode = settings.auth_mode
-        self.http_client = HttpClientWithTimeout(settings.request_timeout)
+        self.http_client = HttpClientWithTimeout(
+            settings.request_timeout,
+            pool_connections=settings.http_pool_connections,
+            pool_maxsize=settings.http_pool_maxsize,
+            pool_block=settings.http_pool_block,
+            keepalive=settings.http_keepalive,
+        )
+        self.token_cache = SerializableTokenCache()
+        self._load_token_cache()
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self.limiter = AdaptiveRateLimiter(
+            settings.graph_rate_limit_per_second, settings.graph_max_concurrency
+        )
+        self.metrics = RequestMetrics()
+        self.latencies = LatencyTracker()
+        self.breaker = CircuitBreaker(
+            settings.graph_breaker_failures, settings.graph_breaker_cooldown_seconds
+        )
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self.coalescer = RequestCoalescer()
+        self._hedge_lock = threading.Lock()
+        self.cassette = open_cassette(
+            settings.graph_cassette_mode, settings.graph_cassette_path, settings.graph_cassette_replay_latency
+        )
+        self._http_cache, self._http_cache_blob = self._load_http_cache()
+        msal_options = {
+            "authority": self.settings.authority,
+            "http_client": self.http_client,
+            "token_cache": self.token_cache,
+            # Holds the authority/OpenID discovery responses; MSAL keeps them for 24 hours.
+            "http_cache": self._http_cache,
+        }
+        if not self.settings.msal_instance_discovery:
+            msal_options["instance_discovery"] = False
+        if self.cassette and self.cassette.replaying:
+            # Replay never reaches the tenant, so there is nothing to sign in to.
+            self.app = None
+            return
         if self.auth_mode == "delegated":
-            self.app = PublicClientApplication(
-                self.settings.client_id,
-                authority=self.settings.authority,
-                http_client=self.http_client,
-            )
-            self._delegated_result = None
+            self.app = PublicClientApplication(self.settings.client_id, **msal_options)
         else:
             self.app = ConfidentialClientApplication(
                 self.settings.client_id,
-                authority=self.settings.authority,
                 client_credential=self.settings.client_secret,
-                http_client=self.http_client,
+                **msal_options,
             )
+        # Building the app performs authority discovery, so persist what it fetched.
+        self._save_http_cache()
+
+    def _load_http_cache(self) -> Tuple[Dict, bytes]:
+        path = self.settings.msal_http_cache_path
+        if not path or not os.path.exists(path):
+            return {}, b""
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+            with os.fdopen(fd, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                # Unpickling runs code, so only trust a file nobody else could have written.
+                if hasattr(os, "getuid") and (stat.st_uid != os.getuid() or stat.st_mode & 0o077):
+                    print(f"授权元数据缓存 {path} 不属于当前用户或权限不是 0600，忽略并重新发现。")
+                    return {}, b""
+                blob = handle.read()
+            cache = pickle.loads(blob)
+        except Exception as exc:
+            print(f"读取授权元数据缓存失败，将重新发现: {exc}")
+            return {}, b""
+        return (cache, blob) if isinstance(cache, dict) else ({}, b"")
+
+    def _save_http_cache(self) -> None:
+        path = self.settings.msal_http_cache_path
+        if not path or not (self._http_cache or self._http_cache_blob):
+            return
+        # MSAL stores response objects, hence pickle (the format MSAL documents for http_cache).
+        blob = pickle.dumps(self._http_cache)
+        if blob == self._http_cache_blob:
+            return
+        tmp_path = f"{path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(blob)
+        os.replace(tmp_path, path)
+        self._http_cache_blob = blob
+
+    def _load_token_cache(self) -> None:
+        path = self.settings.token_cache_path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                self.token_cache.deserialize(handle.read())
+        except Exception as exc:
+            # A corrupt cache only costs one fresh sign-in.
+            print(f"读取令牌缓存失败，将重新获取令牌: {exc}")
+
+    def _save_token_cache(self) -> None:
+        path = self.settings.token_cache_path
+        if not path or not self.token_cache.has_state_changed:
+            return
+        tmp_path = f"{path}.tmp"
+        # The cache holds refresh tokens, so keep it private to the current user.
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            handle.write(self.token_cache.serialize())
+        os.replace(tmp_path, path)
+        self.token_cache.has_state_changed = False
 
     def _acquire_token(self) -> str:
+        if self.app is None:
+            return "cassette-replay"
+        skew = self.settings.token_refresh_skew_seconds
+        with self._token_lock:
+            if self._token and time.time() < self._token_expires_at - skew:
+                return self._token
+            result = self._acquire_token_result()
+            self._token = result["access_token"]
+            self._token_expires_at = time.time() + float(result.get("expires_in", 0))
+            self._save_token_cache()
+            self._save_http_cache()
+            return self._token
+
+    def _acquire_token_result(self) -> Dict:
         if self.auth_mode == "delegated":
-            if self._delegated_result and "access_token" in self._delegated_result:
-                return self._delegated_result["access_token"]
-            flow = self.app.initiate_device_flow(scopes=self.settings.delegated_scopes)
+            scopes = self.settings.delegated_scopes
+            # Silent acquisition serves a cached token or redeems the refresh token.
+            for account in self.app.get_accounts():
+                result = self.app.acquire_token_silent(scopes, account=account)
+                if result and "access_token" in result:
+                    return result
+            flow = self.app.initiate_device_flow(scopes=scopes)
             if "user_code" not in flow:
                 raise RuntimeError(f"Failed to create device flow: {flow}")
             print(
@@ -51,36 +357,259 @@ class GraphClient:
             result = self.app.acquire_token_by_device_flow(flow)
             if "access_token" not in result:
                 raise RuntimeError(f"Delegated auth failed: {result}")
-            self._delegated_result = result
-            return result["access_token"]
+            return result
 
+        # acquire_token_for_client looks up the token cache before calling the token endpoint.
         result = self.app.acquire_token_for_client(scopes=self.settings.scopes)
         if "access_token" not in result:
             raise RuntimeError(f"Failed to acquire token: {result}")
-        return result["access_token"]
+        return result
+
+    def coalesce(self):
+        """Scope (one keepalive cycle) in which identical GETs are sent at most once."""
+        return self.coalescer.scope()
+
+    def close(self) -> None:
+        """Release the connection pool, the hedging threads and the cassette file."""
+        with self._hedge_lock:
+            executor, self._hedge_executor = self._hedge_executor, None
+        if executor is not None:
+            # Losing hedge attempts still in flight finish on their own; nothing waits for them.
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.http_client.close()
+        if self.cassette:
+            self.cassette.close()
 
     def request(self, method: str, path: str, **kwargs) -> requests.Response:
-        token = self._acquire_token()
+        """
+        Send one Graph call through the shared rate limiter. Throttled (429/503/504)
+        responses are retried honouring Retry-After; transport errors are retried
+        only for idempotent methods. Other non-2xx responses raise GraphError.
+        """
+        if method.upper() != "GET":
+            try:
+                return self._request(method, path, **kwargs)
+            finally:
+                # Also on failure: the write may have landed even if the response was lost.
+                self.coalescer.invalidate(path)
+        return self._request(method, path, **kwargs)
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
         headers = kwargs.pop("headers", {})
-        headers.setdefault("Authorization", f"Bearer {token}")
         headers.setdefault("Content-Type", "application/json")
-        url = self.base_url + path.lstrip("/")
+        # @odata.nextLink values are absolute URLs.
+        url = path if path.startswith(("https://", "http://")) else self.base_url + path.lstrip("/")
+        max_retries = self.settings.graph_max_retries
+        endpoint = endpoint_template(url)
+
+        for attempt in range(max_retries + 1):
+            if not self.breaker.allow(endpoint):
+                raise CircuitOpenError(method, path, endpoint)
+            try:
+                headers["Authorization"] = f"Bearer {self._acquire_token()}"
+                self.limiter.acquire()
+            except BaseException:
+                # The endpoint was never reached; a half-open probe must not stay claimed.
+                self.breaker.release_probe(endpoint)
+                raise
+            started = time.perf_counter()
+            try:
+                response = self._send(method, url, endpoint, headers, kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.limiter.release()
+                self._record_health(endpoint, healthy=False)
+                self.metrics.record_attempt(
+                    method, url, None, time.perf_counter() - started, retry=attempt > 0
+                )
+                if method.upper() not in IDEMPOTENT_METHODS or attempt == max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+            except Exception:
+                # Decoding errors, cassette misses and the like must still free the slot.
+                self.limiter.release()
+                self.breaker.release_probe(endpoint)
+                raise
+
+            elapsed = time.perf_counter() - started
+            # 429 means Graph is up but pacing us; the rate limiter handles that.
+            self._record_health(endpoint, healthy=response.status_code < 500)
+            if method.upper() == "GET" and response.ok:
+                self.latencies.observe(endpoint, elapsed)
+            sent = getattr(response, "request", None)
+            self.metrics.record_attempt(
+                method,
+                url,
+                response.status_code,
+                elapsed,
+                bytes_sent=len(sent.body or b"") if sent is not None else 0,
+                bytes_received=_wire_bytes(response),
+                retry=attempt > 0,
+            )
+            throttled = response.status_code in RETRYABLE_STATUS
+            retry_after = parse_retry_after(response.headers) if throttled else None
+            self.limiter.release(throttled=throttled, retry_after=retry_after)
+            if not throttled or attempt == max_retries:
+                break
+            time.sleep(self._retry_delay(attempt, retry_after))
+
+        if not response.ok:
+            raise GraphError(method, path, response.status_code, response.text)
+        return response
+
+    def _record_health(self, endpoint: str, healthy: bool) -> None:
+        if self.breaker.record(endpoint, healthy):
+            print(
+                f"Graph 接口 {endpoint} 连续失败 {self.breaker.failure_threshold} 次，"
+                f"熔断 {self.breaker.cooldown_seconds:g} 秒后再试探。"
+            )
+
+    def _send(
+        self, method: str, url: str, endpoint: str, headers: Dict[str, str], kwargs: Dict
+    ) -> requests.Response:
+        if self.cassette and self.cassette.replaying:
+            return self.cassette.play(method, url, **kwargs)
+        delay = None
+        if self.settings.graph_hedge_percentile > 0 and method.upper() == "GET":
+            delay = self.latencies.percentile(endpoint, self.settings.graph_hedge_percentile)
+        if delay is None:
+            response = self._transmit(method, url, headers, kwargs)
+        else:
+            response = self._send_hedged(delay, method, url, headers, kwargs)
+        if self.cassette:
+            self.cassette.record(response, response.elapsed.total_seconds())
+        return response
 
-        response = requests.request(
+    def _transmit(self, method: str, url: str, headers: Dict[str, str], kwargs: Dict) -> requests.Response:
+        return self.http_client.request(
             method,
             url,
             headers=headers,
             timeout=self.settings.request_timeout,
             **kwargs,
         )
-        if not response.ok:
-            raise RuntimeError(
-                f"Graph {method} {path} failed {response.status_code}: {response.text}"
-            )
-        return response
+
+    def _send_hedged(
+        self, delay: float, method: str, url: str, headers: Dict[str, str], kwargs: Dict
+    ) -> requests.Response:
+        """
+        Send the GET; if it has not answered within `delay` (the endpoint's recent
+        latency percentile), send one duplicate and return whichever answers first.
+        A failed attempt only counts once the other one has failed too.
+
+        The duplicate holds a limiter slot of its own and is skipped when none is
+        free or the window has shrunk after throttling. The losing attempt cannot be
+        recalled: it runs to completion (bounded by the request timeout), its
+        response is dropped and it then frees its slot; only the returned response
+        feeds the limiter's throttle signal.
+        """
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * self.settings.graph_max_concurrency, thread_name_prefix="graph-hedge"
+                )
+        first = self._hedge_executor.submit(self._transmit, method, url, dict(headers), kwargs)
+        attempts = {first}
+        if not wait(attempts, timeout=delay).done and self.limiter.try_acquire_spare():
+            self.metrics.record_hedge(method, url)
+            try:
+                hedge = self._hedge_executor.submit(self._transmit, method, url, dict(headers), kwargs)
+            except BaseException:
+                self.limiter.release()
+                raise
+            hedge.add_done_callback(lambda _future: self.limiter.release())
+            attempts.add(hedge)
+        while True:
+            done, attempts = wait(attempts, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not attempts:
+                return next(iter(done)).result()
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        return retry_delay(
+            attempt,
+            self.settings.graph_retry_backoff_seconds,
+            self.settings.graph_retry_max_backoff_seconds,
+            retry_after,
+        )
+
+    def batch(self) -> GraphBatch:
+        return GraphBatch(self)
+
+    def iter_page_links(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        prefetch: Optional[bool] = None,
+        limit: Optional[int] = None,
+        resume_link: Optional[str] = None,
+    ) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """
+        Yield (page of `value` items, @odata.nextLink) pairs. With prefetch the next
+        page is requested in the background while the caller handles the current one.
+        Stops once `limit` items have been yielded; `resume_link` starts from a
+        nextLink saved by an earlier run instead of the first page.
+        """
+        if prefetch is None:
+            prefetch = self.settings.graph_prefetch_pages
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        seen = 0
+        try:
+            if resume_link:
+                payload = self.get(resume_link).json()
+            else:
+                payload = self.get(path, params=params).json()
+            while True:
+                page = payload.get("value", [])
+                next_link = payload.get("@odata.nextLink")
+                if limit is not None:
+                    page = page[: limit - seen]
+                seen += len(page)
+                if limit is not None and seen >= limit:
+                    next_link = None
+                upcoming = None
+                if next_link and executor:
+                    upcoming = executor.submit(self.get, next_link)
+                yield page, next_link
+                if not next_link:
+                    return
+                payload = (upcoming.result() if upcoming else self.get(next_link)).json()
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_pages(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        prefetch: Optional[bool] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[List[Dict]]:
+        """Yield each page of `value` items, following @odata.nextLink."""
+        for page, _ in self.iter_page_links(path, params=params, prefetch=prefetch, limit=limit):
+            yield page
+
+    def iter_values(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        prefetch: Optional[bool] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        for page in self.iter_pages(path, params=params, prefetch=prefetch, limit=limit):
+            yield from page
 
     def get(self, path: str, **kwargs) -> requests.Response:
-        return self.request("GET", path, **kwargs)
+        if kwargs.get("headers"):
+            # Header-dependent reads (e.g. ConsistencyLevel) are not shared.
+            return self.request("GET", path, **kwargs)
+        return self.coalescer.fetch(
+            RequestCoalescer.key(path, kwargs.get("params")),
+            lambda: self.request("GET", path, **kwargs),
+            on_shared=lambda: self.metrics.record_coalesced("GET", path),
+        )
 
     def post(self, path: str, **kwargs) -> requests.Response:
         return self.request("POST", path, **kwargs)
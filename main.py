@@ -1,6 +1,7 @@
 ﻿import argparse
 
-from planner_agent import run_keepalive_cycle
+# Heavy modules (msal, requests via planner_agent) are imported per command, so
+# --help and argument errors return immediately.
 
 
 def main():
@@ -9,31 +10,49 @@ def main():
     )
     parser.add_argument(
         "command",
-        choices=["keepalive", "delete_groups"],
+        choices=["keepalive", "daemon", "delete_groups"],
         help=(
             "keepalive: 创建一次邮箱检查任务，同时只保留最新一条并清理7天前的旧任务；"
+            "daemon: 常驻进程，按间隔（带随机抖动）重复执行 keepalive，复用令牌与连接；"
             "delete_groups: 删除所有包含Planner计划的组"
         ),
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="仅用于 delete_groups：只检查并列出将被删除的组，不执行删除",
+    )
     args = parser.parse_args()
 
     if args.command == "keepalive":
+        from planner_agent import run_keepalive_cycle
+
         run_keepalive_cycle()
+    elif args.command == "daemon":
+        from planner_agent import run_keepalive_daemon
+
+        run_keepalive_daemon()
     elif args.command == "delete_groups":
         from config import load_settings
         from planner_agent import PlannerAgent
 
         settings = load_settings()
         agent = PlannerAgent(settings)
-        deleted = agent.delete_all_planner_groups()
+        # Filled as groups are deleted, so an interrupted run still reports its progress.
+        deleted = []
+        try:
+            agent.delete_all_planner_groups(dry_run=args.dry_run, results=deleted)
+        except KeyboardInterrupt:
+            print(f"已中断：中断前已{'预览' if args.dry_run else '删除'} {len(deleted)} 个组。")
+            raise SystemExit(130)
+        finally:
+            agent.export_metrics()
         if not deleted:
             print("未找到包含Planner计划的组，未删除任何组。")
+        elif args.dry_run:
+            print(f"预览完成：共 {len(deleted)} 个组将被删除（未执行删除）。")
         else:
-            print("已删除以下组：")
-            for item in deleted:
-                print(
-                    f"- {item['group_name']} ({item['group_id']}), 计划数量: {item['plan_count']}"
-                )
+            print(f"已删除 {len(deleted)} 个组。")
 
 
 if __name__ == "__main__":
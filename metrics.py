@@ -0,0 +1,252 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from state_store import write_json_state
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Path segments that name a collection; the segment after one of them is an id.
+_COLLECTIONS = {
+    "users",
+    "groups",
+    "plans",
+    "buckets",
+    "tasks",
+    "mailFolders",
+    "messages",
+    "childFolders",
+    "members",
+    "owners",
+}
+_VERSION_SEGMENT = re.compile(r"^(v1\.0|beta)$")
+
+
+def endpoint_template(path: str) -> str:
+    """
+    Normalize a Graph path or absolute URL to a template such as
+    planner/buckets/{id}/tasks, so calls for different ids share one series.
+    """
+    segments = [segment for segment in urlsplit(path).path.split("/") if segment]
+    if segments and _VERSION_SEGMENT.match(segments[0]):
+        segments = segments[1:]
+    template: List[str] = []
+    for index, segment in enumerate(segments):
+        if index and segments[index - 1] in _COLLECTIONS and segment not in _COLLECTIONS:
+            template.append("{id}")
+        else:
+            template.append(segment)
+    return "/".join(template) or "/"
+
+
+class _EndpointStats:
+    __slots__ = (
+        "calls",
+        "attempts",
+        "retries",
+        "statuses",
+        "bucket_counts",
+        "latency_sum",
+        "bytes_sent",
+        "bytes_received",
+        "batched",
+        "hedges",
+        "coalesced",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.statuses: Counter = Counter()
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Sub-requests sent inside $batch envelopes: counted, but they have no latency of their own.
+        self.batched = 0
+        # Duplicate GETs sent because the first attempt was slower than the hedging delay.
+        self.hedges = 0
+        # GETs answered from the per-run memo or by joining an identical call in flight.
+        self.coalesced = 0
+
+
+class RequestMetrics:
+    """
+    Per-run Graph call statistics keyed by (method, endpoint template): calls,
+    attempts and retries, status codes, a latency histogram per attempt and
+    bytes on the wire. Thread-safe; exported as JSON or a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[tuple, _EndpointStats] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+    def _stats(self, method: str, path: str) -> _EndpointStats:
+        key = (method.upper(), endpoint_template(path))
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = self._endpoints[key] = _EndpointStats()
+        return stats
+
+    def record_attempt(
+        self,
+        method: str,
+        path: str,
+        status: Optional[int],
+        seconds: float,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        retry: bool = False,
+    ) -> None:
+        """One HTTP round trip; status None means a transport error."""
+        with self._lock:
+            stats = self._stats(method, path)
+            if retry:
+                stats.retries += 1
+            else:
+                stats.calls += 1
+            stats.attempts += 1
+            stats.statuses["error" if status is None else str(status)] += 1
+            stats.latency_sum += seconds
+            position = len(LATENCY_BUCKETS)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    position = index
+                    break
+            stats.bucket_counts[position] += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+
+    def record_batched(self, method: str, path: str, status: int, retry: bool = False) -> None:
+        with self._lock:
+            stats = self._stats(method, path)
+            if retry:
+                stats.retries += 1
+            else:
+                stats.batched += 1
+            stats.statuses[str(status)] += 1
+
+    def record_hedge(self, method: str, path: str) -> None:
+        with self._lock:
+            self._stats(method, path).hedges += 1
+
+    def record_coalesced(self, method: str, path: str) -> None:
+        with self._lock:
+            self._stats(method, path).coalesced += 1
+
+    def summary(self) -> Dict:
+        with self._lock:
+            endpoints = []
+            for (method, template), stats in self._endpoints.items():
+                cumulative = 0
+                histogram = {}
+                for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], stats.bucket_counts):
+                    cumulative += count
+                    histogram[bound] = cumulative
+                endpoints.append(
+                    {
+                        "method": method,
+                        "endpoint": template,
+                        "calls": stats.calls,
+                        "batched": stats.batched,
+                        "attempts": stats.attempts,
+                        "retries": stats.retries,
+                        "hedges": stats.hedges,
+                        "coalesced": stats.coalesced,
+                        "status": dict(stats.statuses),
+                        "latency_seconds_sum": round(stats.latency_sum, 6),
+                        "latency_seconds_buckets": histogram,
+                        "bytes_sent": stats.bytes_sent,
+                        "bytes_received": stats.bytes_received,
+                    }
+                )
+        endpoints.sort(key=lambda item: item["latency_seconds_sum"], reverse=True)
+        return {
+            "calls": sum(item["calls"] for item in endpoints),
+            "retries": sum(item["retries"] for item in endpoints),
+            "hedges": sum(item["hedges"] for item in endpoints),
+            "coalesced": sum(item["coalesced"] for item in endpoints),
+            "latency_seconds_sum": round(sum(item["latency_seconds_sum"] for item in endpoints), 6),
+            "endpoints": endpoints,
+        }
+
+    def to_prometheus(self) -> str:
+        endpoints = self.summary()["endpoints"]
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+
+        header("graph_requests_total", "counter", "Graph calls by endpoint template, including $batch sub-requests.")
+        for item in endpoints:
+            lines.append(f"graph_requests_total{_labels(item)} {item['calls'] + item['batched']}")
+        header("graph_retries_total", "counter", "Graph calls sent again after throttling or transport errors.")
+        for item in endpoints:
+            lines.append(f"graph_retries_total{_labels(item)} {item['retries']}")
+        header("graph_hedged_requests_total", "counter", "Duplicate GETs sent to cut tail latency.")
+        for item in endpoints:
+            lines.append(f"graph_hedged_requests_total{_labels(item)} {item['hedges']}")
+        header("graph_coalesced_requests_total", "counter", "GETs served by an identical call in the same run.")
+        for item in endpoints:
+            lines.append(f"graph_coalesced_requests_total{_labels(item)} {item['coalesced']}")
+        header("graph_responses_total", "counter", "Graph responses by status code.")
+        for item in endpoints:
+            for status, count in sorted(item["status"].items()):
+                lines.append(f"graph_responses_total{_labels(item, status=status)} {count}")
+        header("graph_request_duration_seconds", "histogram", "Latency of each Graph HTTP round trip.")
+        for item in endpoints:
+            if not item["attempts"]:
+                continue
+            for bound, count in item["latency_seconds_buckets"].items():
+                lines.append(f"graph_request_duration_seconds_bucket{_labels(item, le=bound)} {count}")
+            lines.append(f"graph_request_duration_seconds_sum{_labels(item)} {item['latency_seconds_sum']}")
+            lines.append(f"graph_request_duration_seconds_count{_labels(item)} {item['attempts']}")
+        header("graph_request_bytes_total", "counter", "Request body bytes sent to Graph.")
+        for item in endpoints:
+            lines.append(f"graph_request_bytes_total{_labels(item)} {item['bytes_sent']}")
+        header("graph_response_bytes_total", "counter", "Response body bytes received from Graph.")
+        for item in endpoints:
+            lines.append(f"graph_response_bytes_total{_labels(item)} {item['bytes_received']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path: str = "", prometheus_path: str = "") -> None:
+        """Write the JSON summary and/or Prometheus textfile; empty paths are skipped."""
+        write_json_state(json_path, self.summary())
+        if prometheus_path:
+            # Write then rename so a textfile collector never reads a partial file.
+            tmp_path = f"{prometheus_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                handle.write(self.to_prometheus())
+            os.replace(tmp_path, prometheus_path)
+
+    def report_lines(self, top: int = 5) -> List[str]:
+        summary = self.summary()
+        lines = [
+            f"Graph 调用 {summary['calls']} 次，重试 {summary['retries']} 次，合并重复 GET {summary['coalesced']} 次，"
+            f"累计耗时 {summary['latency_seconds_sum']:.2f}s"
+        ]
+        for item in summary["endpoints"][:top]:
+            if not item["attempts"]:
+                continue
+            lines.append(
+                f"- {item['method']} {item['endpoint']}: {item['attempts']} 次, "
+                f"{item['latency_seconds_sum']:.2f}s, 状态 {item['status']}"
+            )
+        return lines
+
+
+def _labels(item: Dict, **extra: str) -> str:
+    labels = {"method": item["method"], "endpoint": item["endpoint"], **extra}
+    body = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels.items()
+    )
+    return "{" + body + "}"
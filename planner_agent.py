@@ -1,40 +1,116 @@
-﻿from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, Tuple
+﻿from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import random
+import signal
+import threading
 import time
+from urllib.parse import quote
 
-from config import Settings, load_settings
-from graph_client import GraphClient
+from config import MailboxTarget, Settings, load_mailboxes, load_settings
+from graph_client import MAX_BATCH_SIZE, GraphClient, GraphError
+from retention import (
+    KeepLatestRule,
+    MaxAgeRule,
+    RetentionEngine,
+    RetentionPolicy,
+    RetentionRule,
+    TaskRecord,
+    parse_graph_datetime,  # noqa: F401 - re-exported for existing callers
+)
+from state_store import CursorStore, IdentityCache, TopologyIndex
 
 # Helper
 
-def parse_graph_datetime(value: str) -> datetime:
-    normalized = value.replace("Z", "+00:00")
-    if "." in normalized:
-        base, rest = normalized.split(".", 1)
-        offset = ""
-        # split offset if present
-        if "+" in rest:
-            digits, offset = rest.split("+", 1)
-            offset = "+" + offset
-        elif "-" in rest[1:]:
-            # avoid the leading '-' of fractional part by slicing from index 1
-            idx = rest[1:].find("-") + 1
-            digits, offset = rest[:idx], rest[idx:]
-        else:
-            digits = rest
-        digits = digits[:6]  # datetime.fromisoformat supports up to microseconds
-        normalized = f"{base}.{digits}{offset}"
-    return datetime.fromisoformat(normalized).astimezone(timezone.utc)
-
-
 def budget_exceeded(start: float, budget: float) -> bool:
     return budget > 0 and (time.monotonic() - start) > budget
 
 
+def _user_path(user_email: str) -> str:
+    # users/{upn} addresses a user directly, without a $filter query.
+    return f"users/{quote(user_email, safe='@')}"
+
+
+# What a mailbox's last summary task needs to be reused by INBOX_CHANGE_MODE.
+_SUMMARY_STATE_KEYS = (
+    "fingerprint",
+    "title",
+    "group",
+    "group_id",
+    "plan",
+    "plan_id",
+    "bucket",
+    "bucket_id",
+    "task_id",
+    "etag",
+    "notes_written",
+)
+
+
+# Fields each workflow reads per entity, sent as $select. @odata.etag is an annotation
+# Graph returns regardless. GRAPH_SELECT_PROFILE=full drops $select for debugging.
+SELECT_PROFILES: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "keepalive": {
+        "groups": ("id", "displayName"),
+        "plans": ("id", "title"),
+        "buckets": ("id", "name"),
+        "tasks": ("id", "title", "createdDateTime", "bucketId"),
+    },
+    # Only whether a group has plans matters here.
+    "delete_groups": {
+        "groups": ("id", "displayName"),
+        "plans": ("id",),
+    },
+}
+
+
+def _inbox_state_key(email: str, plan_title: str) -> str:
+    return f"{email.lower()}|{plan_title}"
+
+
+def inbox_fingerprint(result: Dict) -> str:
+    """Stable hash of the inbox counts and recent messages a summary is built from."""
+    material = json.dumps(
+        [result["unread"], result["total"], result["recent"]], ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def mailbox_notes(result: Dict) -> str:
+    """Task description for a mailbox summary result."""
+    lines = [
+        f"未读: {result['unread']} / 总: {result['total']}",
+        f"位置: 组 {result['group']} / 计划 {result['plan']} / 桶 {result['bucket']}",
+        "最近邮件:",
+    ]
+    for msg in result["recent"]:
+        lines.append(
+            f" - {'已读' if msg['isRead'] else '未读'} | {msg['received']} | {msg['from']} | {msg['subject']}"
+        )
+    return "\n".join(lines)
+
+
 class PlannerAgent:
     def __init__(self, settings: Settings):
         self.settings = settings
         self.client = GraphClient(settings)
+        self.topology = TopologyIndex(
+            settings.topology_cache_path, settings.topology_cache_ttl_seconds
+        )
+        self.cleanup_cursor = CursorStore(settings.cleanup_cursor_path, settings.cleanup_cursor_ttl_seconds)
+        # Last inbox fingerprint and summary task per mailbox, for INBOX_CHANGE_MODE.
+        self.inbox_state = CursorStore(settings.inbox_state_path)
+        self.user_ids = IdentityCache(
+            settings.user_id_cache_path,
+            settings.user_id_cache_ttl_seconds,
+            settings.user_id_cache_max_entries,
+        )
+        # Workflow whose SELECT_PROFILES entry the list accessors apply.
+        self.workflow = "keepalive"
+        # Entities whose endpoint rejected $select; listed in full from then on.
+        self._unselectable: set = set()
 
     def _build_task_title(self, plan: Dict) -> str:
         plan_title = plan.get("title") or "plan"
@@ -45,17 +121,90 @@ class PlannerAgent:
     # Graph accessors
     def get_user_id(self, user_email: Optional[str] = None) -> str:
         email = user_email or self.settings.user_email
-        response = self.client.get(
-            "users", params={"$filter": f"userPrincipalName eq '{email}'"}
+        cached = self.user_ids.get(email)
+        if cached:
+            return cached
+        try:
+            response = self.client.get(_user_path(email), params={"$select": "id"})
+        except GraphError as exc:
+            if exc.status_code == 404:
+                raise ValueError(f"No user found for email {email}") from exc
+            raise
+        user_id = response.json()["id"]
+        self.user_ids.put(email, user_id)
+        return user_id
+
+    def resolve_user_ids(self, user_emails: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Map many UPNs to user ids: cached ones locally, the rest through $batch
+        (20 lookups per call). Unknown users map to None.
+        """
+        resolved: Dict[str, Optional[str]] = {}
+        missing: List[str] = []
+        for email in dict.fromkeys(user_emails):
+            resolved[email] = self.user_ids.get(email)
+            if not resolved[email]:
+                missing.append(email)
+        if not missing:
+            return resolved
+        batch = self.client.batch()
+        for email in missing:
+            batch.add("GET", _user_path(email), params={"$select": "id"})
+        found: Dict[str, str] = {}
+        for email, item in zip(missing, batch.execute()):
+            if item.ok:
+                found[email] = item.json()["id"]
+            elif item.status_code != 404:
+                print(f"解析用户 {email} 失败: {item.error}")
+        self.user_ids.put_many(found)
+        resolved.update(found)
+        return resolved
+
+    def _page_params(self, page_size: Optional[int] = None) -> Dict:
+        size = page_size or self.settings.graph_page_size
+        return {"$top": size} if size > 0 else {}
+
+    def _select_params(self, entity: str) -> Dict:
+        if self.settings.graph_select_profile == "full" or entity in self._unselectable:
+            return {}
+        fields = SELECT_PROFILES.get(self.workflow, SELECT_PROFILES["keepalive"]).get(entity)
+        return {"$select": ",".join(fields)} if fields else {}
+
+    def _iter_projected(self, entity: str, path: str, params: Optional[Dict] = None) -> Iterator[Dict]:
+        """iter_values with the workflow's $select for `entity`."""
+        return self._with_select_fallback(
+            entity, params, lambda query: self.client.iter_values(path, params=query)
+        )
+
+    def _with_select_fallback(
+        self, entity: str, params: Optional[Dict], list_with: Callable[[Optional[Dict]], Iterator]
+    ) -> Iterator:
+        """
+        list_with(params plus the workflow's $select for `entity`). An endpoint that
+        answers 400 to the projection before yielding anything is listed in full instead.
+        """
+        select = self._select_params(entity)
+        if not select:
+            yield from list_with(params or None)
+            return
+        yielded = False
+        try:
+            for item in list_with({**(params or {}), **select}):
+                yielded = True
+                yield item
+        except GraphError as exc:
+            if exc.status_code != 400 or yielded:
+                raise
+            self._unselectable.add(entity)
+            yield from list_with(params or None)
+
+    def iter_messages(self, user_id: str, limit: Optional[int] = None) -> Iterator[Dict]:
+        return self.client.iter_values(
+            f"users/{user_id}/messages", params=self._page_params(limit), limit=limit
         )
-        users = response.json().get("value", [])
-        if not users:
-            raise ValueError(f"No user found for email {email}")
-        return users[0]["id"]
 
     def list_messages(self, user_id: str, top: int = 10) -> List[Dict]:
-        response = self.client.get(f"users/{user_id}/messages", params={"$top": top})
-        return response.json().get("value", [])
+        return list(self.iter_messages(user_id, limit=top))
 
     def inbox_overview(self, user_id: str) -> Dict:
         response = self.client.get(
@@ -75,16 +224,28 @@ class PlannerAgent:
         )
         return response.json().get("value", [])
 
+    def iter_groups(self, page_size: Optional[int] = None) -> Iterator[Dict]:
+        return self._iter_projected("groups", "groups", self._page_params(page_size))
+
     def list_groups(self) -> List[Dict]:
-        response = self.client.get("groups")
-        return response.json().get("value", [])
+        return list(self.iter_groups())
 
     def delete_group(self, group_id: str) -> None:
         self.client.delete(f"groups/{group_id}")
 
+    def delete_groups(self, group_ids: List[str]) -> List[Optional[Exception]]:
+        """Delete groups through $batch; returns one error (or None) per group id."""
+        batch = self.client.batch()
+        for group_id in group_ids:
+            batch.add("DELETE", f"groups/{group_id}")
+        return [item.error for item in batch.execute()]
+
+    # Planner list endpoints do not accept $top; they page by @odata.nextLink only.
+    def iter_plans(self, group_id: str) -> Iterator[Dict]:
+        return self._iter_projected("plans", f"groups/{group_id}/planner/plans")
+
     def list_plans(self, group_id: str) -> List[Dict]:
-        response = self.client.get(f"groups/{group_id}/planner/plans")
-        return response.json().get("value", [])
+        return list(self.iter_plans(group_id))
 
     def create_plan(self, group_id: str, plan_title: str) -> Dict:
         response = self.client.post(
@@ -93,9 +254,11 @@ class PlannerAgent:
         )
         return response.json()
 
+    def iter_buckets(self, plan_id: str) -> Iterator[Dict]:
+        return self._iter_projected("buckets", f"planner/plans/{plan_id}/buckets")
+
     def list_buckets(self, plan_id: str) -> List[Dict]:
-        response = self.client.get(f"planner/plans/{plan_id}/buckets")
-        return response.json().get("value", [])
+        return list(self.iter_buckets(plan_id))
 
     def create_bucket(self, plan_id: str, name: str = "待办事项") -> Dict:
         response = self.client.post(
@@ -104,23 +267,71 @@ class PlannerAgent:
         )
         return response.json()
 
+    def iter_tasks(self, bucket_id: str) -> Iterator[Dict]:
+        return self._iter_projected("tasks", f"planner/buckets/{bucket_id}/tasks")
+
     def list_tasks(self, bucket_id: str) -> List[Dict]:
-        response = self.client.get(f"planner/buckets/{bucket_id}/tasks")
-        return response.json().get("value", [])
+        return list(self.iter_tasks(bucket_id))
 
-    def create_task(self, plan_id: str, bucket_id: str, title: str) -> Dict:
-        response = self.client.post(
-            "planner/tasks",
-            json={"planId": plan_id, "bucketId": bucket_id, "title": title},
+    def iter_plan_tasks(self, plan_id: str) -> Iterator[Dict]:
+        """Every task in the plan as one paginated stream, regardless of bucket."""
+        return self._iter_projected("tasks", f"planner/plans/{plan_id}/tasks")
+
+    def iter_plan_task_pages(
+        self, plan_id: str, resume_link: Optional[str] = None
+    ) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """Pages of plan tasks with their nextLink, so a sweep can save its position."""
+        path = f"planner/plans/{plan_id}/tasks"
+        if resume_link:
+            # Graph carries $select into the nextLink, so a resumed sweep keeps the projection.
+            return self.client.iter_page_links(path, resume_link=resume_link)
+        return self._with_select_fallback(
+            "tasks", None, lambda query: self.client.iter_page_links(path, params=query)
         )
+
+    def list_plan_tasks(self, plan_id: str) -> List[Dict]:
+        return list(self.iter_plan_tasks(plan_id))
+
+    def bucket_names(self, plan_id: str) -> Dict[str, str]:
+        """Bucket id -> name for a plan, used to label tasks from iter_plan_tasks."""
+        return {bucket["id"]: bucket.get("name") for bucket in self.iter_buckets(plan_id)}
+
+    def create_task(
+        self, plan_id: str, bucket_id: str, title: str, description: Optional[str] = None
+    ) -> Dict:
+        payload: Dict = {"planId": plan_id, "bucketId": bucket_id, "title": title}
+        if description is not None:
+            # Task details can be set in the create call, saving the GET etag + PATCH round trips.
+            payload["details"] = {"description": description}
+        response = self.client.post("planner/tasks", json=payload)
         return response.json()
 
+    def update_task(self, task_id: str, etag: str, fields: Dict) -> Dict:
+        """PATCH a task; returns the updated task (with its new etag) when Graph sends it."""
+        response = self.client.patch(
+            f"planner/tasks/{task_id}",
+            headers={"If-Match": etag, "Prefer": "return=representation"},
+            json=fields,
+        )
+        return response.json() if response.text else {}
+
     def delete_task(self, task_id: str, etag: str) -> None:
         self.client.delete(
             f"planner/tasks/{task_id}",
             headers={"If-Match": etag},
         )
 
+    def delete_tasks(self, tasks: List[Tuple[str, str]]) -> List[Optional[Exception]]:
+        """Delete (task_id, etag) pairs through $batch; returns one error (or None) per task."""
+        batch = self.client.batch()
+        for task_id, etag in tasks:
+            batch.add("DELETE", f"planner/tasks/{task_id}", headers={"If-Match": etag})
+        return [item.error for item in batch.execute()]
+
+    def get_task(self, task_id: str) -> Dict:
+        response = self.client.get(f"planner/tasks/{task_id}")
+        return response.json()
+
     def get_task_details(self, task_id: str) -> Dict:
         response = self.client.get(f"planner/tasks/{task_id}/details")
         return response.json()
@@ -135,48 +346,141 @@ class PlannerAgent:
 
     # Workflows
     def find_plan(self, plan_title: str) -> Optional[Tuple[Dict, Dict]]:
-        for group in self.list_groups():
-            for plan in self.list_plans(group["id"]):
+        cached = self.topology.lookup(plan_title)
+        if cached:
+            return cached[0], cached[1]
+        located = self._discover_plan(plan_title)
+        if located:
+            self.topology.put(plan_title, *located)
+        return located
+
+    def _discover_plan(self, plan_title: str) -> Optional[Tuple[Dict, Dict]]:
+        workers = self.settings.discovery_workers
+        # Which groups the concurrent search probes depends on timing; a replayed cassette
+        # only holds the probes of the recorded run, and a sequential search never goes past them.
+        replaying = self.client.cassette is not None and self.client.cassette.replaying
+        if workers > 1 and not replaying:
+            return self._find_plan_concurrent(plan_title, workers)
+        for group in self.iter_groups():
+            for plan in self.iter_plans(group["id"]):
                 if plan.get("title") == plan_title:
                     return group, plan
         return None
 
+    def _find_plan_concurrent(self, plan_title: str, workers: int) -> Optional[Tuple[Dict, Dict]]:
+        """
+        Probe groups for the plan on a bounded thread pool. Returns the same match as
+        the sequential search (the first group in listing order that has the plan):
+        a hit is returned once every earlier group has been checked, and only the
+        lookups for groups after a known hit are cancelled or skipped.
+        """
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="find-plan")
+        in_flight: Dict[Future, int] = {}
+        groups: List[Dict] = []
+        # Group index -> its matching plan (or None) for lookups not yet resolved in order.
+        outcomes: Dict[int, Optional[Dict]] = {}
+        checked = 0
+        first_hit: Optional[int] = None
+
+        def collect() -> Optional[Tuple[Dict, Dict]]:
+            nonlocal checked, first_hit
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                outcomes[index] = next(
+                    (plan for plan in future.result() if plan.get("title") == plan_title), None
+                )
+                if outcomes[index] and (first_hit is None or index < first_hit):
+                    first_hit = index
+            if first_hit is not None:
+                for future, index in list(in_flight.items()):
+                    if index > first_hit and future.cancel():
+                        del in_flight[future]
+            while checked in outcomes:
+                plan = outcomes.pop(checked)
+                if plan:
+                    return groups[checked], plan
+                checked += 1
+            return None
+
+        try:
+            for group in self.iter_groups():
+                if first_hit is not None:
+                    break
+                groups.append(group)
+                in_flight[executor.submit(self.list_plans, group["id"])] = len(groups) - 1
+                # Keep the queue short so an early hit leaves little work to cancel.
+                if len(in_flight) >= workers * 2:
+                    located = collect()
+                    if located:
+                        return located
+            while in_flight:
+                located = collect()
+                if located:
+                    return located
+            return None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def ensure_plan_and_bucket(self, plan_title: str) -> Tuple[Dict, Dict, Dict]:
+        cached = self.topology.lookup(plan_title)
+        if cached and cached[2]:
+            return cached
+
         located = self.find_plan(plan_title)
         if located:
             group, plan = located
         else:
-            group = self.list_groups()[0] if self.list_groups() else None
+            group = next(self.iter_groups(), None)
             if not group:
                 raise ValueError("No group available to create plan")
             plan = self.create_plan(group["id"], plan_title)
 
-        bucket = self.list_buckets(plan["id"])
-        bucket = bucket[0] if bucket else self.create_bucket(plan["id"])
+        try:
+            buckets = self.list_buckets(plan["id"])
+        except GraphError as exc:
+            if exc.status_code != 404 or not cached:
+                raise
+            # The cached plan no longer exists: forget it and rediscover.
+            self.topology.invalidate(plan_title)
+            return self.ensure_plan_and_bucket(plan_title)
+        bucket = buckets[0] if buckets else self.create_bucket(plan["id"])
+        self.topology.put(plan_title, group, plan, bucket)
         return group, plan, bucket
 
-    def create_mailbox_summary_task(self, plan_title: str, recent_top: int = 5) -> Dict:
-        user_id = self.get_user_id()
-        overview = self.inbox_overview(user_id)
+    def create_mailbox_summary_task(
+        self,
+        plan_title: str,
+        recent_top: int = 5,
+        user_email: Optional[str] = None,
+        title_prefix: Optional[str] = None,
+        write_notes: bool = False,
+    ) -> Dict:
+        """
+        Create the summary task. With write_notes the summary goes into the task
+        details in the same POST; `notes_written` reports whether Graph took it.
+        """
+        user_email = user_email or self.settings.user_email
+        user_id = self.get_user_id(user_email)
+        try:
+            overview = self.inbox_overview(user_id)
+        except GraphError as exc:
+            if exc.status_code != 404:
+                raise
+            # A cached id can outlive a deleted and recreated account.
+            self.user_ids.invalidate(user_email)
+            user_id = self.get_user_id(user_email)
+            overview = self.inbox_overview(user_id)
         recent = self.inbox_recent_messages(user_id, top=recent_top)
 
         unread = overview.get("unreadItemCount", 0)
         total = overview.get("totalItemCount", 0)
         latest_subject = recent[0]["subject"] if recent else "无最新邮件"
         timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-        title = f"{plan_title}-{timestamp} 未读:{unread} 总:{total} 最新:{latest_subject[:30]}"
-
-        group, plan, bucket = self.ensure_plan_and_bucket(plan_title)
-
-        task = self.create_task(plan["id"], bucket["id"], title)
-        return {
-            "group": group.get("displayName"),
-            "group_id": group.get("id"),
-            "plan": plan.get("title"),
-            "plan_id": plan.get("id"),
-            "bucket": bucket.get("name"),
-            "bucket_id": bucket.get("id"),
-            "task_id": task.get("id"),
+        prefix = title_prefix or plan_title
+        title = f"{prefix}-{timestamp} 未读:{unread} 总:{total} 最新:{latest_subject[:30]}"
+        result = {
+            "mailbox": user_email,
             "title": title,
             "unread": unread,
             "total": total,
@@ -190,112 +494,360 @@ class PlannerAgent:
                 for m in recent
             ],
         }
+        result["fingerprint"] = inbox_fingerprint(result)
+        state_key = _inbox_state_key(user_email, plan_title)
+        if self.settings.inbox_change_mode in ("touch", "skip"):
+            reused = self._reuse_unchanged_task(state_key, result)
+            if reused:
+                return reused
+
+        group, plan, bucket = self.ensure_plan_and_bucket(plan_title)
+        try:
+            task = self._create_summary_task(result, group, plan, bucket, write_notes)
+        except GraphError as exc:
+            if exc.status_code != 404:
+                raise
+            # Stale cached bucket (or plan): drop just the bucket and resolve again.
+            self.topology.invalidate(plan_title, bucket_only=True)
+            group, plan, bucket = self.ensure_plan_and_bucket(plan_title)
+            task = self._create_summary_task(result, group, plan, bucket, write_notes)
+        result.update(
+            {
+                "group": group.get("displayName"),
+                "group_id": group.get("id"),
+                "plan": plan.get("title"),
+                "plan_id": plan.get("id"),
+                "bucket": bucket.get("name"),
+                "bucket_id": bucket.get("id"),
+                "task_id": task.get("id"),
+                "etag": task.get("@odata.etag"),
+            }
+        )
+        if self.settings.inbox_change_mode in ("touch", "skip"):
+            self._remember_summary(state_key, result)
+        return result
+
+    def _remember_summary(self, state_key: str, result: Dict) -> None:
+        self.inbox_state.save(state_key, {key: result.get(key) for key in _SUMMARY_STATE_KEYS})
+
+    def _reuse_unchanged_task(self, state_key: str, result: Dict) -> Optional[Dict]:
+        """
+        When the inbox fingerprint matches the last run, keep that run's task instead
+        of creating a new one: "touch" retitles it with the current timestamp,
+        "skip" writes nothing. Returns None when a new task is needed.
+        """
+        state = self.inbox_state.load(state_key)
+        if state.get("fingerprint") != result["fingerprint"] or not state.get("task_id"):
+            return None
+        if self.settings.inbox_change_mode == "touch" and state.get("etag"):
+            try:
+                task = self.update_task(state["task_id"], state["etag"], {"title": result["title"]})
+            except GraphError as exc:
+                if exc.status_code not in (404, 412):
+                    raise
+                # Deleted or edited since the last run: fall back to a fresh task.
+                self.inbox_state.clear(state_key)
+                return None
+            etag = task.get("@odata.etag")
+            if not etag:
+                # Graph answered 204 despite the Prefer header; the old etag is stale now.
+                etag = self.get_task(state["task_id"]).get("@odata.etag")
+            state.update(etag=etag, title=result["title"])
+            self._remember_summary(state_key, state)
+        result.update({key: state.get(key) for key in _SUMMARY_STATE_KEYS})
+        result["unchanged"] = True
+        return result
+
+    def _create_summary_task(
+        self, result: Dict, group: Dict, plan: Dict, bucket: Dict, write_notes: bool
+    ) -> Dict:
+        result["notes_written"] = False
+        if write_notes:
+            location = {"group": group.get("displayName"), "plan": plan.get("title"), "bucket": bucket.get("name")}
+            description = mailbox_notes(dict(result, **location))
+            try:
+                task = self.create_task(plan["id"], bucket["id"], result["title"], description=description)
+                result["notes_written"] = True
+                return task
+            except GraphError as exc:
+                if exc.status_code != 400:
+                    raise
+                # Details rejected on create: create the bare task and write notes afterwards.
+                print(f"创建任务时写入备注失败，改为单独写入: {exc}")
+        return self.create_task(plan["id"], bucket["id"], result["title"])
 
-    def create_mailbox_summary_task_with_notes(self, plan_title: str, recent_top: int = 5) -> Dict:
-        result = self.create_mailbox_summary_task(plan_title=plan_title, recent_top=recent_top)
+    def create_mailbox_summary_task_with_notes(
+        self,
+        plan_title: str,
+        recent_top: int = 5,
+        user_email: Optional[str] = None,
+        title_prefix: Optional[str] = None,
+    ) -> Dict:
+        """
+        Summary task with the mailbox summary as its notes, written on creation.
+        If Graph refuses details in the create call, falls back to reading the
+        details etag and patching the description.
+        """
+        result = self.create_mailbox_summary_task(
+            plan_title=plan_title,
+            recent_top=recent_top,
+            user_email=user_email,
+            title_prefix=title_prefix,
+            write_notes=True,
+        )
+        if result["notes_written"] or result.get("unchanged"):
+            return result
         details = self.get_task_details(result["task_id"])
         etag = details.get("@odata.etag")
         if etag:
-            lines = [
-                f"未读: {result['unread']} / 总: {result['total']}",
-                f"位置: 组 {result['group']} / 计划 {result['plan']} / 桶 {result['bucket']}",
-                "最近邮件:",
-            ]
-            for msg in result["recent"]:
-                lines.append(
-                    f" - {'已读' if msg['isRead'] else '未读'} | {msg['received']} | {msg['from']} | {msg['subject']}"
-                )
-            description = "\n".join(lines)
             try:
-                self.update_task_description(result["task_id"], etag, description)
+                self.update_task_description(result["task_id"], etag, mailbox_notes(result))
                 result["notes_written"] = True
+                if self.settings.inbox_change_mode in ("touch", "skip"):
+                    self._remember_summary(_inbox_state_key(result["mailbox"], plan_title), result)
             except Exception as exc:
                 print(f"写入任务备注失败: {exc}")
-                result["notes_written"] = False
                 result["notes_error"] = str(exc)
-        else:
-            result["notes_written"] = False
         return result
 
+    # Retention
+    def _plan_from_context(
+        self, plan_title: Optional[str], plan_context: Optional[Dict[str, str]]
+    ) -> Optional[Tuple[Dict, Dict]]:
+        if plan_context and plan_context.get("plan_id"):
+            return (
+                {"displayName": plan_context.get("group", ""), "id": plan_context.get("group_id")},
+                {"title": plan_context.get("plan", plan_title), "id": plan_context["plan_id"]},
+            )
+        return self.find_plan(plan_title) if plan_title else None
+
+    def _delete_planned(self, planned: List[Dict], group: Dict, plan: Dict, removed: List[Dict]) -> None:
+        errors = self.delete_tasks([(item["task_id"], item["etag"]) for item in planned])
+        for item, error in zip(planned, errors):
+            if error is not None:
+                print(
+                    f"Delete failed for task {item['task_id']} "
+                    f"({item['title']}) in plan {plan.get('title')}: {error}"
+                )
+                continue
+            removed.append(
+                {
+                    "group": group.get("displayName"),
+                    "plan": plan.get("title"),
+                    "bucket": item["bucket"],
+                    "task_id": item["task_id"],
+                    "title": item["title"],
+                    "created_at": item["created_at"],
+                    "reason": item["reason"],
+                }
+            )
+        planned.clear()
+
+    def _apply_retention_to_plan(
+        self, policy: RetentionPolicy, group: Dict, plan: Dict, removed: List[Dict], start: float
+    ) -> bool:
+        """
+        One pass over the plan's task stream, deleting what the policy selects in
+        $batch chunks. Listing is the producer: full chunks go to a pool of
+        cleanup_delete_workers, with at most twice that many chunks queued, so page
+        fetches and deletions overlap. The delete cap is applied as tasks are listed;
+        when the time budget runs out, queued chunks that have not started are
+        saved with the cursor instead of being sent.
+        Returns False when the time budget or delete cap stopped it;
+        in that case the page position, the keep-latest heap and the deletions turned
+        away by the cap are saved so the next run continues the same sweep.
+        """
+        budget = self.settings.cleanup_time_budget_seconds
+        # Keyed by sweep rather than rule set: a sweep whose rules change between
+        # runs (keepalive drops its duplicate rule when the inbox is unchanged)
+        # replaces its old cursor instead of leaving it behind.
+        cursor_key = f"{plan['id']}:{policy.sweep}"
+        cursor = self.cleanup_cursor.load(cursor_key)
+        if cursor and cursor.get("rules") != policy.signature():
+            # Progress made under other rules cannot be resumed; start this sweep over.
+            self.cleanup_cursor.clear(cursor_key)
+            cursor = {}
+        resume_link = cursor.get("next_link")
+        engine = RetentionEngine(policy)
+        # Tasks already held by the restored heap must not be counted twice.
+        kept_ids = set()
+        planned = engine.schedule(cursor.get("pending", []))
+        for state in cursor.get("kept", []):
+            record = TaskRecord.from_state(state)
+            kept_ids.add(record.task_id)
+            planned.extend(engine.feed_record(record))
+        if cursor:
+            print(f"从上次保存的进度继续清理计划 {plan.get('title')}。")
+
+        bucket_names = self.bucket_names(plan["id"])
+        print(
+            f"检查任务: 组[{group.get('displayName')}] 计划[{plan.get('title')}] "
+            f"共 {len(bucket_names)} 个桶"
+        )
+        delete_workers = max(1, self.settings.cleanup_delete_workers)
+        deletes = ThreadPoolExecutor(max_workers=delete_workers, thread_name_prefix="delete-tasks")
+        deleting: Dict[Future, List[Dict]] = {}
+
+        def finish_deletes(return_when: str) -> None:
+            done, _ = wait(deleting, return_when=return_when)
+            for future in done:
+                deleting.pop(future)
+                future.result()
+
+        def flush(force: bool) -> None:
+            while len(planned) >= MAX_BATCH_SIZE or (force and planned):
+                chunk = planned[:MAX_BATCH_SIZE]
+                del planned[:MAX_BATCH_SIZE]
+                # Listing only waits when the hand-off queue is full.
+                while len(deleting) >= delete_workers * 2:
+                    finish_deletes(FIRST_COMPLETED)
+                deleting[deletes.submit(self._delete_planned, chunk, group, plan, removed)] = chunk
+
+        page_link = resume_link
+        completed = True
+        restart = False
+        try:
+            try:
+                for tasks, next_link in self.iter_plan_task_pages(plan["id"], resume_link=resume_link):
+                    for task in tasks:
+                        if budget_exceeded(start, budget):
+                            print("任务清理超出时间预算，停止。")
+                            completed = False
+                            break
+                        if task.get("id") in kept_ids:
+                            continue
+                        planned.extend(engine.feed(task, bucket_names.get(task.get("bucketId"))))
+                        if engine.capped:
+                            completed = False
+                            break
+                        flush(force=False)
+                    if not completed:
+                        break
+                    page_link = next_link
+            except GraphError as exc:
+                if not resume_link or page_link != resume_link:
+                    raise
+                # The saved nextLink is no longer accepted: drop the cursor and start over.
+                print(f"保存的清理进度已失效，重新开始: {exc}")
+                self.cleanup_cursor.clear(cursor_key)
+                restart = True
+            flush(force=True)
+        finally:
+            if not completed and budget_exceeded(start, budget):
+                for future, chunk in list(deleting.items()):
+                    if future.cancel():
+                        del deleting[future]
+                        engine.overflow.extend(chunk)
+            # Chunks already being sent cannot be recalled; wait so `removed` is complete.
+            if deleting:
+                finish_deletes(ALL_COMPLETED)
+            deletes.shutdown(wait=False, cancel_futures=True)
+        if restart:
+            return self._apply_retention_to_plan(policy, group, plan, removed, start)
+
+        if completed:
+            self.cleanup_cursor.clear(cursor_key)
+            return True
+        self.cleanup_cursor.save(
+            cursor_key,
+            {
+                "rules": policy.signature(),
+                # Restart from the page that was being processed when the run stopped.
+                "next_link": page_link,
+                "kept": [record.to_state() for record in engine.kept()],
+                "pending": engine.overflow,
+            },
+        )
+        if engine.capped:
+            print(
+                f"已删除 {len(removed)} 条，达到本次上限 {policy.max_deletes}，进度已保存，下次运行继续清理。"
+            )
+        return False
+
+    def apply_retention(
+        self,
+        policy: RetentionPolicy,
+        plan_title: Optional[str] = None,
+        plan_context: Optional[Dict[str, str]] = None,
+    ) -> List[Dict]:
+        """Evaluate every rule of the policy in a single pass over one plan's tasks."""
+        target_plan = plan_title or self.settings.mail_plan_title
+        removed: List[Dict] = []
+        if self._apply_retention_to_title(policy, target_plan, plan_context, removed, time.monotonic()) is None:
+            print(f"未找到计划 {target_plan}，跳过任务清理。")
+        return removed
+
+    def _apply_retention_to_title(
+        self,
+        policy: RetentionPolicy,
+        plan_title: Optional[str],
+        plan_context: Optional[Dict[str, str]],
+        removed: List[Dict],
+        start: float,
+    ) -> Optional[bool]:
+        """
+        _apply_retention_to_plan for a plan given by context or title. A plan id taken
+        from the context or the topology cache that Graph answers 404 for is forgotten
+        and the plan rediscovered by title once. Returns None when there is no such plan.
+        """
+        cached = bool(plan_context and plan_context.get("plan_id")) or (
+            bool(plan_title) and self.topology.lookup(plan_title) is not None
+        )
+        located = self._plan_from_context(plan_title, plan_context)
+        if not located:
+            return None
+        try:
+            return self._apply_retention_to_plan(policy, *located, removed=removed, start=start)
+        except GraphError as exc:
+            title = plan_title or located[1].get("title")
+            if exc.status_code != 404 or not cached or not title:
+                raise
+            print(f"缓存的计划 {title} 已不存在，重新查找: {exc}")
+            self.topology.invalidate(title)
+            return self._apply_retention_to_title(policy, title, None, removed, start)
+
     def cleanup_previous_week_tasks(
         self, plan_title: Optional[str] = None, plan_context: Optional[Dict[str, str]] = None
     ) -> List[Dict]:
-        now = datetime.now(timezone.utc)
-        threshold = now - timedelta(days=7)
         removed: List[Dict] = []
-        delete_limit = self.settings.max_delete_per_run
         start = time.monotonic()
         budget = self.settings.cleanup_time_budget_seconds
         if budget <= 0:
             print("过期任务清理被禁用。")
             return removed
 
-        groups_to_check = []
-        if plan_context and plan_context.get("plan_id"):
-            groups_to_check.append(
-                (
-                    {"displayName": plan_context.get("group", ""), "id": plan_context.get("group_id")},
-                    {"title": plan_context.get("plan", plan_title), "id": plan_context.get("plan_id")},
-                )
-            )
-        elif plan_title:
-            located = self.find_plan(plan_title)
-            if not located:
+        delete_limit = self.settings.max_delete_per_run
+        if plan_title or plan_context:
+            policy = RetentionPolicy([MaxAgeRule(max_age_days=7)], delete_limit, "previous-week")
+            if self._apply_retention_to_title(policy, plan_title, plan_context, removed, start) is None:
                 print(f"未找到计划 {plan_title}，跳过过期任务清理。")
-                return []
-            groups_to_check.append(located)
-        else:
-            for group in self.list_groups():
-                for plan in self.list_plans(group["id"]):
-                    groups_to_check.append((group, plan))
+            return removed
 
-        for group, plan in groups_to_check:
+        # Sweeps across every plan also remember which plans are already done.
+        sweep_key = "previous-week:all-plans"
+        done_plans = set(self.cleanup_cursor.load(sweep_key).get("done_plans", []))
+        targets = ((group, plan) for group in self.iter_groups() for plan in self.iter_plans(group["id"]))
+        finished = True
+        for group, plan in targets:
+            if plan["id"] in done_plans:
+                continue
             if budget_exceeded(start, budget):
                 print("过期任务清理超出时间预算，停止。")
-                return removed
-            for bucket in self.list_buckets(plan["id"]):
-                if budget_exceeded(start, budget):
-                    print("过期任务清理超出时间预算，停止。")
-                    return removed
-                tasks = self.list_tasks(bucket["id"])
-                print(
-                    f"检查任务: 组[{group.get('displayName')}] 计划[{plan.get('title')}] 桶[{bucket.get('name')}] "
-                    f"共 {len(tasks)} 条"
-                )
-                for task in tasks:
-                    if budget_exceeded(start, budget):
-                        print("过期任务清理超出时间预算，停止。")
-                        return removed
-                    title = task.get("title", "")
-                    created_at_raw = task.get("createdDateTime")
-                    etag = task.get("@odata.etag")
-                    if not created_at_raw or not etag:
-                        continue
-
-                    created_at = parse_graph_datetime(created_at_raw)
-                    if created_at < threshold:
-                        try:
-                            self.delete_task(task["id"], etag)
-                            removed.append(
-                                {
-                                    "group": group.get("displayName"),
-                                    "plan": plan.get("title"),
-                                    "bucket": bucket.get("name"),
-                                    "task_id": task.get("id"),
-                                    "title": title,
-                                    "created_at": created_at_raw,
-                                }
-                            )
-                        except Exception as exc:
-                            print(
-                                f"Delete failed for task {task.get('id')} "
-                                f"({title}) in plan {plan.get('title')}: {exc}"
-                            )
-                    if len(removed) >= delete_limit:
-                        print(
-                            f"已删除 {len(removed)} 条，达到本次上限 {delete_limit}，稍后再次运行继续清理。"
-                        )
-                        return removed
+                finished = False
+                break
+            if delete_limit > 0 and len(removed) >= delete_limit:
+                print(f"已删除 {len(removed)} 条，达到本次上限 {delete_limit}，稍后再次运行继续清理。")
+                finished = False
+                break
+            policy = RetentionPolicy([MaxAgeRule(max_age_days=7)], delete_limit - len(removed), "previous-week")
+            if not self._apply_retention_to_plan(policy, group, plan, removed, start):
+                finished = False
+                break
+            done_plans.add(plan["id"])
+        if finished:
+            self.cleanup_cursor.clear(sweep_key)
+        else:
+            self.cleanup_cursor.save(sweep_key, {"done_plans": sorted(done_plans)})
         return removed
 
     def cleanup_keepalive_duplicates(
@@ -308,117 +860,170 @@ class PlannerAgent:
         Remove older keepalive tasks in the specified plan, keeping only the latest N
         (default 1) by creation time across all buckets.
         """
-        target_plan = plan_title or self.settings.mail_plan_title
-        plan_id = None
-        group_name = None
-        if plan_context and plan_context.get("plan_id"):
-            plan_id = plan_context["plan_id"]
-            group_name = plan_context.get("group")
-        else:
-            located = self.find_plan(target_plan)
-            if not located:
-                print(f"未找到计划 {target_plan}，跳过重复任务清理。")
-                return []
-            target_group, plan = located
-            plan_id = plan.get("id")
-            group_name = target_group.get("displayName")
-        tasks_meta: List[Dict] = []
-        removed: List[Dict] = []
-        delete_limit = self.settings.max_delete_per_run
-        start = time.monotonic()
-        budget = self.settings.cleanup_time_budget_seconds
+        policy = RetentionPolicy(
+            [KeepLatestRule(keep=keep_latest)], self.settings.max_delete_per_run, "duplicates"
+        )
+        return self.apply_retention(policy, plan_title=plan_title, plan_context=plan_context)
 
-        for bucket in self.list_buckets(plan_id):
-            if budget_exceeded(start, budget):
-                print("重复任务清理超出时间预算，停止。")
-                return removed
-            for task in self.list_tasks(bucket["id"]):
-                if budget_exceeded(start, budget):
-                    print("重复任务清理超出时间预算，停止。")
-                    return removed
-                created_raw = task.get("createdDateTime")
-                etag = task.get("@odata.etag")
-                if not created_raw or not etag:
+    def delete_all_planner_groups(
+        self, dry_run: bool = False, results: Optional[List[Dict]] = None
+    ) -> List[Dict]:
+        """
+        删除所有包含 Planner 计划的组，返回删除的组信息。
+
+        Plan probes run on a bounded pool and groups with plans are deleted in
+        $batch chunks while probing continues, with at most group_delete_workers
+        chunks in flight. dry_run only probes and returns what would be deleted.
+        Each outcome is printed and appended to `results` as it completes, so a
+        caller passing its own list keeps the partial results if interrupted.
+        """
+        results = [] if results is None else results
+        previous_workflow, self.workflow = self.workflow, "delete_groups"
+        probe_workers = max(1, self.settings.discovery_workers)
+        delete_workers = max(1, self.settings.group_delete_workers)
+        probes = ThreadPoolExecutor(max_workers=probe_workers, thread_name_prefix="probe-plans")
+        deletes = ThreadPoolExecutor(max_workers=delete_workers, thread_name_prefix="delete-groups")
+        probing: Dict[Future, Dict] = {}
+        deleting: Dict[Future, List[Tuple[Dict, int]]] = {}
+        pending: List[Tuple[Dict, int]] = []
+        probed = found = 0
+
+        def record(group: Dict, plan_count: int) -> None:
+            item = {
+                "group_id": group.get("id"),
+                "group_name": group.get("displayName"),
+                "plan_count": plan_count,
+            }
+            if dry_run:
+                item["dry_run"] = True
+                print(f"[预览] 将删除组 {item['group_name']} ({item['group_id']})，计划数量: {plan_count}")
+            else:
+                print(f"已删除组 {item['group_name']} ({item['group_id']})，计划数量: {plan_count}")
+            results.append(item)
+
+        def finish_deletes(return_when: str) -> None:
+            done, _ = wait(deleting, return_when=return_when)
+            for future in done:
+                chunk = deleting.pop(future)
+                if future.cancelled():
                     continue
                 try:
-                    created_dt = parse_graph_datetime(created_raw)
-                except Exception:
+                    errors = future.result()
+                except Exception as exc:
+                    errors = [exc] * len(chunk)
+                for (group, plan_count), error in zip(chunk, errors):
+                    if error is not None:
+                        print(
+                            f"Delete failed for group {group.get('displayName')} "
+                            f"({group.get('id')}): {error}"
+                        )
+                        continue
+                    record(group, plan_count)
+
+        def flush(force: bool) -> None:
+            while len(pending) >= MAX_BATCH_SIZE or (force and pending):
+                chunk = pending[:MAX_BATCH_SIZE]
+                del pending[:MAX_BATCH_SIZE]
+                if dry_run:
+                    for group, plan_count in chunk:
+                        record(group, plan_count)
                     continue
-                tasks_meta.append(
-                    {
-                        "created_dt": created_dt,
-                        "created_raw": created_raw,
-                        "task": task,
-                        "etag": etag,
-                        "bucket": bucket.get("name"),
-                        "plan": target_plan,
-                        "group": group_name or "",
-                    }
-                )
+                while len(deleting) >= delete_workers:
+                    finish_deletes(FIRST_COMPLETED)
+                ids = [group["id"] for group, _ in chunk]
+                deleting[deletes.submit(self.delete_groups, ids)] = chunk
 
-        tasks_meta.sort(key=lambda item: item["created_dt"], reverse=True)
-        to_delete = tasks_meta[keep_latest:]
+        def finish_probes() -> None:
+            nonlocal probed, found
+            done, _ = wait(probing, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = probing.pop(future)
+                probed += 1
+                try:
+                    plans = future.result()
+                except Exception as exc:
+                    print(f"查询组 {group.get('displayName')} ({group.get('id')}) 的计划失败: {exc}")
+                    continue
+                if plans:
+                    found += 1
+                    pending.append((group, len(plans)))
+                if probed % 100 == 0:
+                    print(f"已检查 {probed} 个组，{found} 个包含计划。")
+            flush(force=False)
 
-        for item in to_delete:
-            if len(removed) >= delete_limit:
-                print(
-                    f"已删除 {len(removed)} 条重复任务，达到上限 {delete_limit}，稍后再次运行继续清理。"
-                )
-                break
-            task = item["task"]
-            try:
-                self.delete_task(task["id"], item["etag"])
-                removed.append(
-                    {
-                        "group": item["group"],
-                        "plan": item["plan"],
-                        "bucket": item["bucket"],
-                        "task_id": task.get("id"),
-                        "title": task.get("title"),
-                        "created_at": item["created_raw"],
-                    }
-                )
-            except Exception as exc:
-                print(
-                    f"Delete failed for duplicate task {task.get('id')} "
-                    f"({task.get('title')}) in plan {item['plan']}: {exc}"
-                )
-        return removed
+        try:
+            for group in self.iter_groups():
+                probing[probes.submit(self.list_plans, group["id"])] = group
+                if len(probing) >= probe_workers * 2:
+                    finish_probes()
+            while probing:
+                finish_probes()
+            flush(force=True)
+            while deleting:
+                finish_deletes(FIRST_COMPLETED)
+        except BaseException:
+            for future in deleting:
+                future.cancel()
+            # Chunks already sent cannot be recalled; wait so results show what was deleted.
+            if deleting:
+                finish_deletes(ALL_COMPLETED)
+            raise
+        finally:
+            probes.shutdown(wait=False, cancel_futures=True)
+            deletes.shutdown(wait=False, cancel_futures=True)
+            self.workflow = previous_workflow
+        return results
 
-    def delete_all_planner_groups(self) -> List[Dict]:
-        """
-        删除所有包含 Planner 计划的组，返回删除的组信息。
-        """
-        deleted: List[Dict] = []
-        for group in self.list_groups():
-            plans = self.list_plans(group["id"])
-            if not plans:
-                continue
-            try:
-                self.delete_group(group["id"])
-                deleted.append(
-                    {
-                        "group_id": group.get("id"),
-                        "group_name": group.get("displayName"),
-                        "plan_count": len(plans),
-                    }
-                )
-            except Exception as exc:
-                print(
-                    f"Delete failed for group {group.get('displayName')} "
-                    f"({group.get('id')}): {exc}"
-                )
-        return deleted
+    def export_metrics(self) -> None:
+        """Print the slowest Graph endpoints and write the configured metrics files."""
+        metrics = self.client.metrics
+        for line in metrics.report_lines():
+            print(line)
+        if self.client.cassette:
+            for line in self.client.cassette.report_lines():
+                print(line)
+        try:
+            metrics.export(self.settings.metrics_json_path, self.settings.metrics_prometheus_path)
+        except OSError as exc:
+            print(f"写入请求指标失败: {exc}")
 
 
-def run_keepalive_cycle() -> None:
-    settings = load_settings()
-    agent = PlannerAgent(settings)
+def run_keepalive_cycle(
+    agent: Optional[PlannerAgent] = None, mailboxes: Optional[List[MailboxTarget]] = None
+) -> Optional[List[Dict]]:
+    """
+    One keepalive run. Passing an agent reuses its token, connection pool and
+    resolved plan context; metrics then cover just this cycle. With mailboxes
+    (or MAILBOXES_FILE) every listed mailbox is processed and one result per
+    mailbox is returned.
+    """
+    if agent is None:
+        agent = PlannerAgent(load_settings())
+    else:
+        agent.client.metrics.reset()
+    settings = agent.settings
+    if mailboxes is None and settings.mailboxes_file:
+        mailboxes = load_mailboxes(settings.mailboxes_file, settings.mail_plan_title)
+    try:
+        # Repeated reads within the cycle (group listings, plan pages) are sent once.
+        with agent.client.coalesce():
+            if mailboxes:
+                return _keepalive_mailboxes(agent, settings, mailboxes)
+            _keepalive(agent, settings)
+            return None
+    finally:
+        # Exported even when the cycle fails, since that is when the numbers matter most.
+        agent.export_metrics()
+
 
+def _keepalive(agent: PlannerAgent, settings: Settings) -> None:
     # Only mailbox check plan
     mail_result = agent.create_mailbox_summary_task_with_notes(
         plan_title=settings.mail_plan_title, recent_top=5
     )
+    if mail_result.get("unchanged"):
+        action = "已更新" if settings.inbox_change_mode == "touch" else "沿用"
+        print(f"收件箱无变化，{action}现有任务，未创建新任务。")
     print(
         f"邮箱检查任务 '{mail_result['title']}' -> "
         f"组 '{mail_result['group']}' / 计划 '{mail_result['plan']}' / 桶 '{mail_result['bucket']}' "
@@ -430,31 +1035,177 @@ def run_keepalive_cycle() -> None:
     else:
         print("邮箱摘要未写入备注（缺少etag）。")
 
+    # Nothing new was created for an unchanged inbox, so there is no duplicate to sweep.
+    keep_rules = [] if mail_result.get("unchanged") else [KeepLatestRule(keep=1)]
+    _keepalive_retention(
+        agent, settings, keep_rules, settings.mail_plan_title, mail_result, [mail_result.get("task_id")]
+    )
+
+
+def _keepalive_mailboxes(
+    agent: PlannerAgent, settings: Settings, mailboxes: List[MailboxTarget]
+) -> List[Dict]:
+    """
+    Summarise many mailboxes on a bounded pool sharing the agent's GraphClient.
+    A failing mailbox only marks its own result; retention then runs once per plan
+    with a keep-latest rule per mailbox.
+    """
+    # Resolve plans and user ids up front so the workers only read the caches.
+    # A plan that fails here is not retried by its workers: concurrent retries could
+    # each create the plan and leave duplicates, so its mailboxes just fail this cycle.
+    unresolved: Dict[str, str] = {}
+    for plan_title in dict.fromkeys(mailbox.plan_title for mailbox in mailboxes):
+        try:
+            agent.ensure_plan_and_bucket(plan_title)
+        except Exception as exc:
+            print(f"解析计划 '{plan_title}' 失败: {exc}")
+            unresolved[plan_title] = f"解析计划失败: {exc}"
     try:
-        duplicates_removed = agent.cleanup_keepalive_duplicates(
-            plan_title=settings.mail_plan_title, keep_latest=1, plan_context=mail_result
-        )
-        if duplicates_removed:
-            for item in duplicates_removed:
-                print(
-                    f"删除重复任务 '{item['title']}' 创建于 {item['created_at']} "
-                    f"位置 组 '{item['group']}' / 计划 '{item['plan']}' / 桶 '{item['bucket']}'"
-                )
-        else:
-            print("没有发现需要删除的重复邮箱检查任务。")
+        agent.resolve_user_ids([mailbox.email for mailbox in mailboxes])
     except Exception as exc:
-        print(f"删除重复邮箱检查任务时失败: {exc}")
+        print(f"批量解析用户失败，将逐个解析: {exc}")
 
-    if settings.enable_old_cleanup:
+    def summarise(mailbox: MailboxTarget) -> Dict:
+        if mailbox.plan_title in unresolved:
+            error = unresolved[mailbox.plan_title]
+            return {"mailbox": mailbox.email, "plan": mailbox.plan_title, "ok": False, "error": error}
         try:
-            removed = agent.cleanup_previous_week_tasks(
-                plan_title=settings.mail_plan_title, plan_context=mail_result
+            result = agent.create_mailbox_summary_task_with_notes(
+                plan_title=mailbox.plan_title,
+                recent_top=5,
+                user_email=mailbox.email,
+                title_prefix=mailbox.title_prefix,
             )
-            print(f"Removed {len(removed)} tasks older than 7 days in plan {settings.mail_plan_title}.")
+            result["ok"] = True
         except Exception as exc:
-            print(f"清理7天前任务失败: {exc}")
-    else:
+            result = {"mailbox": mailbox.email, "plan": mailbox.plan_title, "ok": False, "error": str(exc)}
+        return result
+
+    workers = max(1, min(settings.mailbox_workers, len(mailboxes)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mailbox") as executor:
+        results = list(executor.map(summarise, mailboxes))
+
+    for result in results:
+        if result["ok"]:
+            print(
+                f"[{result['mailbox']}] 未读: {result['unread']} / 总邮件: {result['total']} -> "
+                f"计划 '{result['plan']}' 任务 '{result['title']}'"
+                + ("（收件箱无变化，沿用现有任务）" if result.get("unchanged") else "")
+            )
+        else:
+            print(f"[{result['mailbox']}] 邮箱检查失败: {result['error']}")
+    succeeded = sum(1 for result in results if result["ok"])
+    print(f"邮箱检查完成：成功 {succeeded} 个，失败 {len(results) - succeeded} 个。")
+
+    contexts: Dict[str, Dict] = {}
+    for mailbox, result in zip(mailboxes, results):
+        if result["ok"]:
+            contexts.setdefault(mailbox.plan_title, result)
+    for plan_title, plan_context in contexts.items():
+        keep_rules = [
+            KeepLatestRule(keep=1, title_prefix=f"{mailbox.title_prefix}-")
+            for mailbox, result in zip(mailboxes, results)
+            if mailbox.plan_title == plan_title and not result.get("unchanged")
+        ]
+        summary_task_ids = [
+            result.get("task_id")
+            for mailbox, result in zip(mailboxes, results)
+            if mailbox.plan_title == plan_title and result["ok"]
+        ]
+        _keepalive_retention(agent, settings, keep_rules, plan_title, plan_context, summary_task_ids)
+    return results
+
+
+def _keepalive_retention(
+    agent: PlannerAgent,
+    settings: Settings,
+    keep_rules: List[KeepLatestRule],
+    plan_title: str,
+    plan_context: Dict,
+    summary_task_ids: Iterable[str] = (),
+) -> None:
+    rules: List[RetentionRule] = list(keep_rules)
+    if not settings.enable_old_cleanup:
         print("已跳过7天前任务清理（ENABLE_OLD_CLEANUP 未开启）。")
+    elif settings.cleanup_time_budget_seconds <= 0:
+        print("过期任务清理被禁用。")
+    else:
+        rules.append(MaxAgeRule(max_age_days=7))
+    if not rules:
+        print("收件箱无变化，跳过重复任务清理。")
+        return
+
+    # A reused summary task keeps its original createdDateTime; without the exemption
+    # the 7-day rule would delete it a week after the inbox last changed.
+    exempt: FrozenSet[str] = frozenset()
+    if settings.inbox_change_mode in ("touch", "skip"):
+        exempt = frozenset(task_id for task_id in summary_task_ids if task_id)
+    # One pass over the plan applies both the duplicate and the 7-day rules.
+    try:
+        removed = agent.apply_retention(
+            RetentionPolicy(rules, settings.max_delete_per_run, "keepalive", exempt),
+            plan_title=plan_title,
+            plan_context=plan_context,
+        )
+        for item in removed:
+            print(
+                f"删除{item['reason']}任务 '{item['title']}' 创建于 {item['created_at']} "
+                f"位置 组 '{item['group']}' / 计划 '{item['plan']}' / 桶 '{item['bucket']}'"
+            )
+        if keep_rules and not any(item["reason"] == KeepLatestRule.reason for item in removed):
+            print("没有发现需要删除的重复邮箱检查任务。")
+        if any(isinstance(rule, MaxAgeRule) for rule in rules):
+            expired = sum(1 for item in removed if item["reason"] == MaxAgeRule.reason)
+            print(f"Removed {expired} tasks older than 7 days in plan {plan_title}.")
+    except Exception as exc:
+        print(f"清理邮箱检查任务失败: {exc}")
+
+
+def run_keepalive_daemon(
+    settings: Optional[Settings] = None,
+    stop_event: Optional[threading.Event] = None,
+    max_cycles: int = 0,
+) -> int:
+    """
+    Run keepalive cycles in this process until SIGINT/SIGTERM (or max_cycles).
+    Cycles run back to back on one thread, so a slow cycle delays the next one
+    instead of overlapping it. Returns the number of completed cycles.
+    """
+    settings = settings or load_settings()
+    stop = stop_event or threading.Event()
+    agent = PlannerAgent(settings)
+
+    def request_stop(signum, _frame):
+        print(f"收到信号 {signum}，当前周期结束后退出。")
+        stop.set()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, request_stop)
+
+    cycles = 0
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                run_keepalive_cycle(agent)
+            except Exception as exc:
+                print(f"keepalive 周期失败: {exc}")
+            cycles += 1
+            if max_cycles and cycles >= max_cycles:
+                break
+            elapsed = time.monotonic() - started
+            # Jitter spreads runs so several daemons do not hit Graph at the same instant.
+            delay = settings.daemon_interval_seconds + random.uniform(0, settings.daemon_jitter_seconds)
+            if 0 < delay <= elapsed:
+                print(f"keepalive 周期耗时 {elapsed:.0f}s，超过调度间隔，立即开始下一周期。")
+            stop.wait(max(0.0, delay - elapsed))
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        agent.client.close()
+    return cycles
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+import heapq
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+
+def parse_graph_datetime(value: str) -> datetime:
+    normalized = value.replace("Z", "+00:00")
+    if "." in normalized:
+        base, rest = normalized.split(".", 1)
+        offset = ""
+        # split offset if present
+        if "+" in rest:
+            digits, offset = rest.split("+", 1)
+            offset = "+" + offset
+        elif "-" in rest[1:]:
+            # avoid the leading '-' of fractional part by slicing from index 1
+            idx = rest[1:].find("-") + 1
+            digits, offset = rest[:idx], rest[idx:]
+        else:
+            digits = rest
+        digits = digits[:6]  # datetime.fromisoformat supports up to microseconds
+        normalized = f"{base}.{digits}{offset}"
+    return datetime.fromisoformat(normalized).astimezone(timezone.utc)
+
+
+def utc_sort_key(value: str) -> str:
+    """
+    Fixed-width UTC string ("YYYY-MM-DDTHH:MM:SS.fffffff") that orders like the
+    timestamp itself. Graph returns UTC ("Z"), so the common case is string slicing;
+    other offsets fall back to parse_graph_datetime.
+    """
+    if value.endswith("Z"):
+        body = value[:-1]
+    elif value.endswith("+00:00"):
+        body = value[:-6]
+    else:
+        body = ""
+    base, _, fraction = body.partition(".")
+    if len(base) != 19 or base[10] != "T":
+        fallback = parse_graph_datetime(value).strftime("%Y-%m-%dT%H:%M:%S.%f")
+        base, _, fraction = fallback.partition(".")
+    return f"{base}.{fraction[:7].ljust(7, '0')}"
+
+
+@dataclass
+class KeepLatestRule:
+    """Keep the newest `keep` tasks whose title starts with `title_prefix` ("" = all)."""
+
+    keep: int
+    title_prefix: str = ""
+    reason: str = "重复"
+
+
+@dataclass
+class MaxAgeRule:
+    """Delete tasks whose title starts with `title_prefix` and are older than `max_age_days`."""
+
+    max_age_days: float
+    title_prefix: str = ""
+    reason: str = "过期"
+
+
+RetentionRule = Union[KeepLatestRule, MaxAgeRule]
+
+
+@dataclass
+class RetentionPolicy:
+    rules: List[RetentionRule] = field(default_factory=list)
+    max_deletes: int = 0  # 0 = unlimited
+    # Which sweep runs the policy; saved progress is kept per plan and sweep.
+    sweep: str = "retention"
+    # Tasks max-age rules never delete, e.g. summary tasks INBOX_CHANGE_MODE keeps reusing.
+    age_exempt_ids: FrozenSet[str] = frozenset()
+
+    def signature(self) -> str:
+        """Identifies the rule set, so saved progress is only resumed by the same rules."""
+        return "|".join(repr(rule) for rule in self.rules)
+
+
+class TaskRecord:
+    """Compact view of a task: just what retention needs to rank and delete it."""
+
+    __slots__ = ("task_id", "etag", "created", "created_key", "bucket", "title", "scheduled")
+
+    def __init__(
+        self,
+        task_id: str,
+        etag: str,
+        created: str,
+        created_key: str,
+        bucket: Optional[str],
+        title: str,
+        scheduled: bool = False,
+    ):
+        self.task_id = task_id
+        self.etag = etag
+        self.created = created
+        self.created_key = created_key
+        self.bucket = bucket
+        self.title = title
+        # Set once a rule has planned the deletion, so a record held by several
+        # keep-latest heaps (or also past max age) is deleted only once.
+        self.scheduled = bool(scheduled)
+
+    def to_state(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "TaskRecord":
+        return cls(*(state.get(name) for name in cls.__slots__))
+
+    def as_deletion(self, reason: str) -> Dict:
+        return {
+            "task_id": self.task_id,
+            "etag": self.etag,
+            "title": self.title,
+            "created_at": self.created,
+            "bucket": self.bucket,
+            "reason": reason,
+        }
+
+
+class RetentionEngine:
+    """
+    Evaluates every rule of a policy in one pass over a task stream and merges the
+    results into a single delete plan (each task at most once, capped by
+    max_deletes). Deletions are emitted from feed() as soon as they are certain:
+    keep-latest rules hold a fixed-size min-heap of the newest records, and anything
+    pushed out of it has N newer tasks already, so memory stays O(N) per rule even
+    without a delete cap.
+    """
+
+    def __init__(self, policy: RetentionPolicy, now: Optional[datetime] = None):
+        self.policy = policy
+        now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        # Thresholds are converted once so each task is classified by string comparison.
+        self._age_rules: List[Tuple[MaxAgeRule, str]] = []
+        for rule in policy.rules:
+            if isinstance(rule, MaxAgeRule):
+                threshold = now - timedelta(days=rule.max_age_days)
+                self._age_rules.append(
+                    (rule, utc_sort_key(threshold.strftime("%Y-%m-%dT%H:%M:%S.%fZ")))
+                )
+        self._keep_rules: List[Tuple[KeepLatestRule, List[Tuple[str, str, TaskRecord]]]] = [
+            (rule, []) for rule in policy.rules if isinstance(rule, KeepLatestRule)
+        ]
+        self._admitted = 0
+        # Ids of deletions restored from a saved cursor: the resumed page lists them again.
+        self._restored: Set[str] = set()
+        self.capped = False
+        # Deletions turned away by max_deletes, kept so a later run can pick them up.
+        self.overflow: List[Dict] = []
+
+    def feed(self, task: Dict, bucket_name: Optional[str] = None) -> List[Dict]:
+        """Classify one task; returns the deletions it makes certain."""
+        created_raw = task.get("createdDateTime")
+        etag = task.get("@odata.etag")
+        if not created_raw or not etag:
+            return []
+        try:
+            created_key = utc_sort_key(created_raw)
+        except ValueError:
+            return []
+        title = task.get("title") or ""
+        return self.feed_record(
+            TaskRecord(task.get("id"), etag, created_raw, created_key, bucket_name, title)
+        )
+
+    def feed_record(self, record: TaskRecord) -> List[Dict]:
+        """Classify an already-compacted record, e.g. one restored from a saved cursor."""
+        title = record.title
+        created_key = record.created_key
+        planned: List[Dict] = []
+        for rule, heap in self._keep_rules:
+            if not title.startswith(rule.title_prefix):
+                continue
+            entry = (created_key, record.task_id, record)
+            if len(heap) < rule.keep:
+                heapq.heappush(heap, entry)
+                continue
+            # Whichever is older, the newcomer or the heap's oldest, now has N newer tasks.
+            evicted = (heapq.heappushpop(heap, entry) if rule.keep > 0 else entry)[2]
+            if not evicted.scheduled:
+                evicted.scheduled = True
+                planned.append(evicted.as_deletion(rule.reason))
+        for rule, threshold_key in self._age_rules:
+            if created_key < threshold_key and title.startswith(rule.title_prefix):
+                if not record.scheduled and record.task_id not in self.policy.age_exempt_ids:
+                    record.scheduled = True
+                    planned.append(record.as_deletion(rule.reason))
+                break
+        if self._restored:
+            planned = [deletion for deletion in planned if deletion["task_id"] not in self._restored]
+        return self._admit(planned) if planned else []
+
+    def kept(self) -> List[TaskRecord]:
+        """Records currently held as the newest N by keep-latest rules."""
+        return [entry[2] for _, heap in self._keep_rules for entry in heap]
+
+    def schedule(self, deletions: List[Dict]) -> List[Dict]:
+        """Admit deletions restored from a saved cursor; returns those within max_deletes."""
+        self._restored.update(deletion["task_id"] for deletion in deletions)
+        return self._admit(deletions)
+
+    def _admit(self, deletions: List[Dict]) -> List[Dict]:
+        """
+        Add deletions to the plan, honouring max_deletes. Duplicates never reach here:
+        feed_record marks its records and skips restored ids, so besides the restored
+        ids no set of planned tasks is kept for the pass.
+        """
+        accepted: List[Dict] = []
+        limit = self.policy.max_deletes
+        for deletion in deletions:
+            self._admitted += 1
+            if limit > 0 and self._admitted > limit:
+                self.capped = True
+                self.overflow.append(deletion)
+                continue
+            accepted.append(deletion)
+        return accepted
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+def read_json_state(path: str) -> Dict:
+    """Load a JSON state file; a missing or unreadable file counts as empty state."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+    except Exception as exc:
+        print(f"读取状态文件 {path} 失败，将重新生成: {exc}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_json_state(path: str, data: Dict) -> None:
+    """Atomically replace a JSON state file. An empty path keeps state in memory only."""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class TopologyIndex:
+    """
+    Plan title -> resolved group/plan/bucket ids, persisted between runs.
+    Entries older than the TTL are ignored; a bucket can be forgotten on its own
+    while the plan it belongs to stays cached. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Dict] = read_json_state(path)
+        self._lock = threading.Lock()
+
+    def get(self, plan_title: str) -> Optional[Dict]:
+        entry = self._entries.get(plan_title)
+        if not entry:
+            return None
+        if self.ttl_seconds > 0 and time.time() - entry.get("resolved_at", 0) > self.ttl_seconds:
+            return None
+        return entry
+
+    def lookup(self, plan_title: str) -> Optional[Tuple[Dict, Dict, Optional[Dict]]]:
+        """Return (group, plan, bucket) shaped like Graph payloads; bucket may be None."""
+        entry = self.get(plan_title)
+        if not entry:
+            return None
+        group = {"id": entry["group_id"], "displayName": entry.get("group_name")}
+        plan = {"id": entry["plan_id"], "title": entry.get("plan_title", plan_title)}
+        bucket = None
+        if entry.get("bucket_id"):
+            bucket = {"id": entry["bucket_id"], "name": entry.get("bucket_name")}
+        return group, plan, bucket
+
+    def put(self, plan_title: str, group: Dict, plan: Dict, bucket: Optional[Dict] = None) -> None:
+        with self._lock:
+            previous = self._entries.get(plan_title) or {}
+            if bucket is None and previous.get("plan_id") == plan.get("id"):
+                bucket = {"id": previous.get("bucket_id"), "name": previous.get("bucket_name")}
+            self._entries[plan_title] = {
+                "group_id": group.get("id"),
+                "group_name": group.get("displayName"),
+                "plan_id": plan.get("id"),
+                "plan_title": plan.get("title", plan_title),
+                "bucket_id": (bucket or {}).get("id"),
+                "bucket_name": (bucket or {}).get("name"),
+                "resolved_at": time.time(),
+            }
+            write_json_state(self.path, self._entries)
+
+    def invalidate(self, plan_title: str, bucket_only: bool = False) -> None:
+        with self._lock:
+            entry = self._entries.get(plan_title)
+            if not entry:
+                return
+            if bucket_only:
+                entry = dict(entry, bucket_id=None, bucket_name=None)
+                self._entries[plan_title] = entry
+            else:
+                del self._entries[plan_title]
+            write_json_state(self.path, self._entries)
+
+
+class CursorStore:
+    """
+    Progress of budget-limited sweeps, keyed by sweep (plan id + sweep kind), so the
+    next run resumes where the previous one stopped instead of starting over.
+    Cursors not saved within the TTL (0 = forever) are ignored and dropped on the
+    next save, so progress abandoned by a sweep that no longer runs does not pile up.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 0.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._cursors: Dict[str, Dict] = read_json_state(path)
+        self._lock = threading.Lock()
+
+    def _expired(self, state: Dict) -> bool:
+        return self.ttl_seconds > 0 and time.time() - state.get("updated_at", 0) > self.ttl_seconds
+
+    def load(self, key: str) -> Dict:
+        state = self._cursors.get(key) or {}
+        return {} if self._expired(state) else dict(state)
+
+    def save(self, key: str, state: Dict) -> None:
+        with self._lock:
+            self._cursors = {name: saved for name, saved in self._cursors.items() if not self._expired(saved)}
+            self._cursors[key] = dict(state, updated_at=time.time())
+            write_json_state(self.path, self._cursors)
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            if self._cursors.pop(key, None) is not None:
+                write_json_state(self.path, self._cursors)
+
+
+class IdentityCache:
+    """
+    UPN -> directory object id, persisted between runs. Ids never change for a
+    user, so entries live for the TTL (0 = forever); past max_entries the least
+    recently resolved are evicted.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Dict] = read_json_state(path)
+        self._lock = threading.Lock()
+
+    def get(self, upn: str) -> Optional[str]:
+        entry = self._entries.get(upn.lower())
+        if not entry:
+            return None
+        if self.ttl_seconds > 0 and time.time() - entry.get("resolved_at", 0) > self.ttl_seconds:
+            return None
+        return entry.get("id")
+
+    def put_many(self, resolved: Dict[str, str]) -> None:
+        if not resolved:
+            return
+        with self._lock:
+            now = time.time()
+            for upn, user_id in resolved.items():
+                self._entries[upn.lower()] = {"id": user_id, "resolved_at": now}
+            if self.max_entries > 0 and len(self._entries) > self.max_entries:
+                by_age = sorted(self._entries, key=lambda key: self._entries[key].get("resolved_at", 0))
+                for key in by_age[: len(self._entries) - self.max_entries]:
+                    del self._entries[key]
+            write_json_state(self.path, self._entries)
+
+    def put(self, upn: str, user_id: str) -> None:
+        self.put_many({upn: user_id})
+
+    def invalidate(self, upn: str) -> None:
+        with self._lock:
+            if self._entries.pop(upn.lower(), None) is not None:
+                write_json_state(self.path, self._entries)
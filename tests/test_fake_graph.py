@@ -0,0 +1,241 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import graph_client
+import planner_agent
+from cassette import CassetteMiss
+from config import load_settings
+from fake_graph import FakeGraphServer, FakeTenant
+from graph_client import GraphClient, GraphError
+from planner_agent import PlannerAgent
+
+
+class _DummyMsalApp:
+    def __init__(self, *_args, token_cache=None, **_kwargs):
+        self.token_cache = token_cache
+
+    def acquire_token_for_client(self, scopes):
+        return {"access_token": "fake-access-token", "expires_in": 3600}
+
+
+@pytest.fixture
+def server():
+    server = FakeGraphServer(FakeTenant(groups=7, tasks=5, plan_ratio=1.0), page_size=3).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, server):
+    monkeypatch.setenv("CLIENT_ID", "dummy-client-id")
+    monkeypatch.setenv("CLIENT_SECRET", "dummy-secret")
+    monkeypatch.setenv("TENANT_ID", "fake-tenant")
+    monkeypatch.setenv("USER_EMAIL", "user@example.com")
+    monkeypatch.setenv("NOTIFICATION_EMAIL", "user@example.com")
+    monkeypatch.setenv("APP_SCOPE", "https://graph.microsoft.com/.default")
+    monkeypatch.setenv("DELEGATED_SCOPES", "User.Read")
+    monkeypatch.setenv("MAIL_PLAN_TITLE", "邮箱检查")
+    monkeypatch.setenv("REQUEST_TIMEOUT_SECONDS", "5")
+    monkeypatch.setenv("MAX_DELETE_PER_RUN", "500")
+    monkeypatch.setenv("CLEANUP_TIME_BUDGET_SECONDS", "10")
+    monkeypatch.setenv("AUTH_MODE", "app")
+    monkeypatch.setenv("TOKEN_CACHE_PATH", str(tmp_path / "token_cache.json"))
+    monkeypatch.setenv("MSAL_HTTP_CACHE_PATH", str(tmp_path / "http_cache.bin"))
+    monkeypatch.setenv("GRAPH_BASE_URL", f"{server.url}/v1.0")
+    monkeypatch.setattr(graph_client, "ConfidentialClientApplication", _DummyMsalApp)
+    return GraphClient(load_settings())
+
+
+def test_client_pages_and_batches_against_fake_graph(server, client):
+    groups = list(client.iter_values("groups"))
+    assert len(groups) == 7
+
+    batch = client.batch()
+    for group in groups[:2]:
+        batch.add("DELETE", f"groups/{group['id']}")
+    assert all(response.ok for response in batch.execute())
+
+    remaining = list(client.iter_values("groups"))
+    assert [group["id"] for group in remaining] == [group["id"] for group in groups[2:]]
+    assert server.app.stats["GET v1.0/groups"] == 5  # 7 groups in 3 pages, then 5 in 2
+    assert server.app.stats["POST v1.0/$batch"] == 1
+    assert server.app.stats["batched"] == 2
+    assert server.app.stats["total"] == 6  # the $batch envelope counts once, its items separately
+
+
+def test_fake_graph_enforces_task_etags(server, client):
+    task = next(iter(server.app.tenant.tasks.values()))
+    with pytest.raises(GraphError) as excinfo:
+        client.delete(f"planner/tasks/{task['id']}", headers={"If-Match": 'W/"stale"'})
+    assert excinfo.value.status_code == 412
+
+    client.delete(f"planner/tasks/{task['id']}", headers={"If-Match": task["@odata.etag"]})
+    assert task["id"] not in server.app.tenant.tasks
+
+
+def test_user_ids_are_resolved_in_batches_and_cached(monkeypatch, tmp_path, server, client):
+    for index in range(25):
+        server.app.tenant.add_user(f"user{index}@example.com", messages=0)
+    monkeypatch.setenv("USER_ID_CACHE_PATH", str(tmp_path / "user_ids.json"))
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    agent = PlannerAgent(load_settings())
+    emails = [f"user{index}@example.com" for index in range(25)] + ["nobody@example.com"]
+
+    resolved = agent.resolve_user_ids(emails)
+
+    assert resolved["nobody@example.com"] is None
+    assert all(resolved[email] for email in emails[:-1])
+    assert server.app.stats["POST v1.0/$batch"] == 2
+
+    server.app.stats.clear()
+    reloaded = PlannerAgent(load_settings())
+    assert reloaded.get_user_id("USER3@example.com") == resolved["user3@example.com"]
+    assert reloaded.get_user_id() == server.app.tenant.find_user("user@example.com")["id"]
+    assert server.app.stats["GET v1.0/users/{user}"] == 1
+
+
+@pytest.mark.parametrize("mode", ["touch", "skip"])
+def test_unchanged_inbox_reuses_the_last_summary_task(monkeypatch, tmp_path, server, client, mode):
+    monkeypatch.setenv("INBOX_CHANGE_MODE", mode)
+    monkeypatch.setenv("INBOX_STATE_PATH", str(tmp_path / "inbox_state.json"))
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    first = PlannerAgent(load_settings()).create_mailbox_summary_task_with_notes("邮箱检查")
+    assert not first.get("unchanged")
+
+    server.app.stats.clear()
+    second = PlannerAgent(load_settings()).create_mailbox_summary_task_with_notes("邮箱检查")
+    assert second["unchanged"] and second["task_id"] == first["task_id"]
+    assert server.app.stats["POST v1.0/planner/tasks"] == 0
+    assert server.app.stats["PATCH v1.0/planner/tasks/{task}"] == (1 if mode == "touch" else 0)
+
+    user = server.app.tenant.find_user("user@example.com")
+    server.app.tenant.messages[user["id"]][0]["isRead"] = True
+    third = PlannerAgent(load_settings()).create_mailbox_summary_task_with_notes("邮箱检查")
+    assert not third.get("unchanged") and third["task_id"] != first["task_id"]
+
+
+def test_cassette_replays_a_recorded_run_offline(monkeypatch, tmp_path, server, client):
+    monkeypatch.setenv("GRAPH_CASSETTE_PATH", str(tmp_path / "graph.jsonl"))
+    monkeypatch.setenv("GRAPH_CASSETTE_MODE", "record")
+    recorder = GraphClient(load_settings())
+    recorded = [group["id"] for group in recorder.iter_values("groups", prefetch=False)]
+    task = next(iter(server.app.tenant.tasks.values()))
+    recorder.delete(f"planner/tasks/{task['id']}", headers={"If-Match": task["@odata.etag"]})
+    recorder.cassette.close()
+
+    server.app.stats.clear()
+    monkeypatch.setenv("GRAPH_CASSETTE_MODE", "replay")
+    player = GraphClient(load_settings())
+    assert [group["id"] for group in player.iter_values("groups", prefetch=False)] == recorded
+    player.delete(f"planner/tasks/{task['id']}", headers={"If-Match": task["@odata.etag"]})
+    with pytest.raises(CassetteMiss):
+        player.get("planner/tasks/unrecorded")
+    assert server.app.stats["total"] == 0
+    assert player.cassette.stats["played"] == player.cassette.stats["recorded"]
+
+
+def test_touch_keeps_a_usable_etag_when_patch_returns_no_body(monkeypatch, tmp_path, server, client):
+    monkeypatch.setenv("INBOX_CHANGE_MODE", "touch")
+    monkeypatch.setenv("INBOX_STATE_PATH", str(tmp_path / "inbox_state.json"))
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    patch = server.app._patch
+
+    def patch_without_representation(items, item_id, headers, body, fields):
+        headers = {key: value for key, value in headers.items() if key.lower() != "prefer"}
+        return patch(items, item_id, headers, body, fields)
+
+    monkeypatch.setattr(server.app, "_patch", patch_without_representation)
+    first = PlannerAgent(load_settings()).create_mailbox_summary_task_with_notes("邮箱检查")
+
+    # Each touch must leave the current etag behind, or the next one fails with 412.
+    for _ in range(2):
+        touched = PlannerAgent(load_settings()).create_mailbox_summary_task_with_notes("邮箱检查")
+        assert touched["unchanged"] and touched["task_id"] == first["task_id"]
+    assert server.app.stats["POST v1.0/planner/tasks"] == 1
+    assert server.app.stats["GET v1.0/planner/tasks/{task}"] == 2
+
+
+@pytest.mark.parametrize("profile", ["auto", "full"])
+def test_list_accessors_apply_the_select_profile(monkeypatch, server, client, profile):
+    monkeypatch.setenv("GRAPH_SELECT_PROFILE", profile)
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    agent = PlannerAgent(load_settings())
+    plan = next(plan for plan in server.app.tenant.plans.values() if plan["title"] == "邮箱检查")
+
+    tasks = agent.list_plan_tasks(plan["id"])
+
+    assert tasks and all(task["@odata.etag"] and task["createdDateTime"] for task in tasks)
+    assert all(("assignments" in task) == (profile == "full") for task in tasks)
+    groups = agent.list_groups()
+    assert all(set(group) <= {"id", "displayName", "@odata.etag"} for group in groups) == (profile == "auto")
+
+
+def test_identical_gets_are_sent_once_per_scope(server, client):
+    with client.coalesce():
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            pages = list(pool.map(lambda _: client.get("groups", params={"$top": 3}).json(), range(4)))
+        assert all(page == pages[0] for page in pages)
+        assert server.app.stats["GET v1.0/groups"] == 1
+
+        client.delete(f"groups/{pages[0]['value'][0]['id']}")
+        fresh = client.get("groups", params={"$top": 3}).json()
+        assert fresh["value"][0]["id"] != pages[0]["value"][0]["id"]
+        assert server.app.stats["GET v1.0/groups"] == 2
+
+    client.get("groups", params={"$top": 3})
+    client.get("groups", params={"$top": 3})
+    assert server.app.stats["GET v1.0/groups"] == 4
+    assert client.metrics.summary()["coalesced"] == 3
+
+
+def test_keepalive_cycle_sends_each_get_once(monkeypatch, tmp_path, server, client):
+    monkeypatch.setenv("ENABLE_OLD_CLEANUP", "true")
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    monkeypatch.setenv("INBOX_STATE_PATH", "")
+    monkeypatch.setenv("METRICS_JSON_PATH", "")
+    agent = PlannerAgent(load_settings())
+    sent = Counter()
+    transmit = agent.client._transmit
+
+    def counting_transmit(method, url, headers, kwargs):
+        if method == "GET":
+            sent[(url, tuple(sorted((kwargs.get("params") or {}).items())))] += 1
+        return transmit(method, url, headers, kwargs)
+
+    monkeypatch.setattr(agent.client, "_transmit", counting_transmit)
+
+    planner_agent.run_keepalive_cycle(agent=agent)
+
+    assert sent and server.app.stats["POST v1.0/planner/tasks"] == 1
+    assert [key for key, count in sent.items() if count > 1] == []
+
+
+def test_touch_mode_keeps_its_reused_task_past_the_age_limit(monkeypatch, tmp_path, server, client):
+    monkeypatch.setenv("INBOX_CHANGE_MODE", "touch")
+    monkeypatch.setenv("INBOX_STATE_PATH", str(tmp_path / "inbox_state.json"))
+    monkeypatch.setenv("ENABLE_OLD_CLEANUP", "true")
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    monkeypatch.setenv("METRICS_JSON_PATH", "")
+    planner_agent.run_keepalive_cycle(agent=PlannerAgent(load_settings()))
+    created = [task for task in server.app.tenant.tasks.values() if task["title"].startswith("邮箱检查")]
+    assert len(created) == 1
+    # Unchanged for weeks: the reused task is far past the 7-day limit.
+    created[0]["createdDateTime"] = "2020-01-01T00:00:00Z"
+
+    planner_agent.run_keepalive_cycle(agent=PlannerAgent(load_settings()))
+
+    assert created[0]["id"] in server.app.tenant.tasks
+    assert server.app.stats["POST v1.0/planner/tasks"] == 1
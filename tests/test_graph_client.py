@@ -0,0 +1,355 @@
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+import graph_client
+from config import load_settings
+from graph_client import GraphClient
+
+
+class _FakeResponse:
+    def __init__(self, status_code=200, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload if payload is not None else {}
+        self.headers = headers or {}
+        self.text = "" if payload is None else str(payload)
+        self.content = self.text.encode("utf-8")
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 300
+
+    def json(self):
+        return self._payload
+
+
+class _DummyMsalApp:
+    token_calls = 0
+
+    def __init__(self, *_args, token_cache=None, **_kwargs):
+        self.token_cache = token_cache
+
+    def acquire_token_for_client(self, scopes):
+        type(self).token_calls += 1
+        self.token_cache.has_state_changed = True
+        return {"access_token": "token", "expires_in": 3600}
+
+
+@pytest.fixture
+def settings(monkeypatch, tmp_path):
+    monkeypatch.setenv("CLIENT_ID", "dummy-client-id")
+    monkeypatch.setenv("CLIENT_SECRET", "dummy-secret")
+    monkeypatch.setenv("TENANT_ID", "dummy-tenant")
+    monkeypatch.setenv("USER_EMAIL", "user@example.com")
+    monkeypatch.setenv("NOTIFICATION_EMAIL", "user@example.com")
+    monkeypatch.setenv("APP_SCOPE", "https://graph.microsoft.com/.default")
+    monkeypatch.setenv("DELEGATED_SCOPES", "User.Read")
+    monkeypatch.setenv("MAIL_PLAN_TITLE", "邮箱检查")
+    monkeypatch.setenv("REQUEST_TIMEOUT_SECONDS", "2")
+    monkeypatch.setenv("MAX_DELETE_PER_RUN", "500")
+    monkeypatch.setenv("CLEANUP_TIME_BUDGET_SECONDS", "10")
+    monkeypatch.setenv("AUTH_MODE", "app")
+    monkeypatch.setenv("HTTP_POOL_MAXSIZE", "4")
+    monkeypatch.setenv("TOKEN_CACHE_PATH", str(tmp_path / "token_cache.json"))
+    monkeypatch.setenv("MSAL_HTTP_CACHE_PATH", str(tmp_path / "http_cache.bin"))
+    monkeypatch.setattr(_DummyMsalApp, "token_calls", 0)
+    # Avoid MSAL authority discovery over the network.
+    monkeypatch.setattr(graph_client, "ConfidentialClientApplication", _DummyMsalApp)
+    monkeypatch.setattr(graph_client, "PublicClientApplication", _DummyMsalApp)
+    return load_settings()
+
+
+@pytest.fixture
+def client(settings):
+    return GraphClient(settings)
+
+
+def test_request_uses_pooled_session(monkeypatch, client):
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append((method, url))
+        return _FakeResponse(payload={"value": []})
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+    client.get("groups")
+    client.get("groups")
+
+    assert calls == [("GET", "https://graph.microsoft.com/v1.0/groups")] * 2
+    adapter = client.http_client.get_adapter("https://graph.microsoft.com/")
+    assert adapter._pool_maxsize == 4
+
+
+def test_token_is_reused_until_expiry_and_persisted(monkeypatch, settings, client):
+    monkeypatch.setattr(
+        client.http_client, "request", lambda *_a, **_k: _FakeResponse(payload={})
+    )
+    client.get("me")
+    client.get("me")
+
+    assert _DummyMsalApp.token_calls == 1
+    with open(settings.token_cache_path, encoding="utf-8") as handle:
+        assert handle.read()
+
+    client._token_expires_at = 0
+    client.get("me")
+    assert _DummyMsalApp.token_calls == 2
+
+
+def test_authority_metadata_is_cached_between_clients(monkeypatch, settings):
+    discoveries = []
+
+    class _DiscoveringMsalApp(_DummyMsalApp):
+        def __init__(self, *args, http_cache=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Stand-in for MSAL's authority discovery, which consults http_cache first.
+            if "openid-configuration" not in http_cache:
+                discoveries.append(settings.authority)
+                http_cache["openid-configuration"] = {"token_endpoint": "https://login/token"}
+
+    monkeypatch.setattr(graph_client, "ConfidentialClientApplication", _DiscoveringMsalApp)
+
+    GraphClient(settings)
+    GraphClient(settings)
+
+    assert discoveries == [settings.authority]
+    assert os.stat(settings.msal_http_cache_path).st_mode & 0o777 == 0o600
+
+    # A cache that others could have written is not unpickled.
+    os.chmod(settings.msal_http_cache_path, 0o644)
+    GraphClient(settings)
+    assert discoveries == [settings.authority] * 2
+
+
+def test_batch_chunks_requests_and_reports_per_item_errors(monkeypatch, client):
+    posted = []
+
+    def fake_request(method, url, **kwargs):
+        sub_requests = kwargs["json"]["requests"]
+        posted.append(len(sub_requests))
+        responses = [
+            {"id": item["id"], "status": 404 if item["url"].endswith("/task-3") else 204}
+            for item in reversed(sub_requests)
+        ]
+        return _FakeResponse(payload={"responses": responses})
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+    batch = client.batch()
+    for index in range(45):
+        batch.add("DELETE", f"planner/tasks/task-{index}", headers={"If-Match": "etag"})
+    results = batch.execute()
+
+    assert posted == [20, 20, 5]
+    assert len(results) == 45
+    assert [item.path for item in results if not item.ok] == ["planner/tasks/task-3"]
+    assert results[3].error.status_code == 404
+
+
+def test_iter_pages_follows_next_link_and_honours_limit(monkeypatch, client):
+    next_link = "https://graph.microsoft.com/v1.0/groups?$skiptoken=page2"
+    pages = {
+        "https://graph.microsoft.com/v1.0/groups": {
+            "value": [{"id": "g1"}, {"id": "g2"}],
+            "@odata.nextLink": next_link,
+        },
+        next_link: {"value": [{"id": "g3"}]},
+    }
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        return _FakeResponse(payload=pages[url])
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+
+    assert [item["id"] for item in client.iter_values("groups")] == ["g1", "g2", "g3"]
+    assert calls == list(pages)
+
+    calls.clear()
+    assert [item["id"] for item in client.iter_values("groups", limit=2)] == ["g1", "g2"]
+    assert calls == ["https://graph.microsoft.com/v1.0/groups"]
+
+
+def test_throttled_requests_are_retried_after_retry_after(monkeypatch, client):
+    responses = [
+        _FakeResponse(status_code=429, payload={"error": "throttled"}, headers={"Retry-After": "0.2"}),
+        _FakeResponse(status_code=503, payload={"error": "busy"}),
+        _FakeResponse(payload={"value": []}),
+    ]
+    sleeps = []
+    monkeypatch.setattr(client.http_client, "request", lambda *_a, **_k: responses.pop(0))
+    monkeypatch.setattr(graph_client.time, "sleep", sleeps.append)
+
+    assert client.get("groups").ok
+    assert len(sleeps) == 2 and sleeps[0] >= 0.2
+    assert client.limiter.concurrency < client.settings.graph_max_concurrency
+
+
+def test_non_retryable_error_raises_graph_error(monkeypatch, client):
+    monkeypatch.setattr(
+        client.http_client, "request", lambda *_a, **_k: _FakeResponse(status_code=404, payload={})
+    )
+    with pytest.raises(graph_client.GraphError) as excinfo:
+        client.get("groups/missing")
+    assert excinfo.value.status_code == 404
+
+
+def test_request_metrics_group_calls_by_endpoint_template(monkeypatch, tmp_path, client):
+    responses = [
+        _FakeResponse(status_code=429, payload={"error": "throttled"}, headers={"Retry-After": "0"}),
+        _FakeResponse(payload={"value": []}),
+        _FakeResponse(payload={"value": []}),
+    ]
+    monkeypatch.setattr(client.http_client, "request", lambda *_a, **_k: responses.pop(0))
+    monkeypatch.setattr(graph_client.time, "sleep", lambda _seconds: None)
+
+    client.get("planner/buckets/bucket-1/tasks")
+    client.get("https://graph.microsoft.com/v1.0/planner/buckets/bucket-2/tasks?$skiptoken=x")
+
+    summary = client.metrics.summary()
+    (endpoint,) = summary["endpoints"]
+    assert (endpoint["method"], endpoint["endpoint"]) == ("GET", "planner/buckets/{id}/tasks")
+    assert (endpoint["calls"], endpoint["attempts"], endpoint["retries"]) == (2, 3, 1)
+    assert endpoint["status"] == {"429": 1, "200": 2}
+    assert endpoint["latency_seconds_buckets"]["+Inf"] == 3
+
+    json_path, prom_path = tmp_path / "metrics.json", tmp_path / "metrics.prom"
+    client.metrics.export(str(json_path), str(prom_path))
+    assert json_path.exists()
+    text = prom_path.read_text(encoding="utf-8")
+    assert 'graph_requests_total{method="GET",endpoint="planner/buckets/{id}/tasks"} 2' in text
+    assert 'graph_request_duration_seconds_count{method="GET",endpoint="planner/buckets/{id}/tasks"} 3' in text
+
+
+def test_circuit_breaker_fails_fast_and_probes_for_recovery(monkeypatch, settings):
+    monkeypatch.setenv("GRAPH_MAX_RETRIES", "0")
+    monkeypatch.setenv("GRAPH_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("GRAPH_BREAKER_COOLDOWN_SECONDS", "0.1")
+    client = GraphClient(load_settings())
+    statuses = [500, 500, 200, 500, 200]
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        return _FakeResponse(status_code=statuses.pop(0), payload={})
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+
+    for _ in range(2):
+        with pytest.raises(graph_client.GraphError):
+            client.get("groups")
+    with pytest.raises(graph_client.CircuitOpenError):
+        client.get("groups")
+    assert client.get("users/u1").ok  # other endpoints keep their own circuit
+    time.sleep(0.15)
+    with pytest.raises(graph_client.GraphError):
+        client.get("groups")  # the probe fails, so the circuit opens again
+    with pytest.raises(graph_client.CircuitOpenError):
+        client.get("groups")
+    time.sleep(0.15)
+    assert client.get("groups").ok
+    assert len(calls) == 5
+
+
+def test_probe_that_fails_before_sending_does_not_wedge_the_circuit(monkeypatch, settings):
+    monkeypatch.setenv("GRAPH_MAX_RETRIES", "0")
+    monkeypatch.setenv("GRAPH_BREAKER_FAILURES", "1")
+    monkeypatch.setenv("GRAPH_BREAKER_COOLDOWN_SECONDS", "0.05")
+    client = GraphClient(load_settings())
+    statuses = [500, 200]
+    monkeypatch.setattr(
+        client.http_client, "request", lambda *_a, **_k: _FakeResponse(status_code=statuses.pop(0), payload={})
+    )
+
+    with pytest.raises(graph_client.GraphError):
+        client.get("groups")
+    time.sleep(0.1)
+    acquire_token = client._acquire_token
+
+    def token_outage():
+        raise RuntimeError("token endpoint unavailable")
+
+    monkeypatch.setattr(client, "_acquire_token", token_outage)
+    with pytest.raises(RuntimeError):
+        client.get("groups")  # claims the half-open probe, then fails before sending
+    monkeypatch.setattr(client, "_acquire_token", acquire_token)
+    assert client.get("groups").ok
+    assert client.limiter._in_flight == 0
+
+
+def test_slow_gets_are_hedged_with_one_duplicate(monkeypatch, settings):
+    monkeypatch.setenv("GRAPH_HEDGE_PERCENTILE", "90")
+    client = GraphClient(load_settings())
+    calls = []
+    slow_once = threading.Event()
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        if url.endswith("slow") and not slow_once.is_set():
+            slow_once.set()
+            time.sleep(1)
+            return _FakeResponse(payload={"from": "first"})
+        return _FakeResponse(payload={"from": "hedge" if url.endswith("slow") else "warmup"})
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+    for index in range(client.latencies.min_samples):
+        client.get(f"users/u{index}")
+    assert client.metrics.summary()["hedges"] == 0
+
+    started = time.perf_counter()
+    assert client.get("users/slow").json() == {"from": "hedge"}
+    assert time.perf_counter() - started < 0.5
+    assert calls.count("https://graph.microsoft.com/v1.0/users/slow") == 2
+    assert client.metrics.summary()["hedges"] == 1
+
+
+def test_hedges_need_a_spare_limiter_slot(monkeypatch, settings):
+    monkeypatch.setenv("GRAPH_HEDGE_PERCENTILE", "90")
+    client = GraphClient(load_settings())
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        if url.endswith("slow"):
+            time.sleep(0.2)
+        return _FakeResponse(payload={})
+
+    monkeypatch.setattr(client.http_client, "request", fake_request)
+    for index in range(client.latencies.min_samples):
+        client.get(f"users/u{index}")
+
+    # After a throttle the window is below its maximum: slow GETs are not duplicated.
+    client.limiter.record_throttle()
+    assert client.get("users/slow").ok
+    assert calls.count("https://graph.microsoft.com/v1.0/users/slow") == 1
+    assert client.metrics.summary()["hedges"] == 0
+
+    client.limiter.concurrency = float(client.limiter.max_concurrency)
+    assert client.get("users/slow", params={"again": 1}).ok
+    assert client.metrics.summary()["hedges"] == 1
+    client.close()
+    assert client._hedge_executor is None
+    deadline = time.monotonic() + 2
+    while client.limiter._in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.limiter._in_flight == 0
+
+
+def test_unexpected_send_errors_release_the_concurrency_slot(monkeypatch, settings):
+    monkeypatch.setenv("GRAPH_MAX_CONCURRENCY", "2")
+    client = GraphClient(load_settings())
+
+    def broken(*_args, **_kwargs):
+        raise requests.exceptions.ChunkedEncodingError("connection broken mid-body")
+
+    monkeypatch.setattr(client.http_client, "request", broken)
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            client.get("groups")
+    assert client.limiter._in_flight == 0
+
+    monkeypatch.setattr(client.http_client, "request", lambda *_a, **_k: _FakeResponse(payload={}))
+    assert client.get("groups").ok
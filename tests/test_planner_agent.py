@@ -1,10 +1,15 @@
+import contextlib
 import datetime
+import threading
 
 import pytest
 
-from config import load_settings
+from config import MailboxTarget, load_settings
 import planner_agent
+from graph_client import GraphError
+from metrics import RequestMetrics
 from planner_agent import PlannerAgent
+from retention import KeepLatestRule, MaxAgeRule, RetentionPolicy
 
 
 @pytest.fixture
@@ -24,14 +29,30 @@ def env_vars(monkeypatch):
     monkeypatch.setenv("MAX_DELETE_PER_RUN", "500")
     monkeypatch.setenv("CLEANUP_TIME_BUDGET_SECONDS", "10")
     monkeypatch.setenv("AUTH_MODE", "app")
+    monkeypatch.setenv("TOPOLOGY_CACHE_PATH", "")
+    monkeypatch.setenv("CLEANUP_CURSOR_PATH", "")
+    monkeypatch.setenv("USER_ID_CACHE_PATH", "")
     # Stub GraphClient to avoid real network calls during PlannerAgent init.
     class _DummyGraphClient:
+        cassette = None
+
         def __init__(self, *_args, **_kwargs):
             pass
+
+        def coalesce(self):
+            return contextlib.nullcontext()
     monkeypatch.setattr(planner_agent, "GraphClient", _DummyGraphClient)
     yield
 
 
+def _record_deletes(deleted):
+    def delete_tasks(tasks):
+        deleted.extend(task_id for task_id, _etag in tasks)
+        return [None] * len(tasks)
+
+    return delete_tasks
+
+
 @pytest.fixture
 def agent(env_vars):
     settings = load_settings()
@@ -52,19 +73,23 @@ def test_cleanup_keepalive_duplicates_keeps_latest(monkeypatch, agent):
             "title": "old task",
             "createdDateTime": "2024-11-01T10:00:00Z",
             "@odata.etag": "etag-old",
+            "bucketId": "bucket-1",
         },
         {
             "id": "new",
             "title": "new task",
             "createdDateTime": "2024-11-02T10:00:00Z",
             "@odata.etag": "etag-new",
+            "bucketId": "bucket-1",
         },
     ]
     deleted = []
 
-    monkeypatch.setattr(agent, "list_buckets", lambda plan_id: buckets)
-    monkeypatch.setattr(agent, "list_tasks", lambda bucket_id: tasks)
-    monkeypatch.setattr(agent, "delete_task", lambda task_id, etag: deleted.append(task_id))
+    monkeypatch.setattr(agent, "iter_buckets", lambda plan_id: iter(buckets))
+    monkeypatch.setattr(
+        agent, "iter_plan_task_pages", lambda plan_id, resume_link=None: iter([(tasks, None)])
+    )
+    monkeypatch.setattr(agent, "delete_tasks", _record_deletes(deleted))
 
     removed = agent.cleanup_keepalive_duplicates(
         plan_title="邮箱检查", keep_latest=1, plan_context=plan_context
@@ -72,6 +97,7 @@ def test_cleanup_keepalive_duplicates_keeps_latest(monkeypatch, agent):
 
     assert deleted == ["old"]
     assert removed and removed[0]["task_id"] == "old"
+    assert removed[0]["bucket"] == "待办事项"
 
 
 def test_cleanup_previous_week_tasks_respects_age(monkeypatch, agent):
@@ -92,19 +118,23 @@ def test_cleanup_previous_week_tasks_respects_age(monkeypatch, agent):
             "title": "old task",
             "createdDateTime": week_ago.isoformat(),
             "@odata.etag": "etag-old",
+            "bucketId": "bucket-1",
         },
         {
             "id": "recent",
             "title": "recent task",
             "createdDateTime": recent.isoformat(),
             "@odata.etag": "etag-recent",
+            "bucketId": "bucket-1",
         },
     ]
     deleted = []
 
-    monkeypatch.setattr(agent, "list_buckets", lambda plan_id: buckets)
-    monkeypatch.setattr(agent, "list_tasks", lambda bucket_id: tasks)
-    monkeypatch.setattr(agent, "delete_task", lambda task_id, etag: deleted.append(task_id))
+    monkeypatch.setattr(agent, "iter_buckets", lambda plan_id: iter(buckets))
+    monkeypatch.setattr(
+        agent, "iter_plan_task_pages", lambda plan_id, resume_link=None: iter([(tasks, None)])
+    )
+    monkeypatch.setattr(agent, "delete_tasks", _record_deletes(deleted))
 
     removed = agent.cleanup_previous_week_tasks(
         plan_title="邮箱检查", plan_context=plan_context
@@ -112,3 +142,445 @@ def test_cleanup_previous_week_tasks_respects_age(monkeypatch, agent):
 
     assert deleted == ["old"]
     assert removed and removed[0]["task_id"] == "old"
+    assert removed[0]["bucket"] == "待办事项"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_find_plan_locates_target_across_groups(monkeypatch, agent, workers):
+    agent.settings.discovery_workers = workers
+    groups = [{"id": f"group-{index}", "displayName": f"G{index}"} for index in range(20)]
+    plans = {"group-13": [{"id": "plan-x", "title": "邮箱检查"}]}
+
+    monkeypatch.setattr(agent, "iter_groups", lambda: iter(groups))
+    monkeypatch.setattr(agent, "iter_plans", lambda group_id: iter(plans.get(group_id, [])))
+    monkeypatch.setattr(agent, "list_plans", lambda group_id: plans.get(group_id, []))
+
+    group, plan = agent.find_plan("邮箱检查")
+
+    assert group["id"] == "group-13"
+    assert plan["id"] == "plan-x"
+    assert agent.find_plan("missing") is None
+
+
+def test_concurrent_find_plan_returns_the_earliest_matching_group(monkeypatch, agent):
+    agent.settings.discovery_workers = 4
+    groups = [{"id": f"group-{index}"} for index in range(12)]
+    plan = [{"id": "plan-x", "title": "邮箱检查"}]
+    later_hit_seen = threading.Event()
+
+    def list_plans(group_id):
+        if group_id == "group-2":
+            # The earlier match only completes after a later group has already matched.
+            assert later_hit_seen.wait(timeout=5)
+            return plan
+        if group_id == "group-5":
+            later_hit_seen.set()
+            return plan
+        return []
+
+    monkeypatch.setattr(agent, "iter_groups", lambda: iter(groups))
+    monkeypatch.setattr(agent, "list_plans", list_plans)
+
+    group, _plan = agent.find_plan("邮箱检查")
+
+    assert group["id"] == "group-2"
+
+
+def test_topology_index_skips_discovery_and_recovers_from_stale_bucket(monkeypatch, agent):
+    agent.settings.discovery_workers = 1
+    calls = []
+    buckets = {"plan-1": [{"id": "bucket-1", "name": "待办事项"}]}
+
+    def iter_groups():
+        calls.append("groups")
+        return iter([{"id": "group-1", "displayName": "All Company"}])
+
+    def list_buckets(plan_id):
+        calls.append("buckets")
+        return buckets[plan_id]
+
+    def create_task(plan_id, bucket_id, title):
+        if bucket_id == "bucket-1":
+            raise GraphError("POST", "planner/tasks", 404, "bucket gone")
+        return {"id": "task-1"}
+
+    monkeypatch.setattr(agent, "iter_groups", iter_groups)
+    monkeypatch.setattr(
+        agent, "iter_plans", lambda group_id: iter([{"id": "plan-1", "title": "邮箱检查"}])
+    )
+    monkeypatch.setattr(agent, "list_buckets", list_buckets)
+    monkeypatch.setattr(agent, "create_task", create_task)
+
+    agent.ensure_plan_and_bucket("邮箱检查")
+    assert calls == ["groups", "buckets"]
+
+    calls.clear()
+    _, _, bucket = agent.ensure_plan_and_bucket("邮箱检查")
+    assert calls == []
+    assert bucket["id"] == "bucket-1"
+
+    buckets["plan-1"] = [{"id": "bucket-2", "name": "新桶"}]
+    monkeypatch.setattr(agent, "get_user_id", lambda _email=None: "user-1")
+    monkeypatch.setattr(agent, "inbox_overview", lambda user_id: {})
+    monkeypatch.setattr(agent, "inbox_recent_messages", lambda user_id, top: [])
+    result = agent.create_mailbox_summary_task("邮箱检查")
+
+    assert calls == ["buckets"]
+    assert result["bucket_id"] == "bucket-2"
+
+
+@pytest.mark.parametrize("details_accepted", [True, False])
+def test_summary_notes_are_written_with_the_task(monkeypatch, agent, details_accepted):
+    calls = []
+
+    class _Response:
+        def __init__(self, payload=None):
+            self._payload = payload or {}
+            self.text = "x" if payload else ""
+
+        def json(self):
+            return self._payload
+
+    class _Client:
+        def post(self, path, json):
+            calls.append(("POST", path, "details" in json))
+            if "details" in json and not details_accepted:
+                raise GraphError("POST", path, 400, "details not allowed")
+            return _Response({"id": "task-1"})
+
+        def get(self, path):
+            calls.append(("GET", path))
+            return _Response({"@odata.etag": "details-etag"})
+
+        def patch(self, path, headers, json):
+            calls.append(("PATCH", path, headers["If-Match"]))
+            return _Response()
+
+    agent.client = _Client()
+    monkeypatch.setattr(agent, "get_user_id", lambda _email=None: "user-1")
+    monkeypatch.setattr(agent, "inbox_overview", lambda user_id: {"unreadItemCount": 1, "totalItemCount": 3})
+    monkeypatch.setattr(agent, "inbox_recent_messages", lambda user_id, top: [])
+    monkeypatch.setattr(
+        agent,
+        "ensure_plan_and_bucket",
+        lambda title: ({"id": "g1"}, {"id": "plan-1", "title": title}, {"id": "b1", "name": "待办"}),
+    )
+
+    result = agent.create_mailbox_summary_task_with_notes("邮箱检查")
+
+    assert result["notes_written"] and result["task_id"] == "task-1"
+    if details_accepted:
+        assert calls == [("POST", "planner/tasks", True)]
+    else:
+        assert calls == [
+            ("POST", "planner/tasks", True),
+            ("POST", "planner/tasks", False),
+            ("GET", "planner/tasks/task-1/details"),
+            ("PATCH", "planner/tasks/task-1/details", "details-etag"),
+        ]
+
+
+def test_cleanup_resumes_from_saved_cursor(monkeypatch, agent):
+    agent.settings.max_delete_per_run = 2
+    plan_context = {"plan_id": "plan-1", "plan": "邮箱检查", "group": "All Company"}
+    old = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).isoformat()
+    pages = {
+        None: ([{"id": f"t{i}", "createdDateTime": old, "@odata.etag": "e"} for i in range(3)], "link-2"),
+        "link-2": ([{"id": f"t{i}", "createdDateTime": old, "@odata.etag": "e"} for i in range(3, 5)], None),
+    }
+    requested = []
+    deleted = []
+
+    def iter_plan_task_pages(plan_id, resume_link=None):
+        link = resume_link
+        while True:
+            requested.append(link)
+            tasks, next_link = pages[link]
+            yield [task for task in tasks if task["id"] not in deleted], next_link
+            if not next_link:
+                return
+            link = next_link
+
+    monkeypatch.setattr(agent, "iter_buckets", lambda plan_id: iter([]))
+    monkeypatch.setattr(agent, "iter_plan_task_pages", iter_plan_task_pages)
+    monkeypatch.setattr(agent, "delete_tasks", _record_deletes(deleted))
+
+    runs = [agent.cleanup_previous_week_tasks(plan_context=plan_context) for _ in range(3)]
+
+    assert [len(removed) for removed in runs] == [2, 2, 1]
+    assert deleted == ["t0", "t1", "t2", "t3", "t4"]
+    # The second run picks up the cap overflow (t2) and resumes on page one, the
+    # third resumes directly on page two.
+    assert requested == [None, None, "link-2", "link-2"]
+
+
+def test_cleanup_deletes_chunks_while_listing_continues(monkeypatch, agent):
+    plan_context = {"plan_id": "plan-1", "plan": "邮箱检查", "group": "All Company"}
+    old = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).isoformat()
+    last_page_listed = threading.Event()
+    deleted = []
+
+    def iter_plan_task_pages(plan_id, resume_link=None):
+        for page in range(3):
+            tasks = [{"id": f"t{page}-{i}", "createdDateTime": old, "@odata.etag": "e"} for i in range(20)]
+            if page == 2:
+                last_page_listed.set()
+            yield tasks, (f"link-{page + 1}" if page < 2 else None)
+
+    def delete_tasks(tasks):
+        # Deleting inline would block listing here; the pipeline keeps listing meanwhile.
+        assert last_page_listed.wait(timeout=5)
+        deleted.extend(task_id for task_id, _etag in tasks)
+        return [None] * len(tasks)
+
+    monkeypatch.setattr(agent, "iter_buckets", lambda plan_id: iter([]))
+    monkeypatch.setattr(agent, "iter_plan_task_pages", iter_plan_task_pages)
+    monkeypatch.setattr(agent, "delete_tasks", delete_tasks)
+
+    removed = agent.cleanup_previous_week_tasks(plan_context=plan_context)
+
+    assert len(removed) == 60
+    assert sorted(deleted) == sorted(f"t{page}-{i}" for page in range(3) for i in range(20))
+
+
+def test_retention_rediscovers_a_cached_plan_that_was_deleted(monkeypatch, agent):
+    plan_context = {"plan_id": "plan-gone", "plan": "邮箱检查", "group": "All Company", "group_id": "g1"}
+    agent.topology.put("邮箱检查", {"id": "g1"}, {"id": "plan-gone", "title": "邮箱检查"})
+    old = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).isoformat()
+    deleted = []
+
+    def iter_buckets(plan_id):
+        if plan_id == "plan-gone":
+            raise GraphError("GET", f"planner/plans/{plan_id}/buckets", 404, "plan not found")
+        return iter([])
+
+    monkeypatch.setattr(agent, "iter_buckets", iter_buckets)
+    monkeypatch.setattr(
+        agent, "_discover_plan", lambda title: ({"id": "g2"}, {"id": "plan-new", "title": title})
+    )
+    monkeypatch.setattr(
+        agent,
+        "iter_plan_task_pages",
+        lambda plan_id, resume_link=None: iter(
+            [([{"id": f"{plan_id}-t", "createdDateTime": old, "@odata.etag": "e"}], None)]
+        ),
+    )
+    monkeypatch.setattr(agent, "delete_tasks", _record_deletes(deleted))
+
+    removed = agent.cleanup_previous_week_tasks(plan_context=plan_context)
+
+    assert deleted == ["plan-new-t"]
+    assert [item["plan"] for item in removed] == ["邮箱检查"]
+    assert agent.topology.lookup("邮箱检查")[1]["id"] == "plan-new"
+
+
+def test_task_pages_fall_back_when_select_is_rejected(agent):
+    calls = []
+
+    def iter_page_links(path, params=None, resume_link=None):
+        calls.append(params)
+        if params and "$select" in params:
+            raise GraphError("GET", path, 400, "Invalid $select")
+        yield [{"id": "t1"}], None
+
+    agent.client.iter_page_links = iter_page_links
+
+    assert list(agent.iter_plan_task_pages("plan-1")) == [([{"id": "t1"}], None)]
+    assert list(agent.iter_plan_task_pages("plan-1")) == [([{"id": "t1"}], None)]
+    # Only the first listing tries the projection; later ones go straight to full tasks.
+    assert calls == [{"$select": "id,title,createdDateTime,bucketId"}, None, None]
+
+
+def test_cleanup_cursor_is_kept_per_sweep_and_expires(monkeypatch, agent):
+    agent.settings.max_delete_per_run = 2
+    plan_context = {"plan_id": "plan-1", "plan": "邮箱检查", "group": "All Company"}
+    old = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).isoformat()
+    tasks = [{"id": f"t{i}", "title": "keepalive", "createdDateTime": old, "@odata.etag": "e"} for i in range(5)]
+    deleted = []
+    monkeypatch.setattr(agent, "iter_buckets", lambda plan_id: iter([]))
+    monkeypatch.setattr(
+        agent,
+        "iter_plan_task_pages",
+        lambda plan_id, resume_link=None: iter([([task for task in tasks if task["id"] not in deleted], None)]),
+    )
+    monkeypatch.setattr(agent, "delete_tasks", _record_deletes(deleted))
+
+    # Keepalive sweeps change rules between cycles; both save under the same key.
+    for rules in ([KeepLatestRule(keep=1), MaxAgeRule(max_age_days=7)], [MaxAgeRule(max_age_days=7)]):
+        agent.apply_retention(RetentionPolicy(rules, 2, "keepalive"), plan_context=plan_context)
+    assert list(agent.cleanup_cursor._cursors) == ["plan-1:keepalive"]
+    saved_rules = agent.cleanup_cursor.load("plan-1:keepalive")["rules"]
+    assert saved_rules == RetentionPolicy([MaxAgeRule(max_age_days=7)]).signature()
+
+    agent.cleanup_cursor.ttl_seconds = 60
+    agent.cleanup_cursor._cursors["plan-1:keepalive"]["updated_at"] -= 120
+    assert agent.cleanup_cursor.load("plan-1:keepalive") == {}
+    agent.cleanup_cursor.save("plan-2:keepalive", {"next_link": "link"})
+    assert list(agent.cleanup_cursor._cursors) == ["plan-2:keepalive"]
+
+
+def test_keepalive_daemon_reuses_agent_and_never_overlaps(monkeypatch, env_vars):
+    monkeypatch.setenv("DAEMON_INTERVAL_SECONDS", "0")
+    monkeypatch.setenv("DAEMON_JITTER_SECONDS", "0")
+
+    class _Session:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    class _Client:
+        cassette = None
+
+        def __init__(self, *_args, **_kwargs):
+            self.http_client = _Session()
+
+        def close(self):
+            self.http_client.close()
+
+    monkeypatch.setattr(planner_agent, "GraphClient", _Client)
+    agents = []
+    running = []
+    stop = planner_agent.threading.Event()
+
+    def fake_cycle(agent):
+        assert not running, "cycles overlapped"
+        running.append(agent)
+        agents.append(agent)
+        try:
+            if len(agents) == 2:
+                raise RuntimeError("transient failure")
+            if len(agents) == 3:
+                stop.set()  # what the SIGTERM handler does
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(planner_agent, "run_keepalive_cycle", fake_cycle)
+    cycles = planner_agent.run_keepalive_daemon(load_settings(), stop_event=stop)
+
+    assert cycles == 3
+    assert len({id(agent) for agent in agents}) == 1
+    assert agents[0].client.http_client.closed
+
+
+def test_keepalive_processes_mailbox_file_with_isolated_failures(monkeypatch, tmp_path, agent):
+    mailbox_file = tmp_path / "mailboxes.txt"
+    mailbox_file.write_text(
+        "# mailbox[,plan]\na@example.com\nb@example.com,团队检查\n\nbroken@example.com\na@example.com\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(agent.settings, "mailboxes_file", str(mailbox_file))
+    monkeypatch.setattr(agent.settings, "enable_old_cleanup", False)
+    agent.client.metrics = RequestMetrics()
+    resolved = []
+    monkeypatch.setattr(agent, "ensure_plan_and_bucket", resolved.append)
+    monkeypatch.setattr(agent, "resolve_user_ids", lambda emails: {})
+    monkeypatch.setattr(agent, "export_metrics", lambda: None)
+
+    def fake_summary(plan_title, recent_top, user_email, title_prefix):
+        if user_email.startswith("broken"):
+            raise RuntimeError("mailbox not found")
+        return {
+            "mailbox": user_email,
+            "plan": plan_title,
+            "plan_id": f"plan-{plan_title}",
+            "group": "g",
+            "group_id": "g1",
+            "title": f"{title_prefix}-now",
+            "unread": 1,
+            "total": 2,
+        }
+
+    policies = {}
+
+    def fake_retention(policy, plan_title, plan_context):
+        policies[plan_title] = policy
+        return []
+
+    monkeypatch.setattr(agent, "create_mailbox_summary_task_with_notes", fake_summary)
+    monkeypatch.setattr(agent, "apply_retention", fake_retention)
+
+    results = planner_agent.run_keepalive_cycle(agent=agent)
+
+    assert [(result["mailbox"], result["ok"]) for result in results] == [
+        ("a@example.com", True),
+        ("b@example.com", True),
+        ("broken@example.com", False),
+    ]
+    assert resolved == ["邮箱检查", "团队检查"]
+    assert [rule.title_prefix for rule in policies["邮箱检查"].rules] == [
+        "邮箱检查-a@example.com-",
+        "邮箱检查-broken@example.com-",
+    ]
+    assert [rule.title_prefix for rule in policies["团队检查"].rules] == ["团队检查-b@example.com-"]
+
+
+def test_mailboxes_of_an_unresolved_plan_fail_without_being_dispatched(monkeypatch, agent):
+    monkeypatch.setattr(agent.settings, "enable_old_cleanup", False)
+    agent.client.metrics = RequestMetrics()
+    monkeypatch.setattr(agent, "resolve_user_ids", lambda emails: {})
+    monkeypatch.setattr(agent, "export_metrics", lambda: None)
+    monkeypatch.setattr(agent, "apply_retention", lambda policy, plan_title, plan_context: [])
+
+    def ensure_plan_and_bucket(plan_title):
+        if plan_title == "团队检查":
+            raise GraphError("GET", "groups", 503, "unavailable")
+
+    summarised = []
+
+    def fake_summary(plan_title, recent_top, user_email, title_prefix):
+        summarised.append(user_email)
+        return {"mailbox": user_email, "plan": plan_title, "plan_id": "p", "title": "t", "unread": 0, "total": 0}
+
+    monkeypatch.setattr(agent, "ensure_plan_and_bucket", ensure_plan_and_bucket)
+    monkeypatch.setattr(agent, "create_mailbox_summary_task_with_notes", fake_summary)
+    mailboxes = [
+        MailboxTarget("a@example.com", "邮箱检查"),
+        MailboxTarget("b@example.com", "团队检查"),
+        MailboxTarget("c@example.com", "团队检查"),
+    ]
+
+    results = planner_agent.run_keepalive_cycle(agent=agent, mailboxes=mailboxes)
+
+    assert summarised == ["a@example.com"]
+    assert [(result["mailbox"], result["ok"]) for result in results] == [
+        ("a@example.com", True),
+        ("b@example.com", False),
+        ("c@example.com", False),
+    ]
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_delete_all_planner_groups_probes_concurrently_and_deletes_in_batches(
+    monkeypatch, agent, dry_run
+):
+    groups = [{"id": f"g{i}", "displayName": f"Group {i}"} for i in range(50)]
+
+    def list_plans(group_id):
+        index = int(group_id[1:])
+        if index == 7:
+            raise GraphError("GET", f"groups/{group_id}/planner/plans", 403, "forbidden")
+        return [{"id": f"p{index}"}] if index % 2 == 0 else []
+
+    chunks = []
+
+    def delete_groups(ids):
+        chunks.append(list(ids))
+        return [RuntimeError("locked") if group_id == "g10" else None for group_id in ids]
+
+    monkeypatch.setattr(agent, "iter_groups", lambda: iter(groups))
+    monkeypatch.setattr(agent, "list_plans", list_plans)
+    monkeypatch.setattr(agent, "delete_groups", delete_groups)
+
+    results = []
+    returned = agent.delete_all_planner_groups(dry_run=dry_run, results=results)
+
+    assert returned is results
+    expected = {f"g{i}" for i in range(0, 50, 2)}
+    if dry_run:
+        assert chunks == []
+        assert {item["group_id"] for item in results} == expected
+        assert all(item["dry_run"] for item in results)
+    else:
+        assert sorted(len(chunk) for chunk in chunks) == [5, 20]
+        assert {item["group_id"] for item in results} == expected - {"g10"}
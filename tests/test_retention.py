@@ -0,0 +1,52 @@
+import datetime
+
+from retention import KeepLatestRule, MaxAgeRule, RetentionEngine, RetentionPolicy
+
+
+def _task(task_id, created, title="邮箱检查-task"):
+    return {"id": task_id, "title": title, "createdDateTime": created, "@odata.etag": f"etag-{task_id}"}
+
+
+def test_engine_merges_rules_in_one_pass_and_caps_deletions():
+    now = datetime.datetime(2024, 11, 20, tzinfo=datetime.timezone.utc)
+    policy = RetentionPolicy(
+        [KeepLatestRule(keep=1, title_prefix="邮箱检查"), MaxAgeRule(max_age_days=7)],
+        max_deletes=3,
+    )
+    engine = RetentionEngine(policy, now=now)
+    tasks = [
+        _task("ancient", "2024-11-01T10:00:00Z"),
+        _task("other-old", "2024-11-02T10:00:00.1234567Z", title="manual"),
+        _task("dup-1", "2024-11-18T10:00:00Z"),
+        _task("latest", "2024-11-19T12:00:00+02:00"),
+        _task("dup-2", "2024-11-19T09:00:00.5Z"),
+    ]
+
+    planned = [
+        (item["task_id"], item["reason"]) for task in tasks for item in engine.feed(task, "桶")
+    ]
+
+    # "ancient" is later evicted from the keep-latest heap but is scheduled only
+    # once; "latest" (+02:00) outranks dup-2, which then hits the cap.
+    assert planned == [("ancient", "过期"), ("other-old", "过期"), ("dup-1", "重复")]
+    assert engine.capped
+    assert [record.task_id for record in engine.kept()] == ["latest"]
+
+
+def test_engine_tracks_no_per_task_state_for_uncapped_deletions():
+    now = datetime.datetime(2024, 11, 20, tzinfo=datetime.timezone.utc)
+    policy = RetentionPolicy(
+        [KeepLatestRule(keep=1), KeepLatestRule(keep=1, title_prefix="邮箱检查"), MaxAgeRule(max_age_days=7)]
+    )
+    engine = RetentionEngine(policy, now=now)
+    engine.schedule([{"task_id": "restored", "reason": "重复"}])
+    tasks = [_task(f"old-{index}", f"2024-11-01T10:00:{index:02d}Z") for index in range(50)]
+    tasks += [_task("restored", "2024-11-02T10:00:00Z"), _task("latest", "2024-11-19T10:00:00Z")]
+
+    planned = [item["task_id"] for task in tasks for item in engine.feed(task)]
+
+    # Each old task sits in both heaps and is past max age, yet is planned once.
+    assert planned == [f"old-{index}" for index in range(50)]
+    assert not engine.capped
+    assert engine._restored == {"restored"}
+    assert [record.task_id for record in engine.kept()] == ["latest", "latest"]
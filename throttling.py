@@ -0,0 +1,217 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Mapping, Optional
+
+# Graph answers these when it is throttling or briefly unavailable; the request
+# was not processed, so it is safe to send it again.
+RETRYABLE_STATUS = {429, 503, 504}
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not headers:
+        return None
+    value = None
+    for key, item in headers.items():
+        if key.lower() == "retry-after":
+            value = item
+            break
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Honour Retry-After when given (plus a little jitter so parallel callers do not
+    return in lockstep); otherwise exponential backoff with full jitter.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket (rate_per_second, 0 = unlimited) combined with an AIMD concurrency
+    window shared by every thread using one GraphClient: each successful call widens
+    the window by about one slot per window's worth of calls, each throttle halves it
+    and Retry-After pauses all callers.
+    """
+
+    def __init__(self, rate_per_second: float, max_concurrency: int):
+        self.rate = rate_per_second
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self._tokens = max(1.0, rate_per_second)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0 and self._in_flight < int(self.concurrency):
+                    if self.rate <= 0:
+                        break
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+                # No timeout when only the concurrency window is full: release() wakes us.
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self._in_flight += 1
+
+    def try_acquire_spare(self) -> bool:
+        """
+        Take an extra slot without waiting, e.g. for a hedged duplicate. Only granted
+        while the window is fully open (nothing throttled recently) and a slot is free.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if (
+                now < self._paused_until
+                or self.concurrency < self.max_concurrency
+                or self._in_flight >= self.max_concurrency
+            ):
+                return False
+            if self.rate > 0:
+                self._refill(now)
+                if self._tokens < 1:
+                    return False
+                self._tokens -= 1
+            self._in_flight += 1
+            return True
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._throttled(retry_after)
+            else:
+                self.concurrency = min(
+                    float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency
+                )
+            self._cond.notify_all()
+
+    def record_throttle(self, retry_after: Optional[float] = None) -> None:
+        """Throttle signal that did not come from a slot holder, e.g. a $batch sub-response."""
+        with self._cond:
+            self._throttled(retry_after)
+            self._cond.notify_all()
+
+    def _throttled(self, retry_after: Optional[float]) -> None:
+        self.concurrency = max(1.0, self.concurrency / 2)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+class LatencyTracker:
+    """Recent successful-call latencies per endpoint, for picking a hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, key: str, percentile: float) -> Optional[float]:
+        """The given percentile of recent latencies, or None until there are enough samples."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))
+        return ordered[index]
+
+
+class _Circuit:
+    __slots__ = ("failures", "opened_at", "probing")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker: `failure_threshold` consecutive failures (transport errors
+    or 5xx) open the circuit and calls fail fast; after `cooldown_seconds` a single
+    probe is let through, closing the circuit on success and re-opening it on
+    failure. A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.opened_at is None:
+                return True
+            if circuit.probing or time.monotonic() - circuit.opened_at < self.cooldown_seconds:
+                return False
+            circuit.probing = True
+            return True
+
+    def release_probe(self, key: str) -> None:
+        """Give up a probe that ended without an outcome, so the next call may probe."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None:
+                circuit.probing = False
+
+    def record(self, key: str, healthy: bool) -> bool:
+        """Record one outcome; returns True when this failure opened the circuit."""
+        if self.failure_threshold <= 0:
+            return False
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                if healthy:
+                    return False
+                circuit = self._circuits[key] = _Circuit()
+            was_open = circuit.opened_at is not None
+            circuit.probing = False
+            if healthy:
+                circuit.failures = 0
+                circuit.opened_at = None
+                return False
+            circuit.failures += 1
+            if was_open or circuit.failures >= self.failure_threshold:
+                circuit.opened_at = time.monotonic()
+            return not was_open and circuit.opened_at is not None